@@ -14,13 +14,21 @@ from .sphere import HealpixSphere, HealpixSubSphere, create_fov
 from .sphere_mesh import AdaptiveMeshSphere, area
 from .telescope_operator import (
     TelescopeOperator,
+    NaturalPosterior,
     normal_svd,
     dask_svd,
     plot_spectrum,
     plot_uv,
 )
 from .draw_sky import mask_to_sky
-from .ms_helper import read_ms
+from .ms_helper import read_ms, read_ms_cube, read_ms_parallel
+from .vis_cache import VisibilityCache
+from .ms_predict import write_model_data
 from .projection_lsqr import plsqr
-from .multivariate_gaussian import MultivariateGaussian
+from .multivariate_gaussian import MultivariateGaussian, ChunkedMultivariateGaussian
+from .noise_covariance import StructuredNoiseCovariance
+from .matrix_free_posterior import MatrixFreePosterior, DiagonalPrecision, conjugate_gradient
+from .gmrf import GMRFPrior
+from .evidence import EvidenceOptimizer
+from .bootstrap import block_cgls, bootstrap
 from .resolution import Resolution
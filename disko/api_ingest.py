@@ -0,0 +1,188 @@
+#
+# Fetch snapshots from the web api of a TART radio telescope with asyncio.
+#
+# The vis endpoint is polled, and the visibilities and gains are fetched concurrently.
+# Each calibrated snapshot is put on a bounded queue, so the next snapshot is
+# downloaded while the current one is imaged, and the ingester waits when the
+# imaging falls behind. The blocking urllib requests run in threads.
+#
+import asyncio
+import json
+import logging
+import queue
+import threading
+import urllib.parse
+import urllib.request
+
+from tart.operation import settings
+from tart.util import utc
+from tart_tools import api_imaging
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    logging.NullHandler()
+)  # Add other handlers if you're using this as a library
+logger.setLevel(logging.INFO)
+
+
+def fetch_json(url, timeout=15.0):
+    """
+    Download and decode the JSON document at url
+    """
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+class ApiIngester:
+    """
+    Snapshots (cal_vis, timestamp, source_json) from the TART api at api_root.
+    If catalog is not None, source_json is the catalog of sources at the time of
+    each snapshot, otherwise it is None.
+    """
+
+    def __init__(self, api_root, catalog=None, queue_size=2, interval=1.0, timeout=15.0):
+        self.root = api_root
+        self.catalog = catalog
+        self.queue_size = queue_size
+        self.interval = interval
+        self.timeout = timeout
+        self._config = None
+
+    def url(self, path):
+        return "{}/api/v1/{}".format(self.root, path)
+
+    async def get_url(self, url):
+        return await asyncio.to_thread(fetch_json, url, self.timeout)
+
+    async def get(self, path):
+        return await self.get_url(self.url(path))
+
+    async def config(self):
+        """
+        The telescope settings, fetched once
+        """
+        if self._config is None:
+            info, ant_pos = await asyncio.gather(
+                self.get("info"), self.get("imaging/antenna_positions")
+            )
+            self._config = settings.from_api_json(info["info"], ant_pos)
+        return self._config
+
+    async def sources(self, config, timestamp):
+        if self.catalog is None:
+            return None
+        query = urllib.parse.urlencode(
+            {"lat": config.get_lat(), "lon": config.get_lon(), "date": utc.to_string(timestamp)}
+        )
+        return await self.get_url("{}/catalog?{}".format(self.catalog, query))
+
+    async def calibrate(self, vis_json, gains=None):
+        """
+        Calibrate vis_json with the gains (fetched if they are None), and get its sources
+        """
+        config = await self.config()
+        if gains is None:
+            gains = await self.get("calibration/gain")
+
+        timestamp = api_imaging.vis_json_timestamp(vis_json)
+        source_json = await self.sources(config, timestamp)
+        cv, timestamp = api_imaging.vis_calibrated(
+            vis_json, config, gains["gain"], gains["phase_offset"], flag_list=[]
+        )
+        return cv, timestamp, source_json
+
+    async def produce(self, put, n_frames=None):
+        """
+        Poll the vis endpoint every interval seconds, and await put(snapshot) for
+        each new snapshot. Stops after n_frames snapshots (if it is not None).
+        """
+        await self.config()
+        last = None
+        count = 0
+        while n_frames is None or count < n_frames:
+            vis_json, gains = await asyncio.gather(
+                self.get("imaging/vis"), self.get("calibration/gain")
+            )
+            if vis_json["timestamp"] == last:
+                await asyncio.sleep(self.interval)
+                continue
+            last = vis_json["timestamp"]
+
+            snapshot = await self.calibrate(vis_json, gains)
+            logger.info("Snapshot {} at {}".format(count, snapshot[1]))
+            await put(snapshot)
+            count += 1
+
+    async def frames(self, n_frames=None):
+        """
+        Asynchronously iterate over the snapshots, with up to queue_size of them
+        fetched ahead of the consumer.
+        """
+        q = asyncio.Queue(maxsize=self.queue_size)
+        done = object()
+
+        async def producer():
+            try:
+                await self.produce(q.put, n_frames)
+            finally:
+                await q.put(done)
+
+        task = asyncio.create_task(producer())
+        try:
+            while True:
+                snapshot = await q.get()
+                if snapshot is done:
+                    break
+                yield snapshot
+            await task  # Raise any error from the producer
+        finally:
+            task.cancel()
+
+    def iterate(self, n_frames=None):
+        """
+        Iterate over the snapshots from a synchronous loop. The ingester runs in
+        a background thread with its own event loop, and fills a queue of at most
+        queue_size snapshots while the caller is working.
+        """
+        q = queue.Queue(maxsize=self.queue_size)
+        done = object()
+        stop = threading.Event()
+        errors = []
+
+        async def put(snapshot):
+            while not stop.is_set():
+                try:
+                    await asyncio.to_thread(q.put, snapshot, True, 0.1)
+                    return
+                except queue.Full:
+                    pass
+            raise asyncio.CancelledError()
+
+        def run():
+            try:
+                asyncio.run(self.produce(put, n_frames))
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                errors.append(e)
+            finally:
+                while not stop.is_set():
+                    try:
+                        q.put(done, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            while True:
+                snapshot = q.get()
+                if snapshot is done:
+                    break
+                yield snapshot
+            if errors:
+                raise errors[0]
+        finally:
+            stop.set()
+            thread.join()
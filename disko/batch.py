@@ -0,0 +1,110 @@
+#
+# Image many files in one process pool.
+#
+# The files are read by the workers, and their snapshots grouped by array geometry
+# and frequency (DiSkO.geometry_key). Each group is split into one contiguous run of
+# snapshots per worker, so the operator (or Tikhonov projection) of a group is built
+# at most once per worker rather than once per file.
+#
+import glob
+import logging
+import collections
+import concurrent.futures
+
+import numpy as np
+
+from .daemon import ImagingDaemon
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    logging.NullHandler()
+)  # Add other handlers if you're using this as a library
+logger.setLevel(logging.INFO)
+
+
+def expand_paths(paths):
+    """
+    Expand any glob patterns in the list of paths (keeping the order given).
+    """
+    ret = []
+    for p in paths:
+        matches = sorted(glob.glob(p))
+        if len(matches) == 0:
+            raise RuntimeError("No files match {}".format(p))
+        ret += matches
+    return ret
+
+
+def group_by_geometry(snapshots):
+    """
+    Group the (path, dsko) pairs by dsko.geometry_key(), in order of first appearance
+    """
+    groups = collections.OrderedDict()
+    for path, dsko in snapshots:
+        groups.setdefault(dsko.geometry_key(), []).append((path, dsko))
+    return groups
+
+
+_daemon = None
+
+
+def _init_worker(sphere, options):
+    global _daemon
+    _daemon = ImagingDaemon(sphere, **options)
+
+
+def _read(path):
+    return [(path, dsko) for dsko in _daemon.read(path)]
+
+
+def _image(snapshots):
+    return [_daemon.image(dsko) for path, dsko in snapshots]
+
+
+class BatchImager:
+    """
+    Image every snapshot of a list of files with workers processes. The options
+    (method, alpha, niter, num_vis, channel, field_id, cache) are those of
+    ImagingDaemon. With workers=1 everything is done in this process.
+    """
+
+    def __init__(self, sphere, workers=1, **options):
+        self.sphere = sphere
+        self.workers = workers
+        self.options = options
+
+    def run(self, paths):
+        """
+        Yield (path, dsko, sky) for each snapshot, group by group
+        """
+        if self.workers == 1:
+            _init_worker(self.sphere, self.options)
+            yield from self._run(paths, map)
+            return
+
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker,
+            initargs=(self.sphere, self.options)
+        ) as pool:
+            yield from self._run(paths, pool.map)
+
+    def _run(self, paths, map_fn):
+        snapshots = [s for read in map_fn(_read, paths) for s in read]
+        groups = group_by_geometry(snapshots)
+        logger.info(
+            "Batch of {} files, {} snapshots in {} geometry groups".format(
+                len(paths), len(snapshots), len(groups)
+            )
+        )
+
+        chunks = []
+        for group in groups.values():
+            n_chunks = min(self.workers, len(group))
+            chunks += [
+                [group[i] for i in part]
+                for part in np.array_split(np.arange(len(group)), n_chunks)
+            ]
+
+        for chunk, skies in zip(chunks, map_fn(_image, chunks)):
+            for (path, dsko), sky in zip(chunk, skies):
+                yield path, dsko, sky
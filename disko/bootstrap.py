@@ -0,0 +1,149 @@
+#
+# Bootstrap uncertainty estimates for the regularized (point estimate) images.
+#
+# All K replicas are solved together with a block CGLS, so that each iteration
+# needs one block product with the operator and one with its adjoint. For the
+# DiSkOOperator these share the harmonic evaluations between replicas.
+#
+import logging
+
+import numpy as np
+import scipy.sparse.linalg as spalg
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    logging.NullHandler()
+)  # Add other handlers if you're using this as a library
+logger.setLevel(logging.INFO)
+
+
+def block_cgls(A, B, damp=0.0, weights=None, niter=100, tol=1e-6):
+    """
+    Solve the K damped, weighted least squares problems
+
+        min_x ||W_k^(1/2) (A x_k - b_k)||^2 + damp^2 ||x_k||^2
+
+    together, where b_k are the columns of B (M x K), and the diagonal weights
+    W_k are the columns of weights (M x K, default all ones). A must support
+    A @ X and A.H @ Y for blocks X and Y.
+
+    Each replica has its own CGLS step lengths, so the result is the same as K
+    separate solves. Returns the solutions X (N x K) and the number of iterations.
+    """
+    A = spalg.aslinearoperator(A)
+    M, K = B.shape
+    N = A.shape[1]
+
+    if weights is None:
+        S = np.ones((M, K))
+    else:
+        S = np.sqrt(weights)
+
+    damp2 = damp * damp
+
+    X = np.zeros((N, K))
+    R = S * B
+    G = A.H @ (S * R)
+    P = G.copy()
+    gamma = np.sum(G * G, axis=0)
+    gamma_0 = np.sqrt(np.max(gamma))
+
+    for k in range(niter):
+        if gamma_0 == 0 or np.sqrt(np.max(gamma)) < tol * gamma_0:
+            break
+
+        Q = S * (A @ P)
+        delta = np.sum(Q * Q, axis=0) + damp2 * np.sum(P * P, axis=0)
+        a = np.divide(gamma, delta, out=np.zeros(K), where=(delta > 0))
+
+        X = X + a * P
+        R = R - a * Q
+        G = A.H @ (S * R) - damp2 * X
+
+        gamma_new = np.sum(G * G, axis=0)
+        beta = np.divide(gamma_new, gamma, out=np.zeros(K), where=(gamma > 0))
+        P = G + beta * P
+        gamma = gamma_new
+
+    logger.info(
+        "block_cgls: K={}, {} iterations, max |g|/|g_0| = {:g}".format(
+            K, k + 1, np.sqrt(np.max(gamma)) / max(gamma_0, 1e-300)
+        )
+    )
+    return X, k + 1
+
+
+def centred_operator(A):
+    """
+    The operator A - 1 c^T, whose columns are the columns of A less their means c.
+    This is the operator of a least squares fit with an intercept (as the ridge fit of
+    image_tikhonov). Block products are passed through to A.
+    """
+    A = spalg.aslinearoperator(A)
+    M, N = A.shape
+    c = (A.H @ np.ones(M)) / M
+
+    def matmat(X):
+        return A @ X - np.tensordot(c, X, axes=1)
+
+    def rmatmat(Y):
+        return A.H @ Y - np.multiply.outer(c, np.sum(Y, axis=0))
+
+    return spalg.LinearOperator(
+        (M, N), matvec=matmat, rmatvec=rmatmat, matmat=matmat, rmatmat=rmatmat,
+        dtype=np.float64
+    )
+
+
+def resample_weights(n_vis, n_replicas, rng):
+    """
+    Bootstrap weights for the real data vector [re, im] of n_vis complex visibilities.
+    Each replica draws n_vis visibilities with replacement. The weight of a visibility is
+    the number of times it was drawn, and is shared by its real and imaginary parts.
+    """
+    counts = rng.multinomial(n_vis, np.ones(n_vis) / n_vis, size=n_replicas).T
+    return np.concatenate((counts, counts)).astype(np.float64)
+
+
+def bootstrap(
+    A, d, n_replicas, damp=0.0, method="resample", niter=100, seed=None, centre=False
+):
+    """
+    Bootstrap the damped least squares solution of A x = d.
+
+    method="resample": Resample the visibilities with replacement.
+    method="noise":    Add Gaussian noise to the data, with the standard deviation
+                       of the residuals of the solution for the original data.
+
+    If centre is True, the columns of A and the data are centred (see centred_operator),
+    which is the ridge fit with an intercept of image_tikhonov with damp = sqrt(alpha).
+
+    Returns the mean and standard deviation of the K replica solutions.
+    """
+    logger.info(
+        "bootstrap(n_replicas={}, damp={}, method={})".format(n_replicas, damp, method)
+    )
+    if n_replicas < 2:
+        raise ValueError("At least two bootstrap replicas are needed")
+
+    rng = np.random.default_rng(seed)
+    d = np.asarray(d).flatten()
+    M = d.shape[0]
+    if centre:
+        A = centred_operator(A)
+        d = d - np.mean(d)
+
+    if method == "resample":
+        weights = resample_weights(M // 2, n_replicas, rng)
+        B = np.tile(d.reshape(-1, 1), (1, n_replicas))
+    elif method == "noise":
+        x_0, _ = block_cgls(A, d.reshape(-1, 1), damp=damp, niter=niter)
+        sigma = np.std(d - A @ x_0[:, 0])
+        logger.info("Residual standard deviation {:g}".format(sigma))
+        weights = None
+        B = d.reshape(-1, 1) + rng.normal(0, sigma, (M, n_replicas))
+    else:
+        raise ValueError("Unknown bootstrap method {}".format(method))
+
+    X, _ = block_cgls(A, B, damp=damp, weights=weights, niter=niter)
+    return np.mean(X, axis=1), np.std(X, axis=1, ddof=1)
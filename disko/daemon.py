@@ -0,0 +1,164 @@
+#
+# A long running imaging process, for files that arrive one at a time.
+#
+# The sphere is created once, and the imager for each array geometry (the Tikhonov
+# projection, or the operator and the last LSQR solution) is kept between files, so
+# each new file costs one read and one solve. Paths come from a watched directory,
+# or one per line from a stream such as stdin.
+#
+import os
+import time
+import logging
+import collections
+
+from .disko import DiSkO
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    logging.NullHandler()
+)  # Add other handlers if you're using this as a library
+logger.setLevel(logging.INFO)
+
+
+def watch_paths(directory, interval=1.0, settle=2.0, suffixes=(".ms", ".json", ".h5")):
+    """
+    Yield each entry of directory with one of the suffixes, in name order, once it
+    has not been modified for settle seconds (so it has been completely written).
+    The directory is checked every interval seconds, forever.
+    """
+    seen = set()
+    while True:
+        now = time.time()
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if path in seen or not name.endswith(tuple(suffixes)):
+                continue
+            if now - latest_mtime(path) < settle:
+                continue
+            seen.add(path)
+            yield path
+        time.sleep(interval)
+
+
+def latest_mtime(path):
+    """
+    The latest modification time of path, or of any file inside it
+    """
+    mtime = os.stat(path).st_mtime
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            mtime = max(mtime, os.stat(os.path.join(root, f)).st_mtime)
+    return mtime
+
+
+def stream_paths(stream):
+    """
+    Yield the path on each non-empty line of stream
+    """
+    for line in stream:
+        path = line.strip()
+        if path:
+            yield path
+
+
+class _Feed:
+    """
+    An endless iterable of the most recent vis_arr, so that an image_snapshots
+    generator can be kept and advanced one snapshot at a time.
+    """
+
+    def __init__(self):
+        self.vis_arr = None
+
+    def __iter__(self):
+        while True:
+            yield self.vis_arr
+
+
+class ImagingDaemon:
+    """
+    Image files (TART JSON, measurement sets or DiSkO.to_file snapshot files) with
+    the sphere, method ("tikhonov" or "lsqr") and alpha of image_snapshots. The imagers
+    for the last max_imagers array geometries are kept.
+    """
+
+    def __init__(
+        self, sphere, method="tikhonov", alpha=0.0, niter=100, num_vis=1000,
+        channel=0, field_id=0, cache=None, max_imagers=4
+    ):
+        self.sphere = sphere
+        self.method = method
+        self.alpha = alpha
+        self.niter = niter
+        self.num_vis = num_vis
+        self.channel = channel
+        self.field_id = field_id
+        self.cache = cache
+        self.max_imagers = max_imagers
+        self.imagers = collections.OrderedDict()
+
+    def read(self, path):
+        """
+        The list of DiSkO snapshots in path
+        """
+        if path.endswith(".json"):
+            return DiSkO.from_json_file(path)
+        if path.endswith(".h5"):
+            return DiSkO.from_file_all(path)
+        return [
+            DiSkO.from_ms(
+                path, self.num_vis, res=self.sphere.min_res(), channel=self.channel,
+                field_id=self.field_id, cache=self.cache
+            )
+        ]
+
+    def imager(self, dsko):
+        """
+        The (feed, generator) that images the snapshots with the geometry of dsko
+        """
+        key = dsko.geometry_key()
+        if key in self.imagers:
+            self.imagers.move_to_end(key)
+            return self.imagers[key]
+
+        logger.info("New imager for geometry {}".format(key))
+        feed = _Feed()
+        images = dsko.image_snapshots(
+            feed, self.sphere, self.alpha, method=self.method, niter=self.niter
+        )
+        self.imagers[key] = (feed, images)
+        if len(self.imagers) > self.max_imagers:
+            self.imagers.popitem(last=False)
+        return self.imagers[key]
+
+    def image(self, dsko):
+        """
+        Image one snapshot. The sphere pixels are set to the image.
+        """
+        feed, images = self.imager(dsko)
+        feed.vis_arr = dsko.vis_arr
+        return next(images)
+
+    def process(self, path):
+        """
+        Yield (dsko, sky) for each snapshot in path, as it is imaged. When done, the
+        timings are in self.latency (seconds, with keys read, image and total). The
+        total includes the time the caller takes with each image (to save it, say).
+        """
+        t0 = time.perf_counter()
+        snapshots = self.read(path)
+        t_read = time.perf_counter() - t0
+
+        t_image = 0.0
+        for dsko in snapshots:
+            t1 = time.perf_counter()
+            sky = self.image(dsko)
+            t_image += time.perf_counter() - t1
+            yield dsko, sky
+
+        self.latency = {"read": t_read, "image": t_image, "total": time.perf_counter() - t0}
+        logger.info(
+            "{}: {} snapshots, read {:.3f}s, image {:.3f}s, total {:.3f}s".format(
+                path, len(snapshots), t_read, t_image, self.latency["total"]
+            )
+        )
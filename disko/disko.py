@@ -6,9 +6,11 @@
 #
 import os
 import argparse
+import hashlib
 import sys
 import threading
 import datetime
+import functools
 import json
 import logging
 import time
@@ -17,6 +19,7 @@ import scipy
 
 import numpy as np
 import healpy as hp
+import h5py
 #import dask.array as da
 
 
@@ -30,9 +33,13 @@ from tart.imaging import elaz
 
 
 from .sphere import HealpixSphere
-from .ms_helper import read_ms
+from .ms_helper import read_ms, read_ms_cube, iter_ms_slices, read_ms_parallel, combine_datasets
+from .vis_cache import VisibilityCache, cache_key, info_to_json, info_from_json
+from .subsample import stratified_choice, leverage_scores, leverage_choice
 from .multivariate_gaussian import MultivariateGaussian
+from .noise_covariance import StructuredNoiseCovariance
 from .resolution import Resolution
+from .bootstrap import bootstrap
 
 logger = logging.getLogger(__name__)
 logger.addHandler(
@@ -47,6 +54,70 @@ logger.setLevel(logging.INFO)
 """
 
 
+@functools.lru_cache(maxsize=16)
+def baseline_indices(num_ant):
+    """
+    The antenna index arrays (i, j) of all the baselines i != j of an array of
+    num_ant antennas, in the order of get_all_uvw. Cached for each array size,
+    the arrays are read-only.
+    """
+    ant_i, ant_j = np.nonzero(~np.eye(num_ant, dtype=bool))
+    ant_i.setflags(write=False)
+    ant_j.setflags(write=False)
+    return ant_i, ant_j
+
+
+@functools.lru_cache(maxsize=16)
+def _baseline_lookup(num_ant, baselines):
+    lookup = np.full((num_ant, num_ant), -1, dtype=int)
+    bl = np.frombuffer(baselines, dtype=int).reshape(-1, 2)
+    lookup[bl[:, 0], bl[:, 1]] = np.arange(bl.shape[0])
+    lookup.setflags(write=False)
+    return lookup
+
+
+def baseline_lookup(num_ant, baselines):
+    """
+    A (num_ant, num_ant) table of the index of baseline [i, j] in the list baselines
+    (or -1). Cached for each array configuration.
+    """
+    bl = np.ascontiguousarray(np.asarray(baselines, dtype=int).reshape(-1, 2))
+    return _baseline_lookup(num_ant, bl.tobytes())
+
+
+def gather_visibilities(cal_vis, ant_i, ant_j):
+    """
+    The calibrated visibilities of the baselines (ant_i, ant_j) of cal_vis, gathered
+    with NumPy indexing. The same as calling cal_vis.get_visibility(i, j) for each
+    baseline, the conjugate is used for i > j.
+    """
+    vis = cal_vis.vis
+    num_ant = cal_vis.get_config().get_num_antenna()
+    lookup = baseline_lookup(num_ant, vis.baselines)
+
+    lo = np.minimum(ant_i, ant_j)
+    hi = np.maximum(ant_i, ant_j)
+    index = lookup[lo, hi]
+
+    flagged = np.zeros((num_ant, num_ant), dtype=bool)
+    if len(cal_vis.flagged_baselines) > 0:
+        fl = np.asarray(cal_vis.flagged_baselines, dtype=int).reshape(-1, 2)
+        flagged[fl[:, 0], fl[:, 1]] = True
+
+    bad = (index < 0) | flagged[lo, hi]
+    if np.any(bad):
+        k = np.flatnonzero(bad)[0]
+        raise RuntimeError(
+            "Baseline [{}, {}] is flagged or missing".format(lo[k], hi[k])
+        )
+
+    v = np.asarray(vis.v)[index]
+    gain = np.asarray(cal_vis.gain)
+    phase = np.asarray(cal_vis.phase_offset)
+    v = v * gain[lo] * gain[hi] * np.exp(-1j * (phase[lo] - phase[hi]))
+    return np.where(ant_i > ant_j, np.conjugate(v), v)
+
+
 def get_all_uvw(ant_pos):
     """
     ant pos is an array of (N_ant, 3)
@@ -56,16 +127,11 @@ def get_all_uvw(ant_pos):
         raise RuntimeError(
             "Ant pos (shape={}) must be an array of (N_ant, 3)".format(ant_pos.shape)
         )
-    baselines = []
-    num_ant = len(ant_pos)
     ant_p = np.array(ant_pos)
-    for i in range(num_ant):
-        for j in range(num_ant):
-            if i != j:
-                baselines.append([i, j])
+    ant_i, ant_j = baseline_indices(len(ant_p))
+    baselines = np.stack((ant_i, ant_j), axis=1).tolist()
 
-    bl_pos = ant_p[np.array(baselines).astype(int)]
-    uu_a, vv_a, ww_a = (bl_pos[:, 0] - bl_pos[:, 1]).T
+    uu_a, vv_a, ww_a = (ant_p[ant_i] - ant_p[ant_j]).T
     return baselines, uu_a, vv_a, ww_a
 
 
@@ -118,6 +184,10 @@ import scipy.sparse.linalg as spalg
 class DiSkOOperator(pylops.LinearOperator):
     """
     Linear operator for the telescope with a discrete sky
+
+    The data is a cube [n_v*2, n_freq, n_pol], flattened in C order, with one sky
+    shared by every frequency. The correlations are treated as measurements of the
+    same (unpolarized) sky, for example XX and YY.
     """
 
     def __init__(self, u_arr, v_arr, w_arr, data, frequencies, sphere):
@@ -140,9 +210,16 @@ class DiSkOOperator(pylops.LinearOperator):
                 )
             )
 
-        self.M = self.n_v * self.n_freq
+        self.frequencies = np.array(frequencies).flatten()
+        if self.frequencies.shape[0] != self.n_freq:
+            raise RuntimeError(
+                "Data has {} channels, but {} frequencies were given".format(
+                    self.n_freq, self.frequencies.shape[0]
+                )
+            )
+
+        self.M = self.n_v * self.n_freq * self.npol
 
-        self.frequencies = np.array(frequencies)
         self.sphere = sphere
 
         if (self.sphere.l.shape[0] != self.N):
@@ -172,8 +249,7 @@ class DiSkOOperator(pylops.LinearOperator):
             self.sphere.n[j],
         )  # The column index (one l,m,n element per pixel)
 
-        z = get_harmonic(p2j, l, m, n-1, u, v, w, self.sphere.pixel_areas[j])
-        #z = np.exp(-p2j * (u * l + v * m + w * (n - 1))) * self.sphere.pixel_areas[j]
+        z = get_harmonic(-p2j, l, m, n-1, u, v, w, self.sphere.pixel_areas[j])
         if i < n_vis:
             return np.real(z)
         else:
@@ -182,6 +258,21 @@ class DiSkOOperator(pylops.LinearOperator):
     def Ah(self, i, j, p2j):
         return np.conj(self.A(j, i, p2j))
 
+    def _to_cube(self, y):
+        """
+        Copy the [n_v*2, n_freq] (or [n_v*2, n_freq, K]) model visibilities to every
+        correlation, and flatten in the order of the data cube.
+        """
+        y = np.repeat(np.expand_dims(y, 2), self.npol, axis=2)
+        return y.reshape((self.M,) + y.shape[3:])
+
+    def _from_cube(self, v):
+        """
+        The adjoint of _to_cube, sum the correlations of each channel.
+        """
+        v = v.reshape((self.n_v, self.n_freq, self.npol) + v.shape[1:])
+        return np.sum(v, axis=2)
+
     def _matvec(self, x):
         
         """
@@ -193,10 +284,10 @@ class DiSkOOperator(pylops.LinearOperator):
         """
         n_u = self.u_arr.shape[0]
         
-        y_re = np.zeros(n_u)
-        y_im = np.zeros(n_u)
+        y_re = np.zeros((n_u, self.n_freq))
+        y_im = np.zeros((n_u, self.n_freq))
         
-        for f in self.frequencies:
+        for k, f in enumerate(self.frequencies):
             p2j = jomega(f)
             # For each visibility
             for i in range(n_u):
@@ -204,14 +295,56 @@ class DiSkOOperator(pylops.LinearOperator):
                 v = self.v_arr[i]
                 w = self.w_arr[i]
                 
-                h = get_harmonic(p2j, self.sphere.l, self.sphere.m, self.sphere.n_minus_1, u, v, w, self.sphere.pixel_areas)
+                # The conjugate harmonic, as in make_gamma (and so the adjoint is _rmatvec)
+                h = get_harmonic(-p2j, self.sphere.l, self.sphere.m, self.sphere.n_minus_1, u, v, w, self.sphere.pixel_areas)
 
                 re = np.real(h)
                 im = np.imag(h)
-                y_re[i] = np.dot(x, re)
-                y_im[i] = np.dot(x, im)
+                y_re[i, k] = np.dot(x, re)
+                y_im[i, k] = np.dot(x, im)
+
+        return self._to_cube(np.concatenate((y_re, y_im)))
+
+    def _matmat(self, X):
+        """
+        Multiply by a block of K skies X (N x K). Each harmonic is evaluated once
+        and applied to all K columns.
+        """
+        n_u = self.u_arr.shape[0]
+        K = X.shape[1]
+
+        y_re = np.zeros((n_u, self.n_freq, K))
+        y_im = np.zeros((n_u, self.n_freq, K))
 
-        return np.concatenate((y_re, y_im))
+        for k, f in enumerate(self.frequencies):
+            p2j = jomega(f)
+            for i in range(n_u):
+                h = get_harmonic(-p2j, self.sphere.l, self.sphere.m, self.sphere.n_minus_1,
+                                 self.u_arr[i], self.v_arr[i], self.w_arr[i], self.sphere.pixel_areas)
+                y_re[i, k, :] = np.real(h) @ X
+                y_im[i, k, :] = np.imag(h) @ X
+
+        return self._to_cube(np.concatenate((y_re, y_im)))
+
+    def _rmatmat(self, Y):
+        """
+        Returns A^H Y for a block of K measurement vectors Y (M x K)
+        """
+        assert Y.shape[0] == self.M
+
+        Y = self._from_cube(Y)
+        ret = np.zeros((self.N, Y.shape[2]))
+
+        for k, f in enumerate(self.frequencies):
+            p2j = jomega(f)
+            for j, (l, m, n_1, a) in enumerate(zip(
+                    self.sphere.l, self.sphere.m, self.sphere.n_minus_1,
+                        self.sphere.pixel_areas)):
+                h = get_harmonic(-p2j, l, m, n_1, self.u_arr, self.v_arr, self.w_arr, a)
+                reim = np.concatenate((np.real(h), np.imag(h)))
+                ret[j, :] += reim @ Y[:, k, :]
+
+        return ret
 
     def _rmatvec(self, v):
         r"""
@@ -222,23 +355,24 @@ class DiSkOOperator(pylops.LinearOperator):
         """
         assert v.shape == (self.M,)
 
-        ret = []
+        v = self._from_cube(v)
+        ret = np.zeros(self.N)
 
-        for f in self.frequencies:
+        for k, f in enumerate(self.frequencies):
             p2j = jomega(f)
             # for each pixel
-            for l, m, n_1, a in zip(
+            for j, (l, m, n_1, a) in enumerate(zip(
                     self.sphere.l, self.sphere.m, self.sphere.n_minus_1,
-                        self.sphere.pixel_areas ): 
+                        self.sphere.pixel_areas )):
                 h = get_harmonic(-p2j, l, m, n_1, self.u_arr, self.v_arr, self.w_arr, a)
                 re = np.real(h)
                 im = np.imag(h)
 
                 reim = np.concatenate((re, im))
-                assert reim.shape == (self.M,)
-                ret.append(np.dot(v, reim))
+                assert reim.shape == (self.n_v,)
+                ret[j] += np.dot(v[:, k], reim)
 
-        return np.array(ret)
+        return ret
 
 
 class DirectImagingOperator(pylops.LinearOperator):
@@ -259,9 +393,9 @@ class DirectImagingOperator(pylops.LinearOperator):
         except:
             raise RuntimeError("Data must be of the shape [n_v, n_freq, n_pol]")
 
-        self.M = self.n_v * self.n_freq
+        self.M = self.n_v * self.n_freq * self.npol
 
-        self.frequencies = frequencies
+        self.frequencies = np.array(frequencies).flatten()
         self.sphere = sphere
 
         if (self.sphere.l.shape[0] != self.N):
@@ -285,12 +419,13 @@ class DirectImagingOperator(pylops.LinearOperator):
         The ajoint is just the conjugated basis vectors as rows.
         """
         n_vis = self.n_v // 2
-        vis_complex = v[0:n_vis] + 1.0j*v[n_vis:]
+        cube = np.sum(v.reshape((self.n_v, self.n_freq, self.npol)), axis=2)
         
         sky = np.zeros(self.N, dtype=self.dtype)
 
-        for f in self.frequencies:
+        for k, f in enumerate(self.frequencies):
             p2j = jomega(f)
+            vis_complex = cube[0:n_vis, k] + 1.0j*cube[n_vis:, k]
 
             for u, v, w, vis in zip(self.u_arr, self.v_arr, self.w_arr, vis_complex):
                 h = get_harmonic(p2j, self.sphere.l, self.sphere.m, self.sphere.n_minus_1, u, v, w, self.sphere.pixel_areas)
@@ -307,17 +442,17 @@ class DirectImagingOperator(pylops.LinearOperator):
         """
         assert x.shape == (self.N,)
 
-        ret = []
-        for f in self.frequencies:
+        ret = np.zeros((self.n_v // 2, self.n_freq), dtype=COMPLEX_DATATYPE)
+        for k, f in enumerate(self.frequencies):
             p2j = jomega(f)
 
             # Vector version
-            for u, v, w in zip(self.u_arr, self.v_arr, self.w_arr):
+            for i, (u, v, w) in enumerate(zip(self.u_arr, self.v_arr, self.w_arr)):
                 h = get_harmonic(-p2j, self.sphere.l, self.sphere.m, self.sphere.n_minus_1, u, v, w, self.sphere.pixel_areas)
-                ret.append(np.dot(x, h))
+                ret[i, k] = np.dot(x, h)
 
-        ret = np.array(ret)
-        return np.concatenate((np.real(ret), np.imag(ret)))
+        ret = np.concatenate((np.real(ret), np.imag(ret)))
+        return np.repeat(ret[:, :, None], self.npol, axis=2).flatten()
 
 
 class DiSkO(object):
@@ -328,6 +463,7 @@ class DiSkO(object):
         self.w_arr = w_arr
         self.frequency = frequency
         self.n_v = len(self.u_arr)
+        self.frequencies = np.atleast_1d(frequency)
         self.indices = None
 
     @classmethod
@@ -339,11 +475,38 @@ class DiSkO(object):
         return ret
 
     @classmethod
-    def from_ms(cls, ms, num_vis, res, chunks=50000, channel=0, field_id=0):
-        u_arr, v_arr, w_arr, frequency, cv_vis, hdr, tstamp, rms, indices = read_ms(
-            ms, num_vis, res, chunks, channel, field_id
-        )
+    def from_ms(
+        cls, ms, num_vis, res, chunks=50000, channel=0, field_id=0, cache=None,
+        sampling="random", seed=None, average=False, smearing=0.25
+    ):
+        """
+        Load num_vis visibilities from a measurement set, chosen by sampling
+        ("random" or "stratified" in u,v,w). If average is True, each baseline is
+        averaged in time and frequency while the smearing is below smearing pixels
+        of size res. If cache is a directory, the visibilities are saved there, and
+        loaded from it by later calls with the same measurement set and parameters.
+        """
+        def read():
+            return read_ms(
+                ms, num_vis, res, chunks, channel, field_id, sampling, seed, average, smearing
+            )
+
+        if cache is None:
+            rows = read()
+        else:
+            key = cache_key(
+                ms, num_vis=num_vis, res=res.radians(), chunks=chunks,
+                channel=channel, field_id=field_id, sampling=sampling, seed=seed,
+                average=average, smearing=smearing
+            )
+            rows = VisibilityCache(cache).get(key, read)
+        return cls.from_ms_rows(*rows)
 
+    @classmethod
+    def from_ms_rows(cls, u_arr, v_arr, w_arr, frequency, cv_vis, hdr, tstamp, rms, indices):
+        """
+        Create from the visibilities returned by read_ms (or iter_ms_slices)
+        """
         # Measurement sets do not return the conjugate pairs of visibilities
         
         full_u_arr = np.concatenate((u_arr, -u_arr),0)
@@ -363,6 +526,159 @@ class DiSkO(object):
         logger.info(f"u,v,w: {ret.u_arr.shape}")
         return ret
 
+    @classmethod
+    def from_ms_list(
+        cls, ms_list, num_vis, res, chunks=50000, channel=0, field_ids=None, spws=None,
+        frequency=None, combine=True, scheduler="threads"
+    ):
+        """
+        Read several measurement sets, fields and spectral windows in parallel with dask
+        (see read_ms_parallel). num_vis visibilities are read from each dataset.
+
+        If combine is True, return one DiSkO at the reference frequency (default the
+        lowest frequency), with the u,v,w of each row scaled by its frequency. The
+        frequency of each row is kept in row_frequency. Otherwise return a list with
+        one DiSkO for each dataset.
+        """
+        parts = read_ms_parallel(
+            ms_list, num_vis, res, chunks, channel, field_ids, spws, scheduler
+        )
+        if not combine:
+            return [
+                cls.from_ms_rows(*combine_datasets([p], p["frequency"])[0]) for p in parts
+            ]
+
+        rows, row_frequency = combine_datasets(parts, frequency)
+        ret = cls.from_ms_rows(*rows)
+        ret.row_frequency = np.concatenate((row_frequency, row_frequency), 0)
+        return ret
+
+    @classmethod
+    def iter_ms(
+        cls, ms, num_vis, res, interval=None, scans=False, chunks=50000, channel=0, field_id=0,
+        sampling="random", seed=None
+    ):
+        """
+        Yield one DiSkO for each time slice of a measurement set. The slices are interval
+        seconds long, and are split by scan if scans is True. Each slice is read from the
+        measurement set only when it is reached, so the memory used does not grow with
+        the length of the observation.
+
+        Slices with the same u,v,w (for example all the rows of a fixed array such as
+        TART) have the same geometry_key(), so their operator and SVD can be reused.
+        """
+        for rows in iter_ms_slices(
+            ms, num_vis, res, chunks, channel, field_id, interval=interval, scans=scans,
+            sampling=sampling, seed=seed
+        ):
+            yield cls.from_ms_rows(*rows)
+
+    @classmethod
+    def from_ms_cube(
+        cls, ms, num_vis, res, chunks=50000, channels=None, pols=(0,), field_id=0,
+        sampling="random", seed=None
+    ):
+        """
+        Load a range of channels and a list of correlations in one pass over the
+        measurement set. The cube (vis_cube [n_v, n_freq, n_pol]) is imaged with
+        one sky shared by all frequencies, see cube_to_data().
+
+        The frequency (and vis_arr) are the mean over the cube, so that the
+        single frequency imaging methods can still be used.
+        """
+        u_arr, v_arr, w_arr, frequencies, cube, hdr, tstamp, rms, indices = read_ms_cube(
+            ms, num_vis, res, chunks, channels, pols, field_id, sampling, seed
+        )
+
+        # Measurement sets do not return the conjugate pairs of visibilities
+        full_u_arr = np.concatenate((u_arr, -u_arr), 0)
+        full_v_arr = np.concatenate((v_arr, -v_arr), 0)
+        full_w_arr = np.concatenate((w_arr, -w_arr), 0)
+        full_rms = np.concatenate((rms, rms), 0)
+        full_cube = np.concatenate((cube, np.conjugate(cube)), 0)
+
+        ret = cls(full_u_arr, full_v_arr, full_w_arr, np.mean(frequencies))
+        ret.frequencies = frequencies
+        ret.vis_cube = full_cube / full_rms[:, None, :]  # Natural weighting
+        ret.vis_arr = np.mean(ret.vis_cube, axis=(1, 2))
+        ret.timestamp = tstamp
+        ret.rms = np.mean(full_rms, axis=1)
+        ret.info = hdr
+        ret.indices = indices
+
+        logger.info(f"Visibility cube: {ret.vis_cube.shape}")
+        return ret
+
+    def cube_to_data(self):
+        """
+        The real data cube [n_v*2, n_freq, n_pol] for the DiSkOOperator
+        """
+        return np.concatenate(
+            (np.real(self.vis_cube), np.imag(self.vis_cube))
+        ).astype(REAL_DATATYPE)
+
+    def subset(self, rows):
+        """
+        A new DiSkO with only these rows (u,v,w and visibilities)
+        """
+        ret = DiSkO(self.u_arr[rows], self.v_arr[rows], self.w_arr[rows], self.frequency)
+        ret.frequencies = self.frequencies
+        ret.info = getattr(self, "info", {})
+        for name in ["vis_arr", "rms", "row_frequency", "vis_cube"]:
+            if hasattr(self, name):
+                setattr(ret, name, np.asarray(getattr(self, name))[rows])
+        if hasattr(self, "timestamp"):
+            ret.timestamp = self.timestamp
+        return ret
+
+    def subsample(self, num_vis, sphere=None, method="stratified", seed=None, n_bins=8):
+        """
+        Choose num_vis of the visibilities, and return them as a new DiSkO.
+
+        method="stratified": Take the same number from each cell of a (u,v,w) grid.
+        method="leverage":   Choose in proportion to the leverage of the rows of the
+                             telescope operator for sphere, favouring the visibilities
+                             that best condition the problem.
+
+        Visibilities read from a measurement set are kept together with their
+        conjugate pair, and num_vis counts the pairs.
+        """
+        paired = (self.indices is not None) and (self.n_v == 2 * len(self.indices))
+        n = self.n_v // 2 if paired else self.n_v
+        if num_vis >= n:
+            return self
+
+        uvw = np.stack((self.u_arr[0:n], self.v_arr[0:n], self.w_arr[0:n]), axis=1)
+        if method == "stratified":
+            extent = np.max(np.abs(uvw)) * (1.0 + 1e-9)
+            chosen = stratified_choice(uvw, num_vis, extent, n_bins, seed)
+        elif method == "leverage":
+            if sphere is None:
+                raise ValueError("Leverage subsampling needs a sphere")
+            scores = leverage_scores(self.make_gamma(sphere))
+            scores = scores[0:self.n_v] + scores[self.n_v:]  # Real and imaginary rows
+            if paired:
+                scores = scores[0:n] + scores[n:]
+            chosen = leverage_choice(scores, num_vis, seed)
+        else:
+            raise ValueError("Unknown subsample method {}".format(method))
+
+        logger.info("Subsample ({}) {} of {} visibilities".format(method, num_vis, n))
+        rows = np.concatenate((chosen, chosen + n)) if paired else chosen
+        ret = self.subset(rows)
+        ret.indices = self.indices[chosen] if paired else None
+        return ret
+
+    def geometry_key(self):
+        """
+        A key identifying the u,v,w positions and frequency of these visibilities.
+        Operators (and their SVD) can be shared between DiSkO objects with the same key.
+        """
+        h = hashlib.sha1()
+        for x in (self.u_arr, self.v_arr, self.w_arr, np.atleast_1d(self.frequency)):
+            h.update(np.ascontiguousarray(x, dtype=np.float64).tobytes())
+        return h.hexdigest()
+
     def vis_stats(self):
         vabs = np.abs(self.vis_arr)
 
@@ -385,17 +701,202 @@ class DiSkO(object):
         # including the -u,-v, -w points.
 
         baselines, u_arr, v_arr, w_arr = get_all_uvw(ant_p)
+        ant_i, ant_j = baseline_indices(len(ant_p))
 
         ret = cls(u_arr, v_arr, w_arr, c.get_operating_frequency())
-        ret.vis_arr = []
-        for bl in baselines:
-            v = cal_vis.get_visibility(bl[0], bl[1])  # Handles the conjugate bit
-            ret.vis_arr.append(v)
-            # logger.info("vis={}, bl={}".format(v, bl))
-        ret.vis_arr = np.array(ret.vis_arr, dtype=COMPLEX_DATATYPE)
+        ret.vis_arr = gather_visibilities(cal_vis, ant_i, ant_j).astype(COMPLEX_DATATYPE)
+        ret.timestamp = cal_vis.get_timestamp()
         ret.info = {}
         return ret
 
+    @classmethod
+    def from_cal_vis_list(cls, cal_vis_list):
+        """
+        Create from a list of calibrated snapshots with the same antenna positions
+        and frequency. The visibilities are stacked in vis_stack (n_snap x n_v), and
+        vis_arr is the first snapshot. The snapshot timestamps are in timestamps.
+        """
+        if len(cal_vis_list) == 0:
+            raise ValueError("No calibrated visibilities")
+
+        ret = cls.from_cal_vis(cal_vis_list[0])
+        ant_p = np.asarray(cal_vis_list[0].get_config().get_antenna_positions())
+        ant_i, ant_j = baseline_indices(len(ant_p))
+
+        ret.vis_stack = np.zeros((len(cal_vis_list), ret.n_v), dtype=COMPLEX_DATATYPE)
+        ret.vis_stack[0] = ret.vis_arr
+        for k, cv in enumerate(cal_vis_list[1:], 1):
+            c = cv.get_config()
+            if c.get_operating_frequency() != ret.frequency or not np.array_equal(
+                np.asarray(c.get_antenna_positions()), ant_p
+            ):
+                raise ValueError(
+                    "Snapshot {} has a different array configuration".format(k)
+                )
+            ret.vis_stack[k] = gather_visibilities(cv, ant_i, ant_j)
+
+        ret.timestamps = [cv.get_timestamp() for cv in cal_vis_list]
+        logger.info("Stacked visibilities: {}".format(ret.vis_stack.shape))
+        return ret
+
+    @classmethod
+    def from_json_file(cls, fname, flag_list=[]):
+        """
+        One DiSkO for each snapshot of a TART JSON file (visibilities, antenna positions
+        and gains). The catalog of each snapshot is in source_json.
+        """
+        from tart.operation import settings
+        from tart_tools import api_imaging
+
+        with open(fname, "r") as json_file:
+            calib_info = json.load(json_file)
+
+        config = settings.from_api_json(calib_info["info"]["info"], calib_info["ant_pos"])
+        gains = np.asarray(calib_info["gains"]["gain"])
+        phase_offsets = np.asarray(calib_info["gains"]["phase_offset"])
+
+        ret = []
+        for vis_json, source_json in calib_info["data"]:
+            cv, _timestamp = api_imaging.vis_calibrated(
+                vis_json, config, gains, phase_offsets, flag_list
+            )
+            dsko = cls.from_cal_vis(cv)
+            dsko.source_json = source_json
+            ret.append(dsko)
+        return ret
+
+    SNAPSHOT_FIELDS = ["u_arr", "v_arr", "w_arr", "vis_arr", "rms", "indices"]
+
+    def to_file(self, filename):
+        """
+        Append these visibilities to the HDF5 file filename (created if needed), as
+        one snapshot. Every field is a dataset with one row per snapshot, so all the
+        snapshots in a file must have the same number of visibilities. Missing rms
+        are stored as NaN, and missing indices as -1.
+
+        Returns the index of the snapshot in the file.
+        """
+        rows = {
+            "u_arr": self.u_arr,
+            "v_arr": self.v_arr,
+            "w_arr": self.w_arr,
+            "vis_arr": np.asarray(self.vis_arr, dtype=COMPLEX_DATATYPE),
+            "rms": np.full(self.n_v, np.nan),
+            "indices": np.full(self.n_v, -1, dtype=np.int64),
+        }
+        if getattr(self, "rms", None) is not None:
+            rows["rms"][:] = self.rms
+        if self.indices is not None:
+            rows["indices"][0 : len(self.indices)] = self.indices
+
+        timestamp = getattr(self, "timestamp", None)
+        t = np.nan if timestamp is None else timestamp.timestamp()
+        info = info_to_json(getattr(self, "info", {}))
+
+        with h5py.File(filename, "a") as h5f:
+            if "timestamp" not in h5f:
+                for name in self.SNAPSHOT_FIELDS:
+                    x = rows[name]
+                    h5f.create_dataset(
+                        name, shape=(0, self.n_v), maxshape=(None, self.n_v),
+                        chunks=(1, self.n_v), dtype=x.dtype
+                    )
+                h5f.create_dataset("frequency", shape=(0,), maxshape=(None,), dtype=np.float64)
+                h5f.create_dataset("timestamp", shape=(0,), maxshape=(None,), dtype=np.float64)
+                h5f.create_dataset(
+                    "info", shape=(0,), maxshape=(None,), dtype=h5py.string_dtype()
+                )
+
+            if h5f["u_arr"].shape[1] != self.n_v:
+                raise ValueError(
+                    "{} has snapshots of {} visibilities, not {}".format(
+                        filename, h5f["u_arr"].shape[1], self.n_v
+                    )
+                )
+
+            index = h5f["timestamp"].shape[0]
+            for name in self.SNAPSHOT_FIELDS:
+                h5f[name].resize(index + 1, axis=0)
+                h5f[name][index] = rows[name]
+            for name, x in [("frequency", self.frequency), ("timestamp", t), ("info", info)]:
+                h5f[name].resize(index + 1, axis=0)
+                h5f[name][index] = x
+
+        logger.info("Wrote snapshot {} to {}".format(index, filename))
+        return index
+
+    @classmethod
+    def file_timestamps(cls, filename):
+        """
+        The timestamps of the snapshots in a file written by to_file
+        """
+        with h5py.File(filename, "r") as h5f:
+            t = h5f["timestamp"][:]
+        return [
+            None if np.isnan(x) else datetime.datetime.fromtimestamp(x, tz=datetime.timezone.utc)
+            for x in t
+        ]
+
+    @classmethod
+    def _from_file_rows(cls, rows, frequency, t, info):
+        ret = cls(rows["u_arr"], rows["v_arr"], rows["w_arr"], frequency)
+        ret.vis_arr = rows["vis_arr"]
+        ret.rms = None if np.all(np.isnan(rows["rms"])) else rows["rms"]
+        indices = rows["indices"][rows["indices"] >= 0]
+        ret.indices = indices if indices.shape[0] > 0 else None
+        ret.timestamp = (
+            None if np.isnan(t) else datetime.datetime.fromtimestamp(t, tz=datetime.timezone.utc)
+        )
+        ret.info = info_from_json(info)
+        return ret
+
+    @classmethod
+    def from_file(cls, filename, index=-1, timestamp=None):
+        """
+        Load one snapshot from a file written by to_file, either by index or (if
+        timestamp is not None) the snapshot with that timestamp. Only that snapshot
+        is read from the file.
+        """
+        with h5py.File(filename, "r") as h5f:
+            t_arr = h5f["timestamp"][:]
+            if timestamp is not None:
+                found = np.flatnonzero(np.abs(t_arr - timestamp.timestamp()) < 1e-6)
+                if found.shape[0] == 0:
+                    raise ValueError("No snapshot at {} in {}".format(timestamp, filename))
+                index = found[0]
+            index = range(t_arr.shape[0])[index]
+
+            rows = {name: h5f[name][index] for name in cls.SNAPSHOT_FIELDS}
+            info = h5f["info"].asstr()[index]
+            return cls._from_file_rows(rows, h5f["frequency"][index], t_arr[index], info)
+
+    @classmethod
+    def from_file_all(cls, filename):
+        """
+        Load every snapshot from a file written by to_file. Each dataset is read
+        in one operation.
+        """
+        tic = time.perf_counter()
+        with h5py.File(filename, "r") as h5f:
+            data = {name: h5f[name][:] for name in cls.SNAPSHOT_FIELDS}
+            frequency = h5f["frequency"][:]
+            t_arr = h5f["timestamp"][:]
+            info = h5f["info"].asstr()[:]
+
+        ret = [
+            cls._from_file_rows(
+                {name: data[name][k] for name in cls.SNAPSHOT_FIELDS},
+                frequency[k], t_arr[k], info[k]
+            )
+            for k in range(t_arr.shape[0])
+        ]
+        logger.info(
+            "Loaded {} snapshots from {} in {:04f}s".format(
+                len(ret), filename, time.perf_counter() - tic
+            )
+        )
+        return ret
+
     def get_harmonics(self, in_sphere):
         """Create the harmonics for this arrangement of sphere pixels"""
         # cache_key = "{}:".format(in_sphere.npix)
@@ -472,6 +973,11 @@ class DiSkO(object):
 
     def handle_residuals(self, operator, data, sky):
         residual = data - operator @ sky
+
+        # Average over the channels and correlations of a visibility cube
+        residual = np.mean(residual.reshape(2 * self.n_v, -1), axis=1)
+        data = np.mean(data.reshape(2 * self.n_v, -1), axis=1)
+
         normalized_residuals = residual / np.std(residual)
         
         RESIDUAL_LIMIT = 10.0  # Arbitrary limit to show bad residuals.
@@ -507,7 +1013,7 @@ class DiSkO(object):
 
         t0 = time.time()
 
-        frequencies = [self.frequency]
+        frequencies = self.frequencies if data.shape[1] > 1 else [self.frequency]
         logger.info("frequencies: {}".format(frequencies))
 
         A = DiSkOOperator(self.u_arr, self.v_arr, self.w_arr, data, frequencies, sphere)
@@ -543,7 +1049,7 @@ class DiSkO(object):
             logger.info(f"FISTA complete: {sky.shape} niter={niter}")
 
         if lsqr:
-            if alpha < 0:
+            if alpha is None or alpha < 0:
                 alpha = np.mean(self.rms)
             (
                 sky,
@@ -556,7 +1062,7 @@ class DiSkO(object):
                 arnorm,
                 xnorm,
                 var,
-            ) = spalg.lsqr(A, data, damp=alpha, show=True)
+            ) = spalg.lsqr(A, d, damp=alpha, show=True)
 
             residual = d - A @ sky
 
@@ -594,6 +1100,31 @@ class DiSkO(object):
         sphere.set_visible_pixels(sky, scale)
         return sky.reshape(-1, 1)
 
+    def bootstrap_matrix_free(
+        self, data, sphere, n_replicas, alpha=0.0, method="resample", niter=100, seed=None,
+        centre=False
+    ):
+        """
+        Bootstrap uncertainty of the damped least squares (LSQR or Tikhonov) image of
+        data (from vis_to_data or cube_to_data). The n_replicas replicas are solved
+        together, sharing the operator evaluations. For the Tikhonov image, alpha is
+        sqrt(alpha) of image_tikhonov, and centre is True (see bootstrap).
+
+        Returns the per-pixel standard deviation of the replica images.
+        """
+        logger.info(f"Bootstrap sphere={sphere} data={data.shape} n_replicas={n_replicas}")
+        t0 = time.time()
+
+        frequencies = self.frequencies if data.shape[1] > 1 else [self.frequency]
+        A = DiSkOOperator(self.u_arr, self.v_arr, self.w_arr, data, frequencies, sphere)
+        mean, std = bootstrap(
+            A, data.flatten(), n_replicas, damp=alpha, method=method, niter=niter, seed=seed,
+            centre=centre
+        )
+
+        logger.info("Bootstrap elapsed {}s".format(time.time() - t0))
+        return std
+
     def make_gamma(self, sphere, makecomplex=False):
 
         logger.info("Making Gamma Matrix npix={}".format(sphere.npix))
@@ -706,10 +1237,9 @@ class DiSkO(object):
         #
         # Create a likelihood covariance
         #
-        diag = np.diagflat(self.rms ** 2)
-        sigma_vis = np.block([[diag, 0.5 * diag], [0.5 * diag, diag]])
+        sigma_vis = StructuredNoiseCovariance.from_rms(self.rms, correlation=0.5)
 
-        precision = np.linalg.inv(sigma_vis)
+        precision = sigma_vis.inv()
 
         logger.info("y_m = {}".format(real_vis.shape))
 
@@ -884,6 +1414,71 @@ class DiSkO(object):
         sphere.set_visible_pixels(sky, scale=False)
         return sky.reshape(-1, 1)
 
+    def tikhonov_projection(self, sphere, alpha):
+        """
+        The matrix P (n_s x 2 n_v) for which P @ vis_to_real(vis_arr) is the
+        image_tikhonov solution. The ridge fit has an intercept, so the columns of
+        gamma are centred. The vector of ones is orthogonal to the centred columns,
+        so P also removes the mean of the data.
+        """
+        gamma = self.make_gamma(sphere)
+        gamma = gamma - np.mean(gamma, axis=0)
+        U, s, Vh = np.linalg.svd(gamma, full_matrices=False)
+        logger.info("Tikhonov projection {} alpha={}".format(Vh.shape, alpha))
+        return (Vh.T * (s / (s * s + alpha))) @ U.T
+
+    def image_snapshots(self, vis_stack, sphere, alpha, method="tikhonov", niter=100):
+        """
+        Yield the image of each row of vis_stack (n_snap x n_v), for example from
+        from_cal_vis_list, or of each vis_arr from an iterable. The snapshots share the
+        u,v,w of this object.
+
+        method="tikhonov": The same as image_tikhonov. The projection matrix is
+                           computed once, and each snapshot is one matrix-vector product.
+        method="lsqr":     The same as solve_matrix_free with lsqr. The operator is shared,
+                           and each solve starts from the image of the previous snapshot.
+
+        The sphere pixels are set to each image before it is yielded.
+        """
+        logger.info("image_snapshots({}, method={})".format(sphere, method))
+
+        if method == "tikhonov":
+            P = self.tikhonov_projection(sphere, alpha)
+        elif method == "lsqr":
+            if alpha is None or alpha < 0:
+                alpha = np.mean(self.rms)
+            A = DiSkOOperator(
+                self.u_arr, self.v_arr, self.w_arr, self.vis_to_data(np.zeros(self.n_v)),
+                [self.frequency], sphere
+            )
+            # lsqr damps the step from x0, not x, so the damping is added as rows
+            # of the operator to keep the warm started solutions the same.
+            M, N = A.shape
+            A_aug = spalg.LinearOperator(
+                (M + N, N),
+                matvec=lambda x: np.concatenate((A @ x, alpha * x)),
+                rmatvec=lambda y: A.H @ y[0:M] + alpha * y[M:],
+                dtype=np.float64,
+            )
+            sky = None
+        else:
+            raise ValueError("Unknown snapshot method {}".format(method))
+
+        for k, vis_arr in enumerate(vis_stack):
+            t0 = time.time()
+            d = vis_to_real(vis_arr)
+            if method == "tikhonov":
+                sky = P @ d
+            else:
+                sky, lstop, itn = spalg.lsqr(
+                    A_aug, np.concatenate((d, np.zeros(N))), iter_lim=niter, x0=sky
+                )[0:3]
+                logger.info("    lsqr stop={} iterations={}".format(lstop, itn))
+            logger.info("Snapshot {} elapsed {:04f}s".format(k, time.time() - t0))
+
+            sphere.set_visible_pixels(sky, scale=False)
+            yield sky.reshape(-1, 1)
+
     @classmethod
     def plot(self, plt, sphere, src_list):
         rot = (0, 90, 0)
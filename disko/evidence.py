@@ -0,0 +1,119 @@
+#
+# Marginal likelihood (evidence) of the hyperparameters sigma_v and sigma_p.
+#
+# For the model
+#
+#   y = Gamma s + n,     n ~ N(0, sigma_v^2 I),    s ~ N(mu_0, sigma_p^2 I)
+#
+# the visibilities are distributed as y ~ N(Gamma mu_0, sigma_p^2 Gamma Gamma^T + sigma_v^2 I).
+# With the SVD Gamma = U S V^T and z = U^T (y - Gamma mu_0), this covariance is diagonal,
+# with entries lambda_i = sigma_p^2 s_i^2 + sigma_v^2, so the evidence and its gradient
+# cost O(r) once z has been computed.
+#
+import logging
+
+import numpy as np
+from scipy.optimize import minimize
+
+from .multivariate_gaussian import MultivariateGaussian
+from .telescope_operator import NaturalPosterior
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    logging.NullHandler()
+)  # Add other handlers if you're using this as a library
+logger.setLevel(logging.INFO)
+
+
+class EvidenceOptimizer:
+    """
+    Find the sigma_v and sigma_p that maximize the evidence, reusing the SVD of a
+    TelescopeOperator. The prior has mean mu_0 and covariance sigma_p^2 I, and the
+    noise is independent with variance sigma_v^2 in each real component.
+    """
+
+    def __init__(self, to, real_vis, mu_0):
+        self.to = to
+        self.rank = to.rank
+        self.n_v = to.n_v
+        self.s_r = np.asarray(to.s[0 : self.rank])
+
+        y = np.asarray(real_vis).flatten()
+        self.mu_0 = np.zeros(to.n_s) + np.asarray(mu_0, dtype=np.float64).flatten()
+
+        # The projections are computed once, everything after this is O(r)
+        self.x_0 = np.asarray(to.Vh @ self.mu_0)
+        self.U_1y = np.asarray(to.U_1.T @ y)
+        residual = y - np.asarray(to.gamma @ self.mu_0).flatten()
+        self.z_r = np.asarray(to.U_1.T @ residual)
+        self.z_null = residual @ residual - self.z_r @ self.z_r
+
+        logger.info(
+            "EvidenceOptimizer(rank={}, n_v={}, |z_null|^2={:g})".format(
+                self.rank, self.n_v, self.z_null
+            )
+        )
+
+    def log_evidence(self, sigma_v, sigma_p):
+        """
+        Return the log evidence, and its gradient with respect to (log sigma_v^2, log sigma_p^2)
+        """
+        var_v = sigma_v * sigma_v
+        var_p = sigma_p * sigma_p
+        n_null = self.n_v - self.rank
+
+        lam = var_p * self.s_r * self.s_r + var_v
+        z2 = self.z_r * self.z_r
+
+        log_z = -0.5 * (
+            self.n_v * np.log(2 * np.pi)
+            + np.sum(np.log(lam) + z2 / lam)
+            + n_null * np.log(var_v)
+            + self.z_null / var_v
+        )
+
+        d_lam = 0.5 * (z2 / lam - 1.0) / lam
+        grad_v = var_v * (np.sum(d_lam) + 0.5 * (self.z_null / var_v - n_null) / var_v)
+        grad_p = var_p * np.sum(d_lam * self.s_r * self.s_r)
+        return log_z, np.array([grad_v, grad_p])
+
+    def optimize(self, sigma_v, sigma_p):
+        """
+        Maximize the evidence starting from (sigma_v, sigma_p). Returns the optimal
+        sigma_v, sigma_p and the log evidence there.
+        """
+
+        def f(theta):
+            log_z, grad = self.log_evidence(*np.exp(theta / 2))
+            return -log_z, -grad
+
+        theta_0 = np.log([sigma_v * sigma_v, sigma_p * sigma_p])
+        res = minimize(f, theta_0, jac=True, method="L-BFGS-B")
+        if not res.success:
+            logger.warning("Evidence optimization: {}".format(res.message))
+
+        sigma_v, sigma_p = np.exp(res.x / 2)
+        log_z = -res.fun
+        logger.info(
+            "Evidence optimum sigma_v={:g}, sigma_p={:g}, log Z={:g} ({} evaluations)".format(
+                sigma_v, sigma_p, log_z, res.nfev
+            )
+        )
+        return sigma_v, sigma_p, log_z
+
+    def posterior(self, sigma_v, sigma_p):
+        """
+        The posterior for these hyperparameters, as a NaturalPosterior. In the natural
+        basis the range block is diagonal, and the null block is the prior.
+        """
+        var_v = sigma_v * sigma_v
+        var_p = sigma_p * sigma_p
+
+        var_r = 1.0 / (self.s_r * self.s_r / var_v + 1.0 / var_p)
+        mu_r = var_r * (self.x_0[0 : self.rank] / var_p + self.s_r * self.U_1y / var_v)
+
+        posterior_r = MultivariateGaussian(mu_r, sigma=np.diag(var_r))
+        prior_n = MultivariateGaussian(
+            self.x_0[self.rank :], sigma=var_p * np.identity(self.to.n_s - self.rank)
+        )
+        return NaturalPosterior(self.to.V, self.rank, posterior_r, prior_n)
@@ -0,0 +1,102 @@
+#
+# Gaussian Markov random field priors over the pixels of a sphere.
+#
+# The prior precision is sparse, built from the pixel adjacency of the sphere,
+#
+#   Q = tau (kappa^2 I + B^T B)
+#
+# where B is the (E x n_s) first-difference operator over the E neighbouring
+# pairs of pixels. B^T B is the graph Laplacian, so the prior favours smooth
+# images on scales of about 1/kappa pixels.
+#
+import logging
+
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spalg
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    logging.NullHandler()
+)  # Add other handlers if you're using this as a library
+logger.setLevel(logging.INFO)
+
+
+def difference_operator(edges, npix):
+    """
+    The sparse (E x npix) matrix with a row e_i - e_j for each edge (i, j)
+    """
+    edges = np.asarray(edges, dtype=int)
+    n_e = edges.shape[0]
+    rows = np.repeat(np.arange(n_e), 2)
+    cols = edges.flatten()
+    data = np.tile([1.0, -1.0], n_e)
+    return sp.csr_matrix((data, (rows, cols)), shape=(n_e, npix))
+
+
+class GMRFPrior:
+    """
+    A Gaussian Markov random field prior N(mu, Q^-1) over the pixels of a sphere.
+
+    Provides matvec() and perturb() so that it can be the prior precision of a
+    MatrixFreePosterior. Samples and solves with Q use a sparse factorization.
+    """
+
+    def __init__(self, sphere, mu, tau, kappa):
+        if tau <= 0 or kappa <= 0:
+            raise ValueError("GMRF tau={} and kappa={} must be positive".format(tau, kappa))
+
+        self.D = sphere.npix
+        self.mu = np.zeros(self.D) + np.asarray(mu, dtype=np.float64).flatten()
+        self.tau = tau
+        self.kappa = kappa
+
+        edges = sphere.adjacency()
+        self.B = difference_operator(edges, self.D)
+        self.Q = (
+            tau * (kappa * kappa * sp.identity(self.D) + self.B.T @ self.B)
+        ).tocsc()
+        self._lu = None
+
+        logger.info(
+            "GMRFPrior(D={}, edges={}, tau={:g}, kappa={:g}, nnz={})".format(
+                self.D, edges.shape[0], tau, kappa, self.Q.nnz
+            )
+        )
+
+    @classmethod
+    def from_variance(cls, sphere, mu, variance, length):
+        """
+        A GMRF prior with a correlation length of about length pixels. The variance is
+        the marginal variance of each pixel without smoothing (kappa -> infinity), it
+        is an upper bound on the marginal variance of the field.
+        """
+        kappa = 1.0 / length
+        tau = 1.0 / (variance * kappa * kappa)
+        return cls(sphere, mu, tau, kappa)
+
+    def precision(self):
+        return self.Q
+
+    def matvec(self, x):
+        return self.Q @ x
+
+    def perturb(self, mu):
+        """
+        Return a sample from N(Q mu, Q), using Q = tau (kappa^2 I + B^T B).
+        """
+        z_1 = np.random.normal(0, 1, self.D)
+        z_2 = np.random.normal(0, 1, self.B.shape[0])
+        return self.Q @ mu + np.sqrt(self.tau) * (self.kappa * z_1 + self.B.T @ z_2)
+
+    def solve(self, b):
+        """
+        Return Q^-1 b, using a (cached) sparse LU factorization of Q
+        """
+        if self._lu is None:
+            logger.info("Factorizing GMRF precision")
+            self._lu = spalg.splu(self.Q)
+        return self._lu.solve(b)
+
+    def sample(self):
+        return self.mu + self.solve(self.perturb(np.zeros(self.D)))
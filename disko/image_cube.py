@@ -0,0 +1,134 @@
+#
+# Write images to one HDF5 cube of raw sphere pixels.
+#
+# The image dataset has dimensions (time, frequency, pixel), and grows by one time
+# step per image. The sphere geometry (elevation, azimuth and area of each pixel, and
+# the healpix indices if there are any) is written once. The images are written by a
+# background thread, so that imaging continues while the previous image is written.
+#
+import queue
+import logging
+import threading
+
+import h5py
+import numpy as np
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    logging.NullHandler()
+)  # Add other handlers if you're using this as a library
+logger.setLevel(logging.INFO)
+
+
+def write_geometry(h5f, sphere):
+    """
+    Write the pixel positions and areas of the sphere to the geometry group of h5f
+    """
+    grp = h5f.create_group("geometry")
+    grp.create_dataset("el_r", data=sphere.el_r)
+    grp.create_dataset("az_r", data=sphere.az_r)
+    grp.create_dataset("pixel_areas", data=np.zeros(sphere.npix) + sphere.pixel_areas)
+    if hasattr(sphere, "nside"):
+        grp.attrs["nside"] = sphere.nside
+        grp.create_dataset("pixel_indices", data=sphere.pixel_indices)
+    grp.attrs["sphere"] = repr(sphere)
+
+
+class ImageCubeWriter:
+    """
+    Append images (n_freq x npix, or npix if n_freq is 1) of a sphere to the HDF5 file
+    filename. Appending copies the image and returns at once, unless queue_size images
+    are already waiting to be written. Use close() (or a with block) to finish writing.
+
+        with ImageCubeWriter("cube.h5", sphere) as cube:
+            for ...:
+                cube.append(sky, timestamp)
+    """
+
+    def __init__(self, filename, sphere, frequencies=None, queue_size=8, info="{}"):
+        self.filename = filename
+        self.npix = sphere.npix
+        self.frequencies = np.atleast_1d(
+            np.zeros(1) if frequencies is None else np.asarray(frequencies, dtype=np.float64)
+        )
+        self.n_freq = self.frequencies.shape[0]
+
+        self.h5f = h5py.File(filename, "w")
+        write_geometry(self.h5f, sphere)
+        self.h5f.attrs["info"] = info
+        self.h5f.create_dataset("frequency", data=self.frequencies)
+        self.h5f.create_dataset(
+            "image", shape=(0, self.n_freq, self.npix), maxshape=(None, self.n_freq, self.npix),
+            chunks=(1, self.n_freq, self.npix), dtype=np.float32
+        )
+        self.h5f.create_dataset("timestamp", shape=(0,), maxshape=(None,), dtype=np.float64)
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.count = 0
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            image, t = item
+            try:
+                index = self.h5f["timestamp"].shape[0]
+                for name in ["image", "timestamp"]:
+                    self.h5f[name].resize(index + 1, axis=0)
+                self.h5f["image"][index] = image
+                self.h5f["timestamp"][index] = t
+            except Exception as e:
+                self.error = e
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError("Writing {} failed".format(self.filename)) from self.error
+
+    def append(self, image, timestamp=None):
+        """
+        Queue an image taken at timestamp (a datetime) to be written
+        """
+        self._check()
+        if self.thread is None:
+            raise RuntimeError("{} is closed".format(self.filename))
+        image = np.array(np.real(image), dtype=np.float32).reshape((self.n_freq, self.npix))
+        t = np.nan if timestamp is None else timestamp.timestamp()
+        self.queue.put((image, t))
+        self.count += 1
+
+    def close(self):
+        """
+        Wait for the queued images to be written, and close the file
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            self.h5f.close()
+            logger.info("Wrote {} images to {}".format(self.count, self.filename))
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_image_cube(filename, time=slice(None)):
+    """
+    Read the images (time, frequency, pixel) at the time indices of an ImageCubeWriter
+    file. Returns the images, their timestamps (POSIX seconds) and the geometry
+    datasets as a dictionary.
+    """
+    with h5py.File(filename, "r") as h5f:
+        images = h5f["image"][time]
+        timestamps = h5f["timestamp"][time]
+        geometry = {name: h5f["geometry"][name][:] for name in h5f["geometry"]}
+    return images, timestamps, geometry
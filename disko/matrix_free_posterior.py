@@ -0,0 +1,254 @@
+#
+# Matrix-free Gaussian posterior over the sky.
+#
+# The posterior precision A^T L A + Q_0 is only ever applied to vectors, so
+# that the posterior can be explored when the dense N_s x N_s covariance
+# does not fit in memory.
+#
+import logging
+import time
+
+import numpy as np
+import scipy.sparse.linalg as spalg
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    logging.NullHandler()
+)  # Add other handlers if you're using this as a library
+logger.setLevel(logging.INFO)
+
+
+def conjugate_gradient(matvec, b, x0=None, tol=1e-8, maxiter=None):
+    """
+    Solve P x = b for a symmetric positive definite P that is only
+    available as the function matvec(x) = P x.
+
+    Returns the solution, and the number of iterations used. The iteration
+    stops when ||r|| < tol ||b||.
+    """
+    D = b.shape[0]
+    if maxiter is None:
+        maxiter = 10 * D
+
+    if x0 is None:
+        x = np.zeros(D)
+        r = np.array(b, dtype=np.float64)
+    else:
+        x = np.array(x0, dtype=np.float64)
+        r = b - matvec(x)
+
+    b_norm = np.linalg.norm(b)
+    if b_norm == 0:
+        return np.zeros(D), 0
+
+    p = r.copy()
+    r_dot = r @ r
+
+    for k in range(maxiter):
+        if np.sqrt(r_dot) < tol * b_norm:
+            return x, k
+
+        Pp = matvec(p)
+        gamma = r_dot / (p @ Pp)
+        x = x + gamma * p
+        r = r - gamma * Pp
+
+        r_dot_new = r @ r
+        p = r + (r_dot_new / r_dot) * p
+        r_dot = r_dot_new
+
+    logger.warning(
+        "conjugate_gradient: no convergence after {} iterations ||r||/||b|| = {:g}".format(
+            maxiter, np.sqrt(r_dot) / b_norm
+        )
+    )
+    return x, maxiter
+
+
+class DiagonalPrecision:
+    """
+    A diagonal precision matrix Q = diag(q).
+
+    Any precision used by the MatrixFreePosterior must provide
+
+        matvec(x)   -> Q x
+        perturb(mu) -> a sample from N(Q mu, Q)
+    """
+
+    def __init__(self, q, D):
+        q = np.asarray(q, dtype=np.float64)
+        if q.ndim == 0:
+            q = np.full(D, float(q))
+        if q.shape != (D,):
+            raise ValueError("Precision diagonal {} must have length {}".format(q.shape, D))
+        if np.any(q <= 0):
+            raise ValueError("Precision diagonal must be positive")
+        self.q = q
+        self.D = D
+
+    def matvec(self, x):
+        return self.q * x
+
+    def perturb(self, mu):
+        z = np.random.normal(0, 1, self.D)
+        return self.q * mu + np.sqrt(self.q) * z
+
+
+def as_precision(q, D):
+    """
+    Wrap scalars and vectors as a DiagonalPrecision. Objects that already
+    provide matvec() and perturb() are returned unchanged.
+    """
+    if hasattr(q, "matvec") and hasattr(q, "perturb"):
+        return q
+    return DiagonalPrecision(q, D)
+
+
+class MatrixFreePosterior:
+    """
+    The Gaussian posterior for a sky x, given measurements
+
+        y = A x + n,    n ~ N(0, L^-1)
+
+    and a prior x ~ N(mu_0, Q_0^-1). The posterior is N(mu, P^-1) where
+
+        P = A^T L A + Q_0,    P mu = A^T L y + Q_0 mu_0
+
+    The operator A only needs to provide products with vectors (matvec, rmatvec),
+    for example a DiSkOOperator. The noise precision L and prior precision Q_0 may be
+    scalars, vectors (the diagonal) or objects with matvec() and perturb() methods,
+    including another MatrixFreePosterior (for sequential inference).
+    """
+
+    def __init__(self, A, y, noise_precision, prior_mu, prior_precision, tol=1e-8, maxiter=None):
+        self.A = spalg.aslinearoperator(A)
+        self.n_v, self.D = self.A.shape
+
+        self.y = np.asarray(y, dtype=np.float64).flatten()
+        if self.y.shape[0] != self.n_v:
+            raise ValueError(
+                "Measurements {} do not match operator {}".format(self.y.shape, self.A.shape)
+            )
+
+        self.mu_0 = np.zeros(self.D) + np.asarray(prior_mu, dtype=np.float64).flatten()
+        self.L = as_precision(noise_precision, self.n_v)
+        self.Q_0 = as_precision(prior_precision, self.D)
+
+        self.tol = tol
+        self.maxiter = maxiter
+        self._mu = None
+
+        logger.info("MatrixFreePosterior(A={}, y={})".format(self.A.shape, self.y.shape))
+
+    def precision_matvec(self, x):
+        """
+        Return P x = (A^T L A + Q_0) x
+        """
+        return self.A.rmatvec(self.L.matvec(self.A.matvec(x))) + self.Q_0.matvec(x)
+
+    def matvec(self, x):
+        return self.precision_matvec(x)
+
+    def perturb(self, mu):
+        """
+        Return a sample from N(P mu, P). This allows a posterior to be
+        used as the prior precision of a subsequent update.
+        """
+        return (
+            self.precision_matvec(mu)
+            + self.A.rmatvec(self.L.perturb(np.zeros(self.n_v)))
+            + self.Q_0.perturb(np.zeros(self.D))
+        )
+
+    def precision_operator(self):
+        return spalg.LinearOperator(
+            (self.D, self.D),
+            matvec=self.precision_matvec,
+            rmatvec=self.precision_matvec,
+            dtype=np.float64,
+        )
+
+    def solve(self, b, x0=None):
+        """
+        Return P^-1 b, using the conjugate gradient method.
+        """
+        t0 = time.time()
+        x, niter = conjugate_gradient(
+            self.precision_matvec, b, x0=x0, tol=self.tol, maxiter=self.maxiter
+        )
+        logger.info("CG solve: {} iterations, {:.3f}s".format(niter, time.time() - t0))
+        return x
+
+    @property
+    def mu(self):
+        if self._mu is None:
+            b = self.A.rmatvec(self.L.matvec(self.y)) + self.Q_0.matvec(self.mu_0)
+            self._mu = self.solve(b)
+        return self._mu
+
+    def sample(self):
+        """
+        Return a sample from the posterior by perturbation-optimisation.
+
+        With perturbed data eta_1 ~ N(y, L^-1) and perturbed prior mean
+        eta_2 ~ N(mu_0, Q_0^-1), the solution of
+
+            P x = A^T L eta_1 + Q_0 eta_2
+
+        is distributed as N(mu, P^-1). Only the precision-weighted perturbations
+        L eta_1 ~ N(L y, L) and Q_0 eta_2 ~ N(Q_0 mu_0, Q_0) are ever formed.
+
+        See Papandreou & Yuille (2010), and Orieux, Feron & Giovannelli (2012).
+        """
+        b = self.A.rmatvec(self.L.perturb(self.y)) + self.Q_0.perturb(self.mu_0)
+        return self.solve(b, x0=self.mu)
+
+    def variance_estimate(self, n_samples=32, method="hutchinson"):
+        """
+        Estimate the diagonal of the posterior covariance P^-1 using n_samples
+        CG solves. Returns the estimate and its standard error (per pixel).
+
+        method="hutchinson": Rademacher probes z, diag(P^-1) = E[z * P^-1 z]
+        method="samples":    The sample variance of posterior samples.
+        """
+        logger.info("variance_estimate(n_samples={}, method={})".format(n_samples, method))
+        if n_samples < 2:
+            raise ValueError("At least two samples are needed to estimate the variance")
+
+        if method == "hutchinson":
+            estimates = np.zeros((n_samples, self.D))
+            for k in range(n_samples):
+                z = np.random.choice([-1.0, 1.0], self.D)
+                estimates[k] = z * self.solve(z)
+            var = np.mean(estimates, axis=0)
+            err = np.std(estimates, axis=0, ddof=1) / np.sqrt(n_samples)
+        elif method == "samples":
+            samples = np.array([self.sample() for k in range(n_samples)])
+            var = np.var(samples, axis=0, ddof=1)
+            err = var * np.sqrt(2.0 / (n_samples - 1))
+        else:
+            raise ValueError("Unknown variance estimation method {}".format(method))
+
+        logger.info(
+            "Variance estimate: median {:g}, median standard error {:g}".format(
+                np.median(var), np.median(err)
+            )
+        )
+        return var, err
+
+    def variance(self, n_samples=32, method="hutchinson"):
+        """
+        The posterior standard deviation of each pixel (as returned by
+        MultivariateGaussian.variance), from a stochastic estimate of the
+        diagonal of the covariance.
+        """
+        var, err = self.variance_estimate(n_samples, method)
+        return np.sqrt(np.clip(var, 0, None))
+
+    def covariance_row(self, i):
+        """
+        Return row i of the posterior covariance, P^-1 e_i, with one CG solve.
+        """
+        e_i = np.zeros(self.D)
+        e_i[i] = 1.0
+        return self.solve(e_i)
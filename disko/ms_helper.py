@@ -12,6 +12,7 @@ from dask.diagnostics import ProgressBar
 from dask.distributed import progress
 
 from .resolution import Resolution
+from .subsample import uvw_bins, water_fill
 
 logger = logging.getLogger(__name__)
 logger.addHandler(
@@ -19,6 +20,7 @@ logger.addHandler(
 )  # Add other handlers if you're using this as a library
 logger.setLevel(logging.INFO)
 
+OMEGA_EARTH = 7.2921150e-5  # Sidereal rotation rate of the earth (rad/s)
 
 
 class RadioObservation(object):
@@ -26,7 +28,668 @@ class RadioObservation(object):
         pass
 
 
-def read_ms(ms, num_vis, angular_resolution, chunks=1000, channel=0, field_id=0):
+def read_metadata(ms, spw=-1):
+    """
+    Read the antenna positions, the phase direction of the first field, and the
+    channel frequencies of the spectral window spw (default the last) of a measurement set.
+    """
+    # Create a dataset representing the entire antenna table
+    ant_table = "::".join((ms, "ANTENNA"))
+
+    for ant_ds in xds_from_table(ant_table):
+        ant_p = np.array(ant_ds.POSITION.data)
+    logger.info("Antenna Positions {}".format(ant_p.shape))
+
+    # Create a dataset representing the field
+    field_table = "::".join((ms, "FIELD"))
+    for field_ds in xds_from_table(field_table):
+        phase_dir = np.array(field_ds.PHASE_DIR.data)[0].flatten()
+        name = field_ds.NAME.data.compute()
+        logger.info("Field {}: Phase Dir {}".format(name, np.degrees(phase_dir)))
+
+    # Create datasets representing each row of the spw table
+    spw_table = "::".join((ms, "SPECTRAL_WINDOW"))
+
+    spw_frequencies = []
+    for spw_ds in xds_from_table(spw_table, group_cols="__row__"):
+        logger.info("CHAN_FREQ.values: {}".format(spw_ds.CHAN_FREQ.values.shape))
+        spw_frequencies.append(dask.compute(spw_ds.CHAN_FREQ.values)[0].flatten())
+        logger.info("NUM_CHAN = %f" % np.array(spw_ds.NUM_CHAN.values)[0])
+
+    frequencies = spw_frequencies[spw]
+    logger.info("Frequencies = {}".format(frequencies))
+
+    return ant_p, phase_dir, frequencies
+
+
+def ms_header(phase_dir, frequency, epoch_seconds):
+    """
+    The FITS header entries describing an image made from a measurement set
+    """
+    return {
+        "CTYPE1": ("RA---SIN", "Right ascension angle cosine"),
+        "CRVAL1": np.degrees(phase_dir)[0],
+        "CUNIT1": "deg     ",
+        "CTYPE2": ("DEC--SIN", "Declination angle cosine "),
+        "CRVAL2": np.degrees(phase_dir)[1],
+        "CUNIT2": "deg     ",
+        "CTYPE3": "FREQ    ",  #           / Central frequency  ",
+        "CRPIX3": 1.0,
+        "CRVAL3": "{}".format(frequency),
+        "CDELT3": 10026896.158854,
+        "CUNIT3": "Hz      ",
+        "EQUINOX": "2000.",
+        "DATE-OBS": "{}".format(epoch_seconds),
+        "BTYPE": "Intensity",
+    }
+
+
+def ms_timestamp(epoch_seconds):
+    """
+    Convert from reduced Julian Date (in seconds) to a timestamp.
+    """
+    return datetime.datetime(
+        1858, 11, 17, 0, 0, 0, tzinfo=datetime.timezone.utc
+    ) + datetime.timedelta(seconds=float(epoch_seconds))
+
+
+def row_chunks(ds, start=0, stop=None):
+    """
+    Yield the (start, stop) rows of each row chunk of a dask-ms dataset, clipped
+    to the rows start..stop-1
+    """
+    if stop is None:
+        stop = ds.UVW.data.shape[0]
+    begin = 0
+    for n in ds.UVW.data.chunks[0]:
+        end = begin + n
+        if end > start and begin < stop:
+            yield max(begin, start), min(end, stop)
+        begin = end
+
+
+def good_rows(ds, start, stop, channels, pols, bl_max):
+    """
+    Read the UVW and FLAG columns of one row chunk. Return the uvw of the chunk, and the
+    rows (relative to start) that have baselines shorter than bl_max, and no flags in
+    the selected channels (a slice) and correlations (a list).
+    """
+    uvw = np.array(ds.UVW.data[start:stop], dtype=np.float32)
+    flags = np.array(ds.FLAG.data[start:stop, channels])[:, :, pols]
+    bl = np.sqrt(uvw[:, 0] ** 2 + uvw[:, 1] ** 2 + uvw[:, 2] ** 2)
+    return uvw, np.where(~np.any(flags, axis=(1, 2)) & (bl < bl_max))[0]
+
+
+def allocate_quota(counts, total):
+    """
+    Split total samples between chunks in proportion to the number of good rows
+    in each chunk (by the largest remainder). If there are no more than total good rows
+    then every good row is used.
+    """
+    counts = np.asarray(counts, dtype=int)
+    n = np.sum(counts)
+    if n <= total:
+        return counts.copy()
+
+    exact = counts * (total / n)
+    quota = np.floor(exact).astype(int)
+    remainder = total - np.sum(quota)
+    order = np.argsort(-(exact - quota), kind="stable")
+    quota[order[0:remainder]] += 1
+    return np.minimum(quota, counts)
+
+
+def smearing_limits(angular_resolution, frequency, fraction=0.25, radius=1.0):
+    """
+    The longest averaging time (seconds) and bandwidth (Hz) for which the time and
+    bandwidth smearing of a source at radius (radians) from the phase centre are less
+    than fraction of a pixel (of size angular_resolution).
+
+    The sky rotates by OMEGA_EARTH dt in time dt, which moves a source at radius by up to
+    radius OMEGA_EARTH dt (and so a whole sky moves by OMEGA_EARTH dt). A bandwidth df
+    stretches the image radially by radius df / f.
+    """
+    limit = fraction * angular_resolution.radians() / radius
+    return limit / OMEGA_EARTH, limit * frequency
+
+
+def average_groups(time, ant1, ant2, max_dt):
+    """
+    Group the rows of the same baseline in time windows of max_dt seconds. Returns
+    the group number of each row, numbered from zero.
+    """
+    window = np.floor(np.asarray(time) / max_dt).astype(np.int64)
+    keys = np.stack((np.asarray(ant1), np.asarray(ant2), window), axis=1)
+    _, group = np.unique(keys, axis=0, return_inverse=True)
+    return group.flatten()
+
+
+def unit_means(unit, uvw):
+    """
+    The mean uvw of each unit (numbered from zero) of the rows with the given uvw
+    """
+    n_units = np.max(unit) + 1
+    size = np.bincount(unit, minlength=n_units)
+    return np.stack(
+        [np.bincount(unit, weights=uvw[:, i], minlength=n_units) for i in range(3)],
+        axis=1,
+    ) / size[:, None]
+
+
+def average_units(unit, chosen, uvw, data, sigma):
+    """
+    Average the rows of each of the chosen units, weighting the visibilities by
+    1/sigma^2. The sigma of the average is 1/sqrt(sum(1/sigma^2)).
+
+    Returns uvw [k, 3], data [k, n_chan, n_pol], sigma [k, n_pol] for the k chosen
+    units, and the first row of each unit.
+    """
+    k = chosen.shape[0]
+    sel = np.flatnonzero(np.isin(unit, chosen))
+    idx = np.searchsorted(chosen, unit[sel])
+
+    weight = 1.0 / sigma[sel].astype(np.float64) ** 2
+    w_sum = np.zeros((k, sigma.shape[1]))
+    np.add.at(w_sum, idx, weight)
+
+    vis = np.zeros((k,) + data.shape[1:], dtype=np.complex128)
+    np.add.at(vis, idx, data[sel] * weight[:, None, :])
+
+    uvw_sum = np.zeros((k, 3))
+    np.add.at(uvw_sum, idx, uvw[sel])
+    size = np.bincount(idx, minlength=k)
+
+    first = sel[np.unique(idx, return_index=True)[1]]
+    return (
+        (uvw_sum / size[:, None]).astype(np.float32),
+        (vis / w_sum[:, None, :]).astype(np.complex64),
+        (1.0 / np.sqrt(w_sum)).astype(np.float32),
+        first,
+    )
+
+
+def scan_units(ds, chunk_list, channels, pols, bl_max, max_dt):
+    """
+    Read the UVW and FLAG columns (and TIME, ANTENNA1 and ANTENNA2 if max_dt is set)
+    once, chunk by chunk, and find the units that are sampled. These are the good rows
+    or, if max_dt is set, the groups of good rows of one baseline in max_dt time windows
+    (see average_groups). The rows of the last window of a chunk are carried over to the
+    next chunk, so the windows do not depend on the chunk size (if the rows are in
+    time order).
+
+    Returns the good rows (in order), the unit and uvw of each good row, the mean uvw
+    of each unit, and the largest |u|, |v| and |w| of all the rows.
+    """
+    row_list, unit_list, uvw_list, unit_uvw_list = [], [], [], []
+    n_units = 0
+    limit_uvw = np.zeros(3)
+
+    def add_units(rows, uvw, unit):
+        nonlocal n_units
+        if rows.shape[0] == 0:
+            return
+        row_list.append(rows)
+        unit_list.append(n_units + unit)
+        uvw_list.append(uvw)
+        unit_uvw_list.append(unit_means(unit, uvw))
+        n_units += unit_uvw_list[-1].shape[0]
+
+    carry = None  # The (rows, uvw, time, ant1, ant2) of the windows still open
+    last_time = -np.inf
+    in_order = True
+    for begin, end in chunk_list:
+        uvw, good = good_rows(ds, begin, end, channels, pols, bl_max)
+        limit_uvw = np.maximum(limit_uvw, np.max(np.abs(uvw), 0))
+        if max_dt is None:
+            add_units(begin + good, uvw[good], np.arange(good.shape[0]))
+            continue
+
+        time = np.array(ds.TIME.data[begin:end])
+        in_order = in_order and time[0] >= last_time and not np.any(np.diff(time) < 0)
+        last_time = time[-1]
+
+        cols = (
+            begin + good, uvw[good], time[good],
+            np.array(ds.ANTENNA1.data[begin:end])[good],
+            np.array(ds.ANTENNA2.data[begin:end])[good],
+        )
+        if carry is not None:
+            cols = tuple(np.concatenate(c) for c in zip(carry, cols))
+        if cols[0].shape[0] == 0:
+            continue
+
+        window = np.floor(cols[2] / max_dt)
+        done = window < np.floor(last_time / max_dt)
+        carry = tuple(c[~done] for c in cols)
+        if np.any(done):
+            rows, uvw, time, ant1, ant2 = (c[done] for c in cols)
+            add_units(rows, uvw, average_groups(time, ant1, ant2, max_dt))
+
+    if carry is not None and carry[0].shape[0] > 0:
+        rows, uvw, time, ant1, ant2 = carry
+        add_units(rows, uvw, average_groups(time, ant1, ant2, max_dt))
+    if not in_order:
+        logger.warning("Rows are not in time order, some averages may be split")
+
+    if len(row_list) == 0:
+        return (
+            np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+            np.zeros((0, 3), dtype=np.float32), np.zeros((0, 3)), limit_uvw
+        )
+
+    rows = np.concatenate(row_list)
+    order = np.argsort(rows, kind="stable")
+    return (
+        rows[order], np.concatenate(unit_list)[order], np.concatenate(uvw_list)[order],
+        np.concatenate(unit_uvw_list), limit_uvw
+    )
+
+
+def sample_rows(
+    ds, num_vis, bl_max, channels, pols, start=0, stop=None,
+    sampling="random", seed=None, n_bins=8, max_dt=None
+):
+    """
+    Return a selection of (up to) num_vis good rows from the rows start..stop-1
+    of a dask-ms dataset, streaming the row chunks.
+
+    The first pass reads UVW and FLAG (see scan_units) and keeps the good rows, from
+    which num_vis visibilities are chosen. The second pass reads DATA, SIGMA and ROWID
+    for the chosen rows only, from the chunks that contain them.
+
+    -- sampling: "random" chooses the rows uniformly at random (with np.random).
+                 "stratified" counts the good rows in each cell of a (u,v,w) grid
+                 (n_bins cells per axis, covering +/- bl_max), and takes the same
+                 number from each cell (see water_fill), reproducibly from seed.
+    -- max_dt:   If set, the rows of each baseline are averaged in time windows of
+                 max_dt seconds, and num_vis averages are chosen.
+
+    Returns uvw [n, 3], data [n, n_chan, n_pol], sigma [n, n_pol] and the row
+    numbers in the measurement set (the first row of each average).
+    """
+    if sampling not in ("random", "stratified"):
+        raise ValueError("Unknown sampling method {}".format(sampling))
+
+    # Pass 1: Find the good rows (or averages).
+    chunk_list = list(row_chunks(ds, start, stop))
+    rows, unit, uvw, unit_uvw, limit_uvw = scan_units(
+        ds, chunk_list, channels, pols, bl_max, max_dt
+    )
+    n_units = unit_uvw.shape[0]
+    logger.info("Maximum UVW: {}".format(limit_uvw))
+    logger.info("Good Data {} in {} chunks".format(n_units, len(chunk_list)))
+
+    if n_units == 0:
+        raise RuntimeError("No good visibilities in rows {}..{}".format(start, stop))
+
+    if sampling == "stratified":
+        rng = np.random.default_rng(seed)
+        bins = uvw_bins(unit_uvw, bl_max, n_bins)
+        quota = water_fill(np.bincount(bins, minlength=n_bins**3), num_vis)
+        logger.info("Stratified sampling from {} cells".format(np.count_nonzero(quota)))
+        chosen = np.sort(np.concatenate([
+            rng.choice(np.flatnonzero(bins == b), quota[b], replace=False)
+            for b in np.flatnonzero(quota)
+        ]))
+    elif num_vis < n_units:
+        chosen = np.sort(np.random.choice(n_units, num_vis, replace=False))
+    else:
+        chosen = np.arange(n_units)
+
+    # Pass 2: Read the chosen rows, chunk by chunk.
+    sel = np.flatnonzero(np.isin(unit, chosen))
+    chosen_rows = rows[sel]
+    vis_list, sigma_list, index_list = [], [], []
+    for begin, end in chunk_list:
+        lo, hi = np.searchsorted(chosen_rows, [begin, end])
+        if lo == hi:
+            continue
+        r = chosen_rows[lo:hi] - begin
+        sigma_list.append(np.array(ds.SIGMA.data[begin:end][r], dtype=np.float32)[:, pols])
+        vis_list.append(
+            np.array(ds.DATA.data[begin:end, channels][r], dtype=np.complex64)[:, :, pols]
+        )
+        index_list.append(np.array(ds.ROWID.data[begin:end][r]))
+
+    data = np.concatenate(vis_list)
+    sigma = np.concatenate(sigma_list)
+    rowid = np.concatenate(index_list)
+
+    if max_dt is None:
+        return uvw[sel], data, sigma, rowid
+
+    a_uvw, a_vis, a_sigma, first = average_units(unit[sel], chosen, uvw[sel], data, sigma)
+    logger.info(
+        "Averaged in {:g} second windows: {} visibilities".format(max_dt, a_uvw.shape[0])
+    )
+    return a_uvw, a_vis, a_sigma, rowid[first]
+
+
+def log_uvw(uvw, data):
+    """Log the percentiles of the |u|, |v|, |w| and the largest visibility"""
+    for i in range(3):
+        p05, p50, p95 = np.percentile(np.abs(uvw[:, i]), [5, 50, 95])
+        logger.info("       U[{}]: {:5.2f} {:5.2f} {:5.2f}".format(i, p05, p50, p95))
+    logger.info("Max vis {}".format(np.max(np.abs(data))))
+
+
+def field_datasets(ms, field_id, chunks, group_cols=None, spw=None):
+    """
+    The dask-ms datasets (partitioned by group_cols) that belong to the field field_id,
+    and (if spw is not None) to the spectral window spw.
+    """
+    if group_cols is None:
+        datasets = list(xds_from_ms(ms, chunks={"row": chunks}))
+    else:
+        datasets = list(xds_from_ms(ms, group_cols=group_cols, chunks={"row": chunks}))
+    logger.info("DataSets: N={}".format(len(datasets)))
+
+    selected = [ds for ds in datasets if int(ds.FIELD_ID) == int(field_id)]
+    if len(selected) == 0:
+        raise RuntimeError("FIELD_ID ({}) is invalid".format(field_id))
+
+    if spw is not None:
+        phase_dirs, spw_frequencies, ddid_spw = read_spectral_windows(ms)
+        spw = range(len(spw_frequencies))[spw]
+        selected = [ds for ds in selected if ddid_spw[int(ds.DATA_DESC_ID)] == spw]
+        if len(selected) == 0:
+            raise RuntimeError(
+                "FIELD_ID ({}) has no rows in spectral window {}".format(field_id, spw)
+            )
+    return selected
+
+
+def read_rows(
+    ms, num_vis, bl_max, chunks, channels, pols, field_id, sampling="random", seed=None,
+    max_dt=None, spw=-1
+):
+    """
+    Stream the row chunks of the measurement set, and return a selection of (up to)
+    num_vis good rows of the field field_id in the spectral window spw (default the last,
+    as read_metadata). The num_vis are shared between the datasets of the field in
+    proportion to their number of rows (see sample_rows).
+
+    Returns uvw [n, 3], data [n, n_chan, n_pol], sigma [n, n_pol], the row indices
+    and the TIME of the first row.
+    """
+    uvw_list, vis_list, sigma_list, index_list = [], [], [], []
+
+    datasets = field_datasets(ms, field_id, chunks, spw=spw)
+    quota = allocate_quota([ds.DATA.data.shape[0] for ds in datasets], num_vis)
+    for ds, n in zip(datasets, quota):
+        logger.info(
+            "DATASET field_id={} shape: {}".format(ds.FIELD_ID, ds.DATA.data.shape)
+        )
+        if n == 0:
+            continue
+        tic = time.perf_counter()
+
+        uvw, data, sigma, indices = sample_rows(
+            ds, n, bl_max, channels, pols, sampling=sampling, seed=seed, max_dt=max_dt
+        )
+        uvw_list.append(uvw)
+        vis_list.append(data)
+        sigma_list.append(sigma)
+        index_list.append(indices)
+
+        epoch_seconds = np.array(ds.TIME.data[0])
+        logger.info("Elapsed {:04f} seconds".format(time.perf_counter() - tic))
+
+    uvw = np.concatenate(uvw_list)
+    data = np.concatenate(vis_list)
+    sigma = np.concatenate(sigma_list)
+    indices = np.concatenate(index_list)
+
+    log_uvw(uvw, data)
+
+    return uvw, data, sigma, indices, epoch_seconds
+
+
+def time_slices(times, interval=None):
+    """
+    Split rows (in time order) into slices of at most interval seconds. Returns a list
+    of (start, stop) row ranges. If interval is None, all rows are in one slice.
+    """
+    times = np.asarray(times)
+    n = times.shape[0]
+    if n == 0:
+        return []
+    if interval is None:
+        return [(0, n)]
+    if interval <= 0:
+        raise ValueError("Time slice interval ({}) must be positive".format(interval))
+
+    if np.any(np.diff(times) < 0):
+        logger.warning("Rows are not in time order, time slices will be fragmented")
+
+    bins = np.floor((times - times[0]) / interval)
+    edges = np.concatenate(([0], np.flatnonzero(np.diff(bins)) + 1, [n]))
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def stream_time_slices(ds, interval=None):
+    """
+    Yield the (start, stop) rows and the TIME of the first row of each time slice of
+    a dask-ms dataset (the same slices as time_slices), reading the TIME column one
+    row chunk at a time.
+    """
+    n = ds.TIME.data.shape[0]
+    if n == 0:
+        return
+    if interval is None:
+        yield 0, n, np.array(ds.TIME.data[0])
+        return
+    if interval <= 0:
+        raise ValueError("Time slice interval ({}) must be positive".format(interval))
+
+    start, t_start, current, last_time = 0, None, None, -np.inf
+    in_order = True
+    for begin, end in row_chunks(ds):
+        times = np.array(ds.TIME.data[begin:end])
+        in_order = in_order and times[0] >= last_time and not np.any(np.diff(times) < 0)
+        last_time = times[-1]
+        if t_start is None:
+            t_start = times[0]
+            t0 = t_start
+            current = 0.0
+
+        bins = np.floor((times - t0) / interval)
+        for i in np.flatnonzero(np.diff(np.concatenate(([current], bins)))):
+            yield start, begin + i, t_start
+            start, t_start = begin + i, times[i]
+        current = bins[-1]
+
+    if not in_order:
+        logger.warning("Rows are not in time order, time slices will be fragmented")
+    yield start, n, t_start
+
+
+def iter_ms_slices(
+    ms, num_vis, angular_resolution, chunks=1000, channel=0, field_id=0,
+    interval=None, scans=False, sampling="random", seed=None
+):
+    """
+    Yield the visibilities of a measurement set one time slice at a time, with the same
+    tuple as read_ms for each slice.
+
+    -- interval: Split the rows into slices of interval seconds.
+    -- scans:    Split the rows by SCAN_NUMBER (and by interval within each scan).
+
+    The slices are found by streaming the TIME column (see stream_time_slices), and each
+    slice is read (and subsampled to num_vis visibilities) when it is reached.
+    """
+    pol = 0
+    ant_p, phase_dir, frequencies = read_metadata(ms)
+    frequency = frequencies[channel]
+    bl_max = angular_resolution.get_min_baseline(frequency)
+    logger.info("Frequency = {}, Max UVW: {:g} meters".format(frequency, bl_max))
+
+    group_cols = ["FIELD_ID", "DATA_DESC_ID", "SCAN_NUMBER"] if scans else None
+
+    for ds in field_datasets(ms, field_id, chunks, group_cols, spw=-1):
+        logger.info("DATASET {} rows".format(ds.TIME.data.shape[0]))
+
+        for start, stop, epoch_seconds in stream_time_slices(ds, interval):
+            try:
+                uvw, data, sigma, indices = sample_rows(
+                    ds, num_vis, bl_max, slice(channel, channel + 1), [pol], start, stop,
+                    sampling=sampling, seed=seed
+                )
+            except RuntimeError as e:
+                logger.warning("Skipping slice: {}".format(e))
+                continue
+
+            hdr = ms_header(phase_dir, frequency, epoch_seconds)
+            timestamp = ms_timestamp(epoch_seconds)
+
+            yield (
+                uvw[:, 0], uvw[:, 1], uvw[:, 2], frequency,
+                data[:, 0, 0], hdr, timestamp, sigma[:, 0], indices
+            )
+
+
+def read_spectral_windows(ms):
+    """
+    Return the phase direction of each field, the channel frequencies of each
+    spectral window, and the spectral window of each DATA_DESC_ID.
+    """
+    for field_ds in xds_from_table("::".join((ms, "FIELD"))):
+        phase_dirs = np.array(field_ds.PHASE_DIR.data)[:, 0, :]
+
+    spw_frequencies = [
+        np.array(spw_ds.CHAN_FREQ.data).flatten()
+        for spw_ds in xds_from_table("::".join((ms, "SPECTRAL_WINDOW")), group_cols="__row__")
+    ]
+
+    for dd_ds in xds_from_table("::".join((ms, "DATA_DESCRIPTION"))):
+        ddid_spw = np.array(dd_ds.SPECTRAL_WINDOW_ID.data)
+
+    return phase_dirs, spw_frequencies, ddid_spw
+
+
+def read_dataset(ms, field_id, ddid, num_vis, bl_max, chunks, channel):
+    """
+    Read (up to) num_vis good visibilities of one FIELD_ID and DATA_DESC_ID of a
+    measurement set. This is one task of read_ms_parallel. Returns None if there
+    are no good rows.
+    """
+    for ds in xds_from_ms(ms, chunks={"row": chunks}):
+        if int(ds.FIELD_ID) != field_id or int(ds.DATA_DESC_ID) != ddid:
+            continue
+        try:
+            uvw, data, sigma, indices = sample_rows(
+                ds, num_vis, bl_max, slice(channel, channel + 1), [0]
+            )
+        except RuntimeError as e:
+            logger.warning("{} FIELD_ID={}: {}".format(ms, field_id, e))
+            return None
+
+        return {
+            "ms": ms,
+            "field_id": field_id,
+            "epoch_seconds": np.array(ds.TIME.data[0]),
+            "uvw": uvw,
+            "vis": data[:, 0, 0],
+            "rms": sigma[:, 0],
+            "indices": indices,
+        }
+
+    logger.info("No rows with FIELD_ID={} and DATA_DESC_ID={} in {}".format(field_id, ddid, ms))
+    return None
+
+
+def combine_datasets(parts, frequency=None):
+    """
+    Combine the results of several read_dataset tasks into one set of visibilities
+    at a reference frequency (default the lowest frequency). The u,v,w of each part are
+    scaled by frequency / reference, so that the phases of the combined visibilities
+    are correct at the reference frequency (assuming a flat spectrum).
+
+    Returns the read_ms tuple, and the original frequency of each row.
+    """
+    if len(parts) == 0:
+        raise RuntimeError("No visibilities to combine")
+
+    if frequency is None:
+        frequency = np.min([p["frequency"] for p in parts])
+
+    phase_dir = parts[0]["phase_dir"]
+    for p in parts:
+        if not np.allclose(p["phase_dir"], phase_dir):
+            logger.warning(
+                "Combining field {} of {} with a different phase direction".format(
+                    p["field_id"], p["ms"]
+                )
+            )
+
+    uvw = np.concatenate([p["uvw"] * (p["frequency"] / frequency) for p in parts])
+    row_frequency = np.concatenate(
+        [np.full(p["uvw"].shape[0], p["frequency"]) for p in parts]
+    )
+    vis = np.concatenate([p["vis"] for p in parts])
+    rms = np.concatenate([p["rms"] for p in parts])
+    indices = np.concatenate([p["indices"] for p in parts])
+
+    epoch_seconds = np.min([p["epoch_seconds"] for p in parts])
+    hdr = ms_header(phase_dir, frequency, epoch_seconds)
+    timestamp = ms_timestamp(epoch_seconds)
+
+    log_uvw(uvw, vis)
+    rows = (
+        uvw[:, 0], uvw[:, 1], uvw[:, 2], frequency,
+        vis, hdr, timestamp, rms, indices
+    )
+    return rows, row_frequency
+
+
+def read_ms_parallel(
+    ms_list, num_vis, angular_resolution, chunks=1000, channel=0,
+    field_ids=None, spws=None, scheduler="threads"
+):
+    """
+    Read several measurement sets, fields and spectral windows concurrently with dask.
+    Each (measurement set, FIELD_ID, DATA_DESC_ID) is one task, that reads (up to)
+    num_vis visibilities from channel of its spectral window.
+
+    -- field_ids: The FIELD_IDs to read (default all fields)
+    -- spws:      The spectral windows to read (default all)
+    -- scheduler: The dask scheduler ("threads", "processes", or None to use
+                  the current distributed client)
+
+    Returns a list of the datasets that have good rows, each a dict with the visibilities
+    (see read_dataset), its spectral window, frequency and phase direction.
+    """
+    tasks, info = [], []
+    for ms in ms_list:
+        phase_dirs, spw_frequencies, ddid_spw = read_spectral_windows(ms)
+        fields = range(phase_dirs.shape[0]) if field_ids is None else field_ids
+        for field_id in fields:
+            for ddid, spw in enumerate(ddid_spw):
+                if spws is not None and spw not in spws:
+                    continue
+                frequency = spw_frequencies[spw][channel]
+                bl_max = angular_resolution.get_min_baseline(frequency)
+                tasks.append(
+                    dask.delayed(read_dataset)(
+                        ms, field_id, ddid, num_vis, bl_max, chunks, channel
+                    )
+                )
+                info.append(
+                    {"spw": int(spw), "frequency": frequency, "phase_dir": phase_dirs[field_id]}
+                )
+
+    logger.info("Reading {} datasets from {} measurement sets".format(len(tasks), len(ms_list)))
+    tic = time.perf_counter()
+    parts = dask.compute(*tasks, scheduler=scheduler)
+    logger.info("Elapsed {:04f} seconds".format(time.perf_counter() - tic))
+
+    return [dict(p, **i) for p, i in zip(parts, info) if p is not None]
+
+
+def read_ms(
+    ms, num_vis, angular_resolution, chunks=1000, channel=0, field_id=0,
+    sampling="random", seed=None, average=False, smearing=0.25
+):
     """
     Use dask-ms to load the necessary data to create a telescope operator
     (will use uvw positions, and antenna positions)
@@ -42,177 +705,110 @@ def read_ms(ms, num_vis, angular_resolution, chunks=1000, channel=0, field_id=0)
                    d / lambda = 1 / (2 sin(theta))
                    bl_max = lambda / 2sin(theta)
 
+    The measurement set is streamed in row chunks, and the visibilities are chosen
+    by sampling ("random" or "stratified", see sample_rows).
 
+    -- average: Average each baseline over time, and over the channels following
+                channel, as far as the smearing stays below smearing pixels
+                (see smearing_limits).
     """
-
-    # local_cluster = distributed.LocalCluster(processes=False)
-    # address = local_cluster.scheduler_address
-    # logging.info("Using distributed scheduler "
-    # "with address '{}'".format(address))
-    # client = distributed.Client()
+    pol = 0
 
     try:
-        # Create a dataset representing the entire antenna table
-        ant_table = "::".join((ms, "ANTENNA"))
-
-        for ant_ds in xds_from_table(ant_table):
-            # print(ant_ds)
-            # print(dask.compute(ant_ds.NAME.data,
-            # ant_ds.POSITION.data,
-            # ant_ds.DISH_DIAMETER.data))
-            ant_p = np.array(ant_ds.POSITION.data)
-        logger.info("Antenna Positions {}".format(ant_p.shape))
-
-        # Create a dataset representing the field
-        field_table = "::".join((ms, "FIELD"))
-        for field_ds in xds_from_table(field_table):
-            phase_dir = np.array(field_ds.PHASE_DIR.data)[0].flatten()
-            name = field_ds.NAME.data.compute()
-            logger.info("Field {}: Phase Dir {}".format(name, np.degrees(phase_dir)))
-
-        # Create datasets representing each row of the spw table
-        spw_table = "::".join((ms, "SPECTRAL_WINDOW"))
-
-        for spw_ds in xds_from_table(spw_table, group_cols="__row__"):
-            logger.info("CHAN_FREQ.values: {}".format(spw_ds.CHAN_FREQ.values.shape))
-            frequencies = dask.compute(spw_ds.CHAN_FREQ.values)[0].flatten()
-            frequency = frequencies[channel]
-            logger.info("Frequencies = {}".format(frequencies))
-            logger.info("Frequency = {}".format(frequency))
-            logger.info("NUM_CHAN = %f" % np.array(spw_ds.NUM_CHAN.values)[0])
-
-        # Create datasets from a partioning of the MS
-        datasets = list(xds_from_ms(ms, chunks={"row": chunks}))
-        logger.info("DataSets: N={}".format(len(datasets)))
+        ant_p, phase_dir, frequencies = read_metadata(ms)
+        frequency = frequencies[channel]
+        logger.info("Frequency = {}".format(frequency))
+
+        bl_max = angular_resolution.get_min_baseline(frequency)
+        logger.info("Resolution Max UVW: {:g} meters".format(bl_max))
+
+        max_dt = None
+        n_chan = 1
+        if average:
+            max_dt, max_df = smearing_limits(angular_resolution, frequency, smearing)
+            if frequencies.shape[0] > 1:
+                width = np.abs(frequencies[1] - frequencies[0])
+                n_chan = int(np.clip(max_df // width, 1, frequencies.shape[0] - channel))
+            frequency = np.mean(frequencies[channel : channel + n_chan])
+            logger.info(
+                "Averaging {:g} seconds and {} channels (frequency {})".format(
+                    max_dt, n_chan, frequency
+                )
+            )
 
-        pol = 0
+        uvw, data, sigma, indices, epoch_seconds = read_rows(
+            ms, num_vis, bl_max, chunks, slice(channel, channel + n_chan), [pol], field_id,
+            sampling, seed, max_dt
+        )
 
-        def read_np_array(da, title, dtype=np.float32):
-            tic = time.perf_counter()
-            logger.info("Reading {}...".format(title))
-            ret = np.array(da, dtype=dtype)
-            toc = time.perf_counter()
-            logger.info("Elapsed {:04f} seconds".format(toc - tic))
-            return ret
+        # The SIGMA of a row applies to each of its channels
+        data = np.mean(data, axis=1, keepdims=True)
+        sigma = sigma / np.sqrt(n_chan)
 
-        for i, ds in enumerate(datasets):
-            logger.info(
-                "DATASET field_id={} shape: {}".format(ds.FIELD_ID, ds.DATA.data.shape)
-            )
-            logger.info("UVW shape: {}".format(ds.UVW.data.shape))
-            logger.info("SIGMA shape: {}".format(ds.SIGMA.data.shape))
-            if int(field_id) == int(ds.FIELD_ID):
-                uvw = read_np_array(ds.UVW.data, "UVW")
-                flags = read_np_array(
-                    ds.FLAG.data[:, channel, pol], "FLAGS", dtype=np.int32
-                )
+        res_limit = Resolution.from_baseline(np.max(np.abs(uvw)), frequency)
+        logger.info(f"Nyquist resolution: {res_limit}")
 
-                #
-                #
-                #   Now calculate which indices we should use to get the required number of
-                #   visibilities.
-                #
-                bl_max = angular_resolution.get_min_baseline(frequency)
+        hdr = ms_header(phase_dir, frequency, epoch_seconds)
+        timestamp = ms_timestamp(epoch_seconds)
 
-                logger.info("Resolution Max UVW: {:g} meters".format(bl_max))
-                logger.info("Flags: {}".format(flags.shape))
-
-                # Now report the recommended resolution from the data.
-                # 1.0 / 2*np.sin(theta) = limit_u
-                limit_uvw = np.max(np.abs(uvw), 0)
-
-                res_limit = Resolution.from_baseline(np.max(limit_uvw), frequency)
-                logger.info(f"Nyquist resolution: {res_limit}")
-
-                if True:
-                    bl = np.sqrt(uvw[:, 0] ** 2 + uvw[:, 1] ** 2 + uvw[:, 2] ** 2)
-                    # good_data = np.array(np.where((flags == 0) & (np.max(np.abs(uvw), 1) < bl_max))).T.reshape((-1,))
-                    good_data = np.array(
-                        np.where((flags == 0) & (bl < bl_max))
-                    ).T.reshape((-1,))
-                else:
-                    good_data = np.array(np.where(flags == 0)).T.reshape((-1,))
-                logger.info("Good Data {}".format(good_data.shape))
-
-                logger.info("Maximum UVW: {}".format(limit_uvw))
-                logger.info("Minimum UVW: {}".format(np.min(np.abs(uvw), 0)))
-
-                for i in range(3):
-                    p05, p50, p95 = np.percentile(np.abs(uvw[:, i]), [5, 50, 95])
-                    logger.info(
-                        "       U[{}]: {:5.2f} {:5.2f} {:5.2f}".format(i, p05, p50, p95)
-                    )
+    except Exception as e:
+        logger.info("Exception {}".format(e))
+        logger.exception(e)
+        raise
 
-                n_ant = len(ant_p)
+    return (
+        uvw[:, 0], uvw[:, 1], uvw[:, 2], frequency,
+        data[:, 0, 0], hdr, timestamp, sigma[:, 0], indices
+    )
 
-                n_max = len(good_data)
 
-                if n_max <= num_vis:
-                    indices = good_data
-                else:
-                    indices = np.random.choice(
-                        good_data, min(num_vis, n_max), replace=False
-                    )
-                    # sort the indices to keep them in order (speeds up IO)
-                    indices = np.sort(indices)
-                #
-                #
-                #   Now read the remaining data
-                #
-                sigma = read_np_array(ds.SIGMA.data[indices, pol], "SIGMA")
-                # ant1   = read_np_array(ds.ANTENNA1.data[indices], "ANTENNA1")
-                # ant12  = read_np_array(ds.ANTENNA1.data[indices], "ANTENNA2")
-                cv_vis = read_np_array(
-                    ds.DATA.data[indices, channel, pol], "DATA", dtype=np.complex64
-                )
+def read_ms_cube(
+    ms, num_vis, angular_resolution, chunks=1000, channels=None, pols=(0,), field_id=0,
+    sampling="random", seed=None
+):
+    """
+    Load a visibility cube in one pass over the measurement set.
 
-                epoch_seconds = np.array(ds.TIME.data)[0]
-
-        if "uvw" not in locals():
-            raise RuntimeError("FIELD_ID ({}) is invalid".format(field_id))
-
-        hdr = {
-            "CTYPE1": ("RA---SIN", "Right ascension angle cosine"),
-            "CRVAL1": np.degrees(phase_dir)[0],
-            "CUNIT1": "deg     ",
-            "CTYPE2": ("DEC--SIN", "Declination angle cosine "),
-            "CRVAL2": np.degrees(phase_dir)[1],
-            "CUNIT2": "deg     ",
-            "CTYPE3": "FREQ    ",  #           / Central frequency  ",
-            "CRPIX3": 1.0,
-            "CRVAL3": "{}".format(frequency),
-            "CDELT3": 10026896.158854,
-            "CUNIT3": "Hz      ",
-            "EQUINOX": "2000.",
-            "DATE-OBS": "{}".format(epoch_seconds),
-            "BTYPE": "Intensity",
-        }
+    -- channels: The (start, stop) range of channels to read (default all channels)
+    -- pols:     The list of correlations to read, for example [0, 3] for XX and YY.
 
-        # from astropy.wcs.utils import celestial_frame_to_wcs
-        # from astropy.coordinates import FK5
-        # frame = FK5(equinox='J2010')
-        # wcs = celestial_frame_to_wcs(frame)
-        # wcs.to_header()
+    A row is used only if it is unflagged in every selected channel and correlation.
+    The baseline limit is set by the highest selected frequency.
 
-        u_arr = uvw[indices, 0].T
-        v_arr = uvw[indices, 1].T
-        w_arr = uvw[indices, 2].T
+    Returns u, v, w, the channel frequencies, the visibility cube [n_vis, n_chan, n_pol],
+    the header, timestamp, sigma [n_vis, n_pol], and the row indices.
+    """
+    try:
+        ant_p, phase_dir, frequencies = read_metadata(ms)
+        if channels is None:
+            channels = (0, frequencies.shape[0])
+        chan = slice(*channels)
+        frequencies = frequencies[chan]
+        if frequencies.shape[0] == 0:
+            raise ValueError("Channel range {} is empty".format(channels))
+        pols = list(pols)
+        logger.info(
+            "Frequencies = {} .. {} ({} channels), correlations {}".format(
+                frequencies[0], frequencies[-1], frequencies.shape[0], pols
+            )
+        )
 
-        rms_arr = sigma.T
+        bl_max = angular_resolution.get_min_baseline(np.max(frequencies))
+        logger.info("Resolution Max UVW: {:g} meters".format(bl_max))
 
-        logger.info("Max vis {}".format(np.max(np.abs(cv_vis))))
+        uvw, data, sigma, indices, epoch_seconds = read_rows(
+            ms, num_vis, bl_max, chunks, chan, pols, field_id, sampling, seed
+        )
 
-        # Convert from reduced Julian Date to timestamp.
-        timestamp = datetime.datetime(
-            1858, 11, 17, 0, 0, 0, tzinfo=datetime.timezone.utc
-        ) + datetime.timedelta(seconds=epoch_seconds)
+        hdr = ms_header(phase_dir, np.mean(frequencies), epoch_seconds)
+        timestamp = ms_timestamp(epoch_seconds)
 
     except Exception as e:
         logger.info("Exception {}".format(e))
         logger.exception(e)
+        raise
 
-    # finally:
-    # client.close()
-    # local_cluster.close()
-
-    return u_arr, v_arr, w_arr, frequency, cv_vis, hdr, timestamp, rms_arr, indices
+    return (
+        uvw[:, 0], uvw[:, 1], uvw[:, 2], frequencies,
+        data, hdr, timestamp, sigma, indices
+    )
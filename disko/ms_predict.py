@@ -0,0 +1,123 @@
+#
+# Predict the visibilities of a sky image, and write them back to a measurement set.
+#
+# The forward operator is evaluated lazily for each row chunk with dask, and the
+# MODEL_DATA and residual columns are written with xds_to_table, so every row of
+# the field is predicted while the memory used is set by the chunk size.
+#
+import logging
+import time
+
+import dask
+import dask.array as da
+import numpy as np
+
+from daskms import xds_to_table
+
+from .disko import get_harmonic, jomega
+from .ms_helper import read_spectral_windows, field_datasets
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    logging.NullHandler()
+)  # Add other handlers if you're using this as a library
+logger.setLevel(logging.INFO)
+
+
+def parallel_hands(n_corr):
+    """
+    The correlations that measure the total intensity of an unpolarized sky, for the
+    usual orderings (XX, XY, YX, YY), (XX, YY) or (I)
+    """
+    if n_corr == 4:
+        return [0, 3]
+    return list(range(n_corr))
+
+
+def predict_block(uvw, sigma, frequencies, sphere, sky, batch=1024):
+    """
+    The model visibilities [n_row, n_chan, n_corr] of the sky for one block of rows.
+
+    The image is in the units of the naturally weighted visibilities (vis / SIGMA, see
+    DiSkO.from_ms), so the model of the parallel hands is SIGMA times the harmonic sum.
+    The cross hands are zero. This is not the model of an image of averaged visibilities
+    (read_ms with average=True), which are weighted by the sigma of each average.
+    """
+    n_row = uvw.shape[0]
+    n_corr = sigma.shape[1]
+    hands = parallel_hands(n_corr)
+    model = np.zeros((n_row, frequencies.shape[0], n_corr), dtype=np.complex64)
+
+    for k, f in enumerate(frequencies):
+        p2j = jomega(f)
+        for start in range(0, n_row, batch):
+            u, v, w = uvw[start : start + batch].T
+            # The conjugate harmonic, as in make_gamma
+            h = get_harmonic(
+                -p2j, sphere.l, sphere.m, sphere.n_minus_1,
+                u[:, None], v[:, None], w[:, None], sphere.pixel_areas
+            )
+            vis = h @ sky
+            for c in hands:
+                model[start : start + batch, k, c] = vis * sigma[start : start + batch, c]
+    return model
+
+
+def write_model_data(
+    ms, sphere, sky, field_id=0, spws=None, chunks=10000,
+    model_column="MODEL_DATA", residual_column="RESIDUAL_DATA", scheduler="threads"
+):
+    """
+    Predict the visibilities of sky (one value per pixel of sphere) for every row and
+    channel of the field field_id, and write them to model_column. If spws is not None,
+    only the rows of these spectral windows are written. The residuals
+    (DATA - model) are written to residual_column (if it is not None). The columns
+    are created if needed.
+
+    The row chunks are predicted and written in parallel by the dask scheduler.
+    """
+    sky = np.asarray(sky, dtype=np.float64).flatten()
+    if sky.shape[0] != sphere.npix:
+        raise ValueError(
+            "Sky has {} values, but the sphere has {} pixels".format(sky.shape[0], sphere.npix)
+        )
+
+    phase_dirs, spw_frequencies, ddid_spw = read_spectral_windows(ms)
+
+    columns = [model_column]
+    if residual_column is not None:
+        columns.append(residual_column)
+
+    if spws is None:
+        datasets = field_datasets(ms, field_id, chunks)
+    else:
+        datasets = [ds for spw in spws for ds in field_datasets(ms, field_id, chunks, spw=spw)]
+
+    writes = []
+    for ds in datasets:
+        frequencies = spw_frequencies[ddid_spw[int(ds.DATA_DESC_ID)]]
+        data = ds.DATA.data
+
+        model = da.blockwise(
+            predict_block, "rfc",
+            ds.UVW.data, "rx",
+            ds.SIGMA.data, "rc",
+            frequencies, None,
+            sphere, None,
+            sky, None,
+            new_axes={"f": frequencies.shape[0]},
+            concatenate=True,
+            dtype=np.complex64,
+        )
+
+        dims = ("row", "chan", "corr")
+        new_columns = {model_column: (dims, model)}
+        if residual_column is not None:
+            new_columns[residual_column] = (dims, (data - model).astype(data.dtype))
+
+        writes.append(xds_to_table(ds.assign(**new_columns), ms, columns))
+
+    logger.info("Writing {} to {} datasets of {}".format(columns, len(writes), ms))
+    tic = time.perf_counter()
+    dask.compute(writes, scheduler=scheduler)
+    logger.info("Elapsed {:04f} seconds".format(time.perf_counter() - tic))
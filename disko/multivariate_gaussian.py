@@ -1,5 +1,7 @@
 import scipy
 import logging
+import os
+import tempfile
 import h5py
 import json
 
@@ -7,6 +9,7 @@ import numpy as np
 import dask.array as da
 
 from .util import log_array, da_identity, da_block_diag
+from .noise_covariance import StructuredNoiseCovariance
 
 logger = logging.getLogger(__name__)
 logger.addHandler(
@@ -100,7 +103,7 @@ class MultivariateGaussian:
         # A = MultivariateGaussian.square_rechunk(A)
         # b = da_identity(D, chunks=A.chunks)
         b = np.identity(D, dtype=A.dtype)
-        Ainv = scipy.linalg.solve(A, b, sym_pos=True)
+        Ainv = scipy.linalg.solve(A, b, assume_a="pos")
         return Ainv
 
     def sigma_inv(self):
@@ -119,7 +122,8 @@ class MultivariateGaussian:
 
         @param likelihood, measurements
 
-        The self variable is the prior.
+        The self variable is the prior. The precision_y may be a dense matrix or
+        a StructuredNoiseCovariance.
 
         See https://www.microsoft.com/en-us/research/uploads/prod/2006/01/Bishop-Pattern-Recognition-and-Machine-Learning-2006.pdf p92
         """
@@ -128,7 +132,10 @@ class MultivariateGaussian:
         )
 
         L = precision_y
-        atl = A.T @ L
+        if isinstance(L, StructuredNoiseCovariance):
+            atl = L.dot(A).T  # L is symmetric
+        else:
+            atl = A.T @ L
         sigma_inv = self.sigma_inv()
 
         sigma_1_inv = sigma_inv + atl @ A
@@ -161,6 +168,11 @@ class MultivariateGaussian:
 
     @classmethod
     def outer(self, a, b):
+        if isinstance(a, ChunkedMultivariateGaussian) or isinstance(
+            b, ChunkedMultivariateGaussian
+        ):
+            return ChunkedMultivariateGaussian.outer(a, b)
+
         logger.info("outer({}, {})".format(a.mu.shape, b.mu.shape))
         mu = np.block([a.mu.flatten(), b.mu.flatten()])
 
@@ -277,6 +289,9 @@ class MultivariateGaussian:
         var = np.diagonal(self.sigma())
         return np.sqrt(var)
 
+    def covariance_row(self, i):
+        return self.sigma()[i, :]
+
     def to_hdf5(self, filename, json_info="{}"):
         """Save the MultivariateGaussian object,
         to a portable HDF5 format
@@ -313,6 +328,231 @@ class MultivariateGaussian:
 
             mu = h5f["mu"][:]
             sigma = h5f["sigma"][:]
-            sigma_inv = h5f["sigma_inv"][:]
+            if "sigma_inv" in h5f:
+                sigma_inv = h5f["sigma_inv"][:]
+            else:
+                sigma_inv = None
 
         return MultivariateGaussian(mu=mu, sigma=sigma, sigma_inv=sigma_inv)
+
+
+class ChunkedMultivariateGaussian(MultivariateGaussian):
+    """
+    A MultivariateGaussian whose covariance is kept on disk as a chunked HDF5
+    dataset.
+
+    block, outer and variance work on panels of at most tile rows of the
+    covariance. linear_transform also works on panels, but takes a dense A.
+    Their results are new ChunkedMultivariateGaussian objects stored in
+    temporary files in the same directory, which are deleted by close().
+
+    This is not an out-of-core posterior. Other operations (bayes_update,
+    sample, sigma) load the covariance into memory, and the telescope operator
+    that transforms it holds dense D x D matrices.
+    """
+
+    def __init__(self, filename, mode="r", temporary=False, tile=2048):
+        self.dtype = np.float64
+        self.filename = filename
+        self.directory = os.path.dirname(os.path.abspath(filename))
+        self.temporary = temporary
+        self.tile = tile
+
+        self.h5f = h5py.File(filename, mode)
+        self.mu = self.h5f["mu"][:]
+        self.D = self.mu.shape[0]
+        self.sigma_dataset = self.h5f["sigma"]
+
+        d = self.sigma_dataset.shape
+        if (d[0] != self.D) or (d[1] != self.D):
+            raise ValueError(
+                "Covariance {} must be a {}x{} square matrix".format(d, self.D, self.D)
+            )
+
+        self._sigma_inv = None
+        self._chol = None
+
+        logger.info(
+            "ChunkedMultivariateGaussian({}, {})".format(self.mu.shape, filename)
+        )
+
+    @classmethod
+    def empty(cls, mu, directory=None, tile=2048):
+        """
+        Create a temporary file with mean mu, and a zero covariance
+        """
+        mu = np.asarray(mu, dtype=np.float64).flatten()
+        D = mu.shape[0]
+
+        fd, filename = tempfile.mkstemp(
+            suffix=".h5", prefix="disko_sigma_", dir=directory
+        )
+        os.close(fd)
+
+        chunk = max(1, min(D, tile))
+        with h5py.File(filename, "w") as h5f:
+            h5f.create_dataset("mu", data=mu)
+            h5f.create_dataset(
+                "sigma", (D, D), dtype=np.float64, chunks=(chunk, chunk), fillvalue=0
+            )
+
+        return cls(filename, mode="r+", temporary=True, tile=tile)
+
+    @classmethod
+    def from_sigma(cls, mu, sigma, directory=None, tile=2048):
+        """
+        Copy sigma (an array, dask array or HDF5 dataset) to disk, one panel at a time
+        """
+        ret = cls.empty(mu, directory, tile)
+        for i_0, i_1 in ret._panels(ret.D):
+            ret.sigma_dataset[i_0:i_1, :] = np.asarray(sigma[i_0:i_1, :])
+        return ret
+
+    @classmethod
+    def diagonal(cls, mu, diag, directory=None, tile=2048):
+        logger.info("diagonal({}, {})".format(mu.shape, diag.shape))
+        ret = cls.empty(mu, directory, tile)
+        diag = np.asarray(diag).flatten()
+        for i_0, i_1 in ret._panels(ret.D):
+            ret.sigma_dataset[i_0:i_1, i_0:i_1] = np.diag(diag[i_0:i_1])
+        return ret
+
+    @classmethod
+    def from_hdf5(cls, filename, tile=2048):
+        """
+        Open a file written by to_hdf5, without loading the covariance
+        """
+        logger.info("Opening MultivariateGaussian from HDF5 {}".format(filename))
+        return cls(filename, mode="r", temporary=False, tile=tile)
+
+    def _panels(self, n):
+        for i in range(0, n, self.tile):
+            yield i, min(i + self.tile, n)
+
+    def close(self):
+        if self.h5f is not None:
+            self.h5f.close()
+            self.h5f = None
+            if self.temporary:
+                os.remove(self.filename)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def sigma(self):
+        logger.info("Loading {}x{} covariance into memory".format(self.D, self.D))
+        return self.sigma_dataset[:, :]
+
+    def sigma_inv(self):
+        if self._sigma_inv is None:
+            self._sigma_inv = self.sp_inv(self.sigma())
+        return self._sigma_inv
+
+    def linear_transform(self, A, b=None):
+        """
+        Linear transform y = A x + b. The covariance A sigma A^T is formed in two
+        passes over the covariance, with sigma A^T held in a scratch file.
+        """
+        A = np.asarray(A)
+        m = A.shape[0]
+        logger.info("linear_transform({}) tile={}".format(A.shape, self.tile))
+
+        mu_1 = A @ self.mu
+        if b is not None:
+            mu_1 = mu_1 + b
+
+        ret = ChunkedMultivariateGaussian.empty(mu_1, self.directory, self.tile)
+
+        fd, scratch = tempfile.mkstemp(
+            suffix=".h5", prefix="disko_scratch_", dir=self.directory
+        )
+        os.close(fd)
+        try:
+            with h5py.File(scratch, "w") as h5f:
+                W = h5f.create_dataset("W", (self.D, m), dtype=np.float64)
+
+                # W = sigma A^T
+                for k_0, k_1 in self._panels(self.D):
+                    W[k_0:k_1, :] = self.sigma_dataset[k_0:k_1, :] @ A.T
+
+                # A W
+                for i_0, i_1 in self._panels(m):
+                    out = np.zeros((i_1 - i_0, m))
+                    for k_0, k_1 in self._panels(self.D):
+                        out += A[i_0:i_1, k_0:k_1] @ W[k_0:k_1, :]
+                    ret.sigma_dataset[i_0:i_1, :] = out
+        finally:
+            os.remove(scratch)
+
+        return ret
+
+    def block(self, start, stop):
+        logger.info("block({} {})".format(start, stop))
+        ret = ChunkedMultivariateGaussian.empty(
+            self.mu[start:stop], self.directory, self.tile
+        )
+        for i_0, i_1 in ret._panels(ret.D):
+            ret.sigma_dataset[i_0:i_1, :] = self.sigma_dataset[
+                start + i_0 : start + i_1, start:stop
+            ]
+        return ret
+
+    @classmethod
+    def outer(cls, a, b):
+        """
+        The block diagonal combination of a and b, either of which may be in memory.
+        The off-diagonal blocks are never written.
+        """
+        logger.info("outer({}, {})".format(a.mu.shape, b.mu.shape))
+        chunked = a if isinstance(a, ChunkedMultivariateGaussian) else b
+        mu = np.block([a.mu.flatten(), b.mu.flatten()])
+
+        ret = cls.empty(mu, chunked.directory, chunked.tile)
+        offset = 0
+        for x in [a, b]:
+            if isinstance(x, ChunkedMultivariateGaussian):
+                sig = x.sigma_dataset
+            else:
+                sig = x.sigma()
+            for i_0, i_1 in ret._panels(x.D):
+                ret.sigma_dataset[
+                    offset + i_0 : offset + i_1, offset : offset + x.D
+                ] = sig[i_0:i_1, :]
+            offset += x.D
+        return ret
+
+    def variance(self):
+        var = np.zeros(self.D)
+        for i_0, i_1 in self._panels(self.D):
+            var[i_0:i_1] = np.diagonal(self.sigma_dataset[i_0:i_1, i_0:i_1])
+        return np.sqrt(var)
+
+    def covariance_row(self, i):
+        return self.sigma_dataset[i, :]
+
+    def to_hdf5(self, filename, json_info="{}"):
+        """Save to the same format as MultivariateGaussian.to_hdf5, without sigma_inv"""
+        logger.info("Writing ChunkedMultivariateGaussian to HDF5 {}".format(filename))
+        with h5py.File(filename, "w") as h5f:
+            conftype = h5py.special_dtype(vlen=bytes)
+
+            conf_dset = h5f.create_dataset("info", (1,), dtype=conftype)
+            conf_dset[0] = json_info
+
+            sigma = h5f.create_dataset(
+                "sigma",
+                (self.D, self.D),
+                dtype=np.float64,
+                chunks=self.sigma_dataset.chunks,
+                compression="gzip",
+                compression_opts=9,
+            )
+            for i_0, i_1 in self._panels(self.D):
+                sigma[i_0:i_1, :] = self.sigma_dataset[i_0:i_1, :]
+
+            h5f.create_dataset(
+                "mu", data=self.mu, compression="gzip", compression_opts=9
+            )
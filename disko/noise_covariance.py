@@ -0,0 +1,106 @@
+#
+# Structured covariance of the real-valued visibility vector.
+#
+# The visibilities are split into [real, imag] components (see vis_to_real), and
+# the covariance of the resulting vector has four diagonal blocks
+#
+#   Sigma = [ diag(a)  diag(c) ]
+#           [ diag(c)  diag(b) ]
+#
+# which is block-diagonal once the real and imaginary parts of each visibility are
+# paired. Inverses, products and determinants are all O(n_v).
+#
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    logging.NullHandler()
+)  # Add other handlers if you're using this as a library
+logger.setLevel(logging.INFO)
+
+
+class StructuredNoiseCovariance:
+    """
+    A 2n x 2n symmetric matrix [[diag(a), diag(c)], [diag(c), diag(b)]].
+
+    The same class is used for the covariance and for its inverse (the precision),
+    as the inverse has the same structure.
+    """
+
+    def __init__(self, a, b, c):
+        self.a = np.asarray(a, dtype=np.float64).flatten()
+        self.b = np.asarray(b, dtype=np.float64).flatten()
+        self.c = np.asarray(c, dtype=np.float64).flatten()
+        self.n = self.a.shape[0]
+
+        if (self.b.shape[0] != self.n) or (self.c.shape[0] != self.n):
+            raise ValueError(
+                "Diagonals must be the same length {} {} {}".format(
+                    self.a.shape, self.b.shape, self.c.shape
+                )
+            )
+
+        self.det = self.a * self.b - self.c * self.c
+        if np.any(self.det <= 0) or np.any(self.a <= 0):
+            raise ValueError("StructuredNoiseCovariance must be positive definite")
+
+        self.shape = (2 * self.n, 2 * self.n)
+        self.D = 2 * self.n
+
+    @classmethod
+    def from_rms(cls, rms, correlation=0.5):
+        """
+        The covariance used for visibility noise: variance rms^2 in both the real and
+        imaginary components, and covariance correlation*rms^2 between them.
+        """
+        var = np.asarray(rms, dtype=np.float64).flatten() ** 2
+        return cls(var, var, correlation * var)
+
+    def inv(self):
+        return StructuredNoiseCovariance(
+            self.b / self.det, self.a / self.det, -self.c / self.det
+        )
+
+    def logdet(self):
+        return np.sum(np.log(self.det))
+
+    def dot(self, x):
+        """
+        Return self @ x, where x is a vector (2n,) or a matrix (2n, k)
+        """
+        if x.shape[0] != self.D:
+            raise ValueError("Cannot multiply {} by {}".format(self.shape, x.shape))
+
+        if x.ndim == 1:
+            a, b, c = self.a, self.b, self.c
+        else:
+            a, b, c = self.a[:, None], self.b[:, None], self.c[:, None]
+
+        x_1 = x[0 : self.n]
+        x_2 = x[self.n :]
+        return np.concatenate((a * x_1 + c * x_2, c * x_1 + b * x_2))
+
+    def matvec(self, x):
+        return self.dot(x)
+
+    def perturb(self, mu):
+        """
+        Return a sample from N(S mu, S), where S is this matrix. Used when S is
+        the noise precision of a MatrixFreePosterior.
+        """
+        # Cholesky factor of each 2x2 block [[a, c], [c, b]]
+        l_11 = np.sqrt(self.a)
+        l_21 = self.c / l_11
+        l_22 = np.sqrt(self.b - l_21 * l_21)
+
+        z_1 = np.random.normal(0, 1, self.n)
+        z_2 = np.random.normal(0, 1, self.n)
+        return self.dot(mu) + np.concatenate((l_11 * z_1, l_21 * z_1 + l_22 * z_2))
+
+    def to_dense(self):
+        a = np.diag(self.a)
+        b = np.diag(self.b)
+        c = np.diag(self.c)
+        return np.block([[a, c], [c, b]])
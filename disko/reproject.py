@@ -0,0 +1,132 @@
+#
+# Reprojection of sphere pixels onto the regular (l, m) grid of a FITS image.
+#
+# The pixel centres are triangulated once, and each grid point is a weighted sum of
+# the three pixels at the corners of the triangle that contains it (its barycentric
+# coordinates). The weights are a sparse matrix, so each image is reprojected with
+# one sparse matrix-vector product. This is the same as griddata(method="linear").
+# The weights are kept for each sphere geometry and grid, in memory and optionally
+# in a cache directory.
+#
+import os
+import hashlib
+import logging
+import collections
+
+import numpy as np
+import scipy.sparse
+
+from scipy.spatial import Delaunay
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    logging.NullHandler()
+)  # Add other handlers if you're using this as a library
+logger.setLevel(logging.INFO)
+
+
+def sphere_lm(sphere):
+    """
+    The (l, m) plane coordinates of the sphere pixel centres, as used by to_fits
+    """
+    l = np.sin(sphere.az_r) * np.cos(sphere.el_r)
+    m = -np.cos(sphere.az_r) * np.cos(sphere.el_r)
+    return l, m
+
+
+def grid_lm(sphere, width, height):
+    """
+    The (l, m) of each point of the width x height image grid covering the field of view
+    """
+    l0 = np.sin(sphere.fov.radians() / 2)
+    x = np.linspace(-l0, l0, width)
+    y = np.linspace(-l0, l0, height)
+    return np.meshgrid(x, y)
+
+
+def barycentric_weights(points, grid_points):
+    """
+    The sparse matrix (n_grid x n_points) of the linear interpolation weights of the
+    grid points. Rows of grid points outside the convex hull of the points are empty.
+    """
+    tri = Delaunay(points)
+    simplex = tri.find_simplex(grid_points)
+    inside = np.flatnonzero(simplex >= 0)
+
+    T = tri.transform[simplex[inside]]
+    b = np.einsum("ijk,ik->ij", T[:, 0:2], grid_points[inside] - T[:, 2])
+    weights = np.column_stack((b, 1.0 - np.sum(b, axis=1)))
+
+    # Each row has three entries (or none), in order, so the CSR arrays are built directly
+    indptr = np.zeros(grid_points.shape[0] + 1, dtype=np.int64)
+    indptr[inside + 1] = 3
+    indptr = np.cumsum(indptr)
+    cols = tri.simplices[simplex[inside]].flatten()
+    return scipy.sparse.csr_matrix(
+        (weights.flatten().astype(np.float32), cols, indptr),
+        shape=(grid_points.shape[0], points.shape[0]),
+    )
+
+
+class Reprojection:
+    """
+    Reprojects the pixels of a sphere onto a height x width grid, with NaN outside
+    the pixels. Create with Reprojection.from_sphere, which reuses the weights of the
+    same geometry and grid.
+    """
+
+    _memory = collections.OrderedDict()
+    MEMORY_SIZE = 4
+
+    def __init__(self, weights, width, height):
+        self.weights = weights
+        self.width = width
+        self.height = height
+        self.outside = np.diff(weights.indptr) == 0
+
+    @staticmethod
+    def key(sphere, width, height):
+        l, m = sphere_lm(sphere)
+        h = hashlib.sha1()
+        for x in (l, m, np.array([width, height, sphere.fov.radians()])):
+            h.update(np.ascontiguousarray(x, dtype=np.float64).tobytes())
+        return h.hexdigest()
+
+    @classmethod
+    def from_sphere(cls, sphere, width=2000, height=2000, cache=None):
+        """
+        The reprojection of sphere onto a width x height grid. If cache is a directory,
+        the weights are loaded from (or saved to) a file there.
+        """
+        key = cls.key(sphere, width, height)
+        if key in cls._memory:
+            cls._memory.move_to_end(key)
+            return cls._memory[key]
+
+        fname = None if cache is None else os.path.join(cache, "reproject_{}.npz".format(key))
+        if fname is not None and os.path.exists(fname):
+            logger.info("Loading reprojection weights from {}".format(fname))
+            weights = scipy.sparse.load_npz(fname).tocsr()
+        else:
+            logger.info("Computing reprojection weights {}x{}".format(width, height))
+            xx, yy = grid_lm(sphere, width, height)
+            weights = barycentric_weights(
+                np.column_stack(sphere_lm(sphere)), np.column_stack((xx.flatten(), yy.flatten()))
+            )
+            if fname is not None:
+                os.makedirs(cache, exist_ok=True)
+                tmp = "{}.{}.tmp.npz".format(fname[0:-4], os.getpid())
+                scipy.sparse.save_npz(tmp, weights, compressed=False)
+                os.replace(tmp, fname)
+                logger.info("Saved reprojection weights to {}".format(fname))
+
+        ret = cls(weights, width, height)
+        cls._memory[key] = ret
+        if len(cls._memory) > cls.MEMORY_SIZE:
+            cls._memory.popitem(last=False)
+        return ret
+
+    def __call__(self, pixels):
+        grid = self.weights @ np.asarray(pixels, dtype=np.float32)
+        grid[self.outside] = np.nan
+        return grid.reshape((self.height, self.width))
@@ -253,6 +253,9 @@ class Sphere(object):
     def min_res(self):
         raise Exception("min_res not implemented for this sphere")
 
+    def adjacency(self):
+        raise Exception("adjacency not implemented for this sphere")
+
     def to_svg(
         self,
         fname,
@@ -278,27 +281,26 @@ class Sphere(object):
         logger.info(f"Pixels Set {self.pixels.shape}, Image stats: {json.dumps(stats, sort_keys=True)}")
         return stats
 
-    def to_fits(self, fname, title=None, info={}):
+    def to_fits(self, fname, title=None, info={}, method="cubic", cache=None):
+        """
+        Write the image to a 2000x2000 FITS file, interpolated by griddata with method.
+        method="linear" is the same as griddata(method="linear"), but the reprojection
+        weights are computed once for each sphere geometry (and saved in the directory
+        cache, if it is not None), so that each image is one sparse product.
+        """
         from astropy.io import fits
         from scipy.interpolate import griddata
-
-        # Make a grid on the plane, at the width of the narrowest pixel
-        # f = scipy.interpolate.interp2d(self.el_r, self.az_r, self.pixels, fill_value=-1)
-        l = np.sin(self.az_r) * np.cos(self.el_r)
-        m = -np.cos(self.az_r) * np.cos(self.el_r)
-
-        points = (l, m)
-        values = self.pixels
-
-        l0 = np.sin(self.fov.radians() / 2)
+        from .reproject import Reprojection, sphere_lm, grid_lm
 
         width = 2000
         height = 2000
-        x = np.linspace(-l0, l0, width)
-        y = np.linspace(-l0, l0, height)
-        xx, yy = np.meshgrid(x, y)
 
-        grid = griddata(points, values, (xx, yy), method="cubic")
+        if method == "linear":
+            grid = Reprojection.from_sphere(self, width, height, cache=cache)(self.pixels)
+        else:
+            # Make a grid on the plane, at the width of the narrowest pixel
+            xx, yy = grid_lm(self, width, height)
+            grid = griddata(sphere_lm(self), self.pixels, (xx, yy), method=method)
 
         hdr = fits.Header()
         hdr["COMMENT"] = "POINTLESS: {}".format(title)
@@ -359,6 +361,24 @@ class HealpixSphere(Sphere):
     def get_lmn(self):
         return self.l, self.m, self.n
 
+    def adjacency(self):
+        """
+        Return an (E, 2) array of the pairs (i, j), i < j, of neighbouring pixels.
+        i and j are positions in the pixel arrays (not healpix indices), and
+        neighbours outside this sphere are ignored.
+        """
+        neighbours = hp.get_all_neighbours(self.nside, self.pixel_indices)  # (8, npix)
+
+        order = np.argsort(self.pixel_indices)
+        sorted_indices = self.pixel_indices[order]
+        pos = np.clip(np.searchsorted(sorted_indices, neighbours), 0, self.npix - 1)
+        found = (neighbours >= 0) & (sorted_indices[pos] == neighbours)
+
+        i = np.broadcast_to(np.arange(self.npix), neighbours.shape)
+        j = order[pos]
+        mask = found & (i < j)
+        return np.unique(np.stack((i[mask], j[mask]), axis=1), axis=0)
+
     def index_of(self, el, az):
         theta, phi = elaz2hp(el, az)
         return hp.ang2pix(self.nside, theta, phi)
@@ -177,6 +177,22 @@ class AdaptiveMeshSphere(Sphere):
     def min_res(self):
         return self.res_min
 
+    def adjacency(self):
+        """
+        Return an (E, 2) array of the pairs (i, j), i < j, of cells that share an edge.
+        """
+        s = np.sort(self.simplices, axis=1)
+        edges = np.concatenate((s[:, [0, 1]], s[:, [0, 2]], s[:, [1, 2]]))
+        cells = np.tile(np.arange(self.npix), 3)
+
+        order = np.lexsort((edges[:, 1], edges[:, 0]))
+        edges = edges[order]
+        cells = cells[order]
+
+        shared = np.all(edges[1:] == edges[:-1], axis=1)
+        pairs = np.stack((cells[:-1][shared], cells[1:][shared]), axis=1)
+        return np.sort(pairs, axis=1)
+
     def __repr__(self):
         return f"AdaptiveMeshSphere fov={self.fov}, res_min={self.res_min}, N={self.npix}"
 
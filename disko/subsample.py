@@ -0,0 +1,100 @@
+#
+# Choosing which visibilities to use when there are more than needed.
+#
+# Random selection follows the density of the uv coverage, so the short baselines
+# (where the coverage is dense) are over-represented. The stratified selection
+# divides (u,v,w) into a grid of cells and takes the same number of visibilities
+# from each cell (or all of them, if a cell has fewer). The leverage selection
+# chooses rows of the telescope operator in proportion to their statistical leverage.
+#
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    logging.NullHandler()
+)  # Add other handlers if you're using this as a library
+logger.setLevel(logging.INFO)
+
+
+def uvw_bins(uvw, extent, n_bins=8):
+    """
+    The index of the (u,v,w) grid cell of each row of uvw [n, 3]. The grid has
+    n_bins cells along each axis, covering -extent..extent.
+    """
+    cell = np.floor((np.asarray(uvw) + extent) * (n_bins / (2.0 * extent))).astype(int)
+    cell = np.clip(cell, 0, n_bins - 1)
+    return (cell[:, 0] * n_bins + cell[:, 1]) * n_bins + cell[:, 2]
+
+
+def water_fill(counts, total):
+    """
+    Share total samples as evenly as possible between bins, with no more than
+    counts[b] samples from bin b. Leftover samples go to the bins with the most
+    unused rows.
+    """
+    counts = np.asarray(counts, dtype=int)
+    if np.sum(counts) <= total:
+        return counts.copy()
+
+    quota = np.zeros_like(counts)
+    remaining = total
+    while remaining > 0:
+        spare = counts - quota
+        active = np.flatnonzero(spare > 0)
+        share = remaining // active.shape[0]
+        if share == 0:
+            order = active[np.argsort(-spare[active], kind="stable")]
+            quota[order[0:remaining]] += 1
+            break
+        quota[active] += np.minimum(share, spare[active])
+        remaining = total - np.sum(quota)
+    return quota
+
+
+def stratified_choice(uvw, n, extent, n_bins=8, seed=None):
+    """
+    Choose n of the rows of uvw [N, 3] evenly across the cells of the (u,v,w) grid.
+    Returns the sorted row indices.
+    """
+    rng = np.random.default_rng(seed)
+    bins = uvw_bins(uvw, extent, n_bins)
+    counts = np.bincount(bins, minlength=n_bins**3)
+    quota = water_fill(counts, n)
+
+    chosen = [
+        rng.choice(np.flatnonzero(bins == b), quota[b], replace=False)
+        for b in np.flatnonzero(quota)
+    ]
+    logger.info(
+        "Stratified choice of {} rows from {} cells".format(n, np.count_nonzero(counts))
+    )
+    return np.sort(np.concatenate(chosen))
+
+
+def leverage_scores(A):
+    """
+    The statistical leverage of each row of A, the squared row norms of the
+    left singular vectors of A (with non-zero singular values).
+    """
+    U, s, Vh = np.linalg.svd(A, full_matrices=False)
+    rank = np.sum(s > s[0] * max(A.shape) * np.finfo(s.dtype).eps)
+    return np.sum(U[:, 0:rank] ** 2, axis=1)
+
+
+def leverage_choice(scores, n, seed=None):
+    """
+    Choose n rows without replacement, with probability in proportion to their
+    leverage scores. Returns the sorted row indices.
+    """
+    rng = np.random.default_rng(seed)
+    p = np.asarray(scores, dtype=np.float64)
+    p = p / np.sum(p)
+    n_nonzero = np.count_nonzero(p)
+    if n > n_nonzero:
+        # Rows with zero leverage are only used once the others are exhausted
+        rest = np.flatnonzero(p == 0)
+        extra = rng.choice(rest, n - n_nonzero, replace=False)
+        return np.sort(np.concatenate((np.flatnonzero(p), extra)))
+    return np.sort(rng.choice(p.shape[0], n, replace=False, p=p))
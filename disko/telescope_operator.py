@@ -21,7 +21,7 @@ from pathlib import Path
 
 from .sphere import HealpixSphere
 from .disko import vis_to_real
-from .multivariate_gaussian import MultivariateGaussian
+from .multivariate_gaussian import MultivariateGaussian, ChunkedMultivariateGaussian
 
 logger = logging.getLogger(__name__)
 logger.addHandler(
@@ -512,6 +512,34 @@ class TelescopeOperator:
         logger.info("Elapsed {}s".format(time.time() - t0))
         return posterior
 
+    def natural_inference(self, prior, vis_arr, sigma_precision):
+        """
+            Perform the Bayesian update of the prior sky, returning the posterior
+            as a NaturalPosterior (in the natural basis of this operator).
+
+            The prior may be a MultivariateGaussian over the sky, or a NaturalPosterior.
+            A NaturalPosterior in the basis of this operator is used directly, without
+            any transformation. This is the usual case when consecutive measurements
+            have the same geometry.
+        """
+        logger.info("Natural basis inference of sky (n_s = {})".format(prior.D))
+        t0 = time.time()
+
+        if isinstance(prior, NaturalPosterior) and prior.in_basis_of(self):
+            logger.info("Prior is already in the natural basis")
+            prior_r = prior.posterior_r
+            prior_n = prior.prior_n
+        else:
+            n_prior = prior.linear_transform(self.Vh)
+            prior_r = n_prior.block(0, self.rank)
+            prior_n = n_prior.block(self.rank, self.n_s)
+            del n_prior
+
+        posterior_r = prior_r.bayes_update(sigma_precision, vis_arr, self.A_r)
+
+        logger.info("Elapsed {}s".format(time.time() - t0))
+        return NaturalPosterior(self.V, self.rank, posterior_r, prior_n)
+
     def get_prior(self):
 
         # What range should the image have.
@@ -539,3 +567,205 @@ class TelescopeOperator:
         plt.tight_layout()
         plt.savefig("{}_UV.pdf".format(name))
         plt.close()
+
+
+class NaturalPosterior:
+    """
+    A posterior over the sky, kept in the natural basis x = V^H s of a TelescopeOperator.
+
+    x = [x_r, x_n], where x_r ~ posterior_r (the range space, updated by the measurements)
+    and x_n ~ prior_n (the null space, untouched by the measurements). The sky is
+
+        s = V x = V_1 x_r + V_2 x_n
+
+    The dense sky covariance V Sigma V^H is never formed. Quantities in the sky basis are
+    computed from the blocks when they are asked for.
+    """
+
+    def __init__(self, V, rank, posterior_r, prior_n):
+        self.V = V
+        self.rank = rank
+        self.posterior_r = posterior_r
+        self.prior_n = prior_n
+
+        self._V = np.asarray(V)
+        self.D = self._V.shape[0]
+        self._mu = None
+
+        if posterior_r.D + prior_n.D != self.D:
+            raise ValueError(
+                "Blocks {} + {} do not match the basis {}".format(
+                    posterior_r.D, prior_n.D, self._V.shape
+                )
+            )
+
+        # The diagonal of each block covariance, or None for a dense block
+        self._diagonals = [self._diagonal(g) for _, g in self.blocks()]
+
+        logger.info("NaturalPosterior(rank={}, D={})".format(rank, self.D))
+
+    def in_basis_of(self, to):
+        if self.rank != to.rank:
+            return False
+        if self.V is to.V:
+            return True
+        # A posterior loaded by from_hdf5 has its own copy of V
+        V = np.asarray(to.V)
+        return (V.shape == self._V.shape) and np.array_equal(V, self._V)
+
+    def blocks(self):
+        return [
+            (self._V[:, 0 : self.rank], self.posterior_r),
+            (self._V[:, self.rank :], self.prior_n),
+        ]
+
+    @property
+    def mu(self):
+        if self._mu is None:
+            x = np.block([self.posterior_r.mu.flatten(), self.prior_n.mu.flatten()])
+            self._mu = self._V @ x
+        return self._mu
+
+    @staticmethod
+    def _diagonal(g):
+        """
+        The diagonal of the covariance of g, if the covariance is diagonal (as the
+        isotropic prior of the null block), otherwise None
+        """
+        if isinstance(g, ChunkedMultivariateGaussian):
+            return None
+        sigma = np.asarray(g.sigma())
+        diag = np.diagonal(sigma)
+        if np.count_nonzero(sigma) == np.count_nonzero(diag):
+            return diag
+        return None
+
+    @staticmethod
+    def _sigma_product(V_b, g, diag):
+        """
+        Return V_b Sigma_b, where Sigma_b is the covariance of g, and diag
+        its diagonal (or None)
+        """
+        if isinstance(g, ChunkedMultivariateGaussian):
+            ret = np.zeros(V_b.shape)
+            for k_0, k_1 in g._panels(g.D):
+                ret += V_b[:, k_0:k_1] @ g.sigma_dataset[k_0:k_1, :]
+            return ret
+        if diag is not None:
+            return V_b * diag
+        return V_b @ np.asarray(g.sigma())
+
+    def variance(self):
+        """
+        The posterior standard deviation of each pixel (as returned by
+        MultivariateGaussian.variance). The variance of pixel i is the sum over
+        blocks of the row products (V_b Sigma_b)_i . (V_b)_i, which is
+        (V_b^2)_i . diag(Sigma_b) for a diagonal block.
+        """
+        var = np.zeros(self.D)
+        for (V_b, g), diag in zip(self.blocks(), self._diagonals):
+            if g.D == 0:
+                continue
+            if diag is not None:
+                var += (V_b * V_b) @ diag
+            else:
+                var += np.sum(self._sigma_product(V_b, g, diag) * V_b, axis=1)
+        return np.sqrt(np.clip(var, 0, None))
+
+    def covariance_row(self, i):
+        row = np.zeros(self.D)
+        for (V_b, g), diag in zip(self.blocks(), self._diagonals):
+            if g.D > 0:
+                row += V_b @ self._sigma_product(V_b[i : i + 1, :], g, diag).flatten()
+        return row
+
+    def sample(self):
+        x = np.block([self.posterior_r.sample(), self.prior_n.sample()])
+        return self._V @ x
+
+    def natural(self):
+        """
+        The posterior over x = V^H s as a single (block diagonal) MultivariateGaussian
+        """
+        return MultivariateGaussian.outer(self.posterior_r, self.prior_n)
+
+    def linear_transform(self, A, b=None):
+        """
+        The distribution of A s + b. This is a single dense transform by A V.
+        """
+        return self.natural().linear_transform(np.asarray(A) @ self._V, b)
+
+    def to_multivariate(self):
+        """
+        The posterior over the sky as a dense MultivariateGaussian
+        """
+        return self.natural().linear_transform(self._V)
+
+    def to_hdf5(self, filename, json_info="{}"):
+        """
+        Save the basis V, the rank and the two blocks. A block with a diagonal
+        covariance is saved as its diagonal. No dense sky covariance is formed.
+        """
+        logger.info("Writing NaturalPosterior to HDF5 {}".format(filename))
+        with h5py.File(filename, "w") as h5f:
+            conftype = h5py.special_dtype(vlen=bytes)
+
+            conf_dset = h5f.create_dataset("info", (1,), dtype=conftype)
+            conf_dset[0] = json_info
+
+            h5f.create_dataset(
+                "V", data=self._V, compression="gzip", compression_opts=9
+            )
+            h5f.attrs["rank"] = self.rank
+
+            for name, g, diag in [
+                ("posterior_r", self.posterior_r, self._diagonals[0]),
+                ("prior_n", self.prior_n, self._diagonals[1]),
+            ]:
+                grp = h5f.create_group(name)
+                grp.create_dataset(
+                    "mu", data=g.mu, compression="gzip", compression_opts=9
+                )
+                if diag is not None:
+                    grp.create_dataset(
+                        "sigma_diagonal",
+                        data=diag,
+                        compression="gzip",
+                        compression_opts=9,
+                    )
+                else:
+                    grp.create_dataset(
+                        "sigma",
+                        data=np.asarray(g.sigma()),
+                        compression="gzip",
+                        compression_opts=9,
+                    )
+
+    @classmethod
+    def from_hdf5(cls, filename):
+        logger.info("Loading NaturalPosterior from HDF5 {}".format(filename))
+
+        with h5py.File(filename, "r") as h5f:
+            V = h5f["V"][:]
+            rank = int(h5f.attrs["rank"])
+
+            blocks = []
+            for name in ["posterior_r", "prior_n"]:
+                grp = h5f[name]
+                mu = grp["mu"][:]
+                if "sigma_diagonal" in grp:
+                    sigma = np.diag(grp["sigma_diagonal"][:])
+                else:
+                    sigma = grp["sigma"][:]
+                blocks.append(MultivariateGaussian(mu=mu, sigma=sigma))
+
+        return NaturalPosterior(V, rank, blocks[0], blocks[1])
+
+    @staticmethod
+    def is_hdf5(filename):
+        """
+        True if filename was written by NaturalPosterior.to_hdf5 (rather than
+        MultivariateGaussian.to_hdf5)
+        """
+        with h5py.File(filename, "r") as h5f:
+            return "V" in h5f
@@ -0,0 +1,113 @@
+#
+# Copyright Tim Molteno 2019 tim@elec.ac.nz
+#
+
+import unittest
+import logging
+import json
+import asyncio
+import datetime
+import threading
+import http.server
+import urllib.parse
+import urllib.error
+
+import numpy as np
+
+from disko.api_ingest import ApiIngester
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler()) # Add a null handler so logs can go somewhere
+LOGGER.setLevel(logging.INFO)
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    Serves the snapshot in test_data.json. The vis timestamp advances by one second
+    every second request, so the ingester sees repeated snapshots.
+    '''
+    def do_GET(self):
+        server = self.server
+        path = urllib.parse.urlparse(self.path).path
+        with server.lock:
+            server.requests.append(path)
+            if path == '/api/v1/info':
+                body = server.calib_info['info']
+            elif path == '/api/v1/imaging/antenna_positions':
+                body = server.calib_info['ant_pos']
+            elif path == '/api/v1/calibration/gain':
+                body = server.calib_info['gains']
+            elif path == '/api/v1/imaging/vis':
+                server.vis_count += 1
+                t = server.t_0 + datetime.timedelta(seconds=server.vis_count // 2)
+                body = dict(server.calib_info['data'][0][0], timestamp=t.isoformat())
+            elif path == '/catalog/catalog':
+                body = []
+            else:
+                self.send_error(404)
+                return
+
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestApiIngest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        with open('test_data/test_data.json', 'r') as json_file:
+            self.server.calib_info = json.load(json_file)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.vis_count = 0
+        self.server.t_0 = datetime.datetime(2021, 3, 4, 5, 6, 7, tzinfo=datetime.timezone.utc)
+
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.root = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_frames(self):
+        ingester = ApiIngester(self.root, catalog=self.root + '/catalog', interval=0.01)
+
+        async def collect():
+            return [s async for s in ingester.frames(n_frames=3)]
+
+        snapshots = asyncio.run(collect())
+        self.assertEqual(len(snapshots), 3)
+        timestamps = [ts for cv, ts, source_json in snapshots]
+        self.assertEqual(len(set(timestamps)), 3)
+        self.assertEqual(sorted(timestamps), timestamps)
+        for cv, ts, source_json in snapshots:
+            self.assertEqual(source_json, [])
+            self.assertTrue(np.allclose(cv.get_gain(np.arange(24)), self.server.calib_info['gains']['gain']))
+        self.assertEqual(self.server.requests.count('/api/v1/info'), 1)
+
+    def test_iterate(self):
+        ingester = ApiIngester(self.root, queue_size=1, interval=0.01)
+        timestamps = []
+        for cv, ts, source_json in ingester.iterate(n_frames=2):
+            self.assertIsNone(source_json)
+            timestamps.append(ts)
+        self.assertEqual(len(set(timestamps)), 2)
+
+    def test_stop_early(self):
+        ingester = ApiIngester(self.root, queue_size=1, interval=0.01)
+        frames = ingester.iterate()
+        next(frames)
+        frames.close()
+
+    def test_error(self):
+        ingester = ApiIngester(self.root + '/missing', interval=0.01)
+        with self.assertRaises(urllib.error.HTTPError):
+            list(ingester.iterate(n_frames=1))
@@ -0,0 +1,49 @@
+#
+# Copyright Tim Molteno 2019 tim@elec.ac.nz
+#
+
+import unittest
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from disko import HealpixSubSphere
+from disko.batch import BatchImager, expand_paths, group_by_geometry
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler()) # Add a null handler so logs can go somewhere
+LOGGER.setLevel(logging.INFO)
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        for name in ['a.json', 'b.json', 'c.json']:
+            shutil.copy('test_data/test_data.json', os.path.join(self.tmp.name, name))
+        self.sphere = HealpixSubSphere.from_resolution(res_arcmin=600, theta=0.0, phi=0.0, radius_rad=np.radians(60))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_expand_paths(self):
+        paths = expand_paths([os.path.join(self.tmp.name, '*.json')])
+        self.assertEqual([os.path.basename(p) for p in paths], ['a.json', 'b.json', 'c.json'])
+        with self.assertRaises(RuntimeError):
+            expand_paths([os.path.join(self.tmp.name, '*.ms')])
+
+    def test_batch(self):
+        paths = expand_paths([os.path.join(self.tmp.name, '*.json')])
+
+        serial = list(BatchImager(self.sphere, workers=1, alpha=0.1).run(paths))
+        self.assertEqual([p for p, dsko, sky in serial], paths)
+
+        groups = group_by_geometry([(p, dsko) for p, dsko, sky in serial])
+        self.assertEqual(len(groups), 1)
+
+        pooled = list(BatchImager(self.sphere, workers=2, alpha=0.1).run(paths))
+        self.assertEqual([p for p, dsko, sky in pooled], paths)
+        for (_, _, a), (_, _, b) in zip(serial, pooled):
+            self.assertTrue(np.allclose(a, b))
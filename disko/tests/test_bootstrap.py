@@ -0,0 +1,75 @@
+#
+# Copyright Tim Molteno 2019 tim@elec.ac.nz
+#
+
+import unittest
+import logging
+
+import numpy as np
+
+from sklearn import linear_model
+
+import disko
+from disko import DiSkO, HealpixSubSphere, block_cgls, bootstrap
+from disko.bootstrap import centred_operator
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler()) # Add a null handler so logs can go somewhere
+LOGGER.setLevel(logging.INFO)
+
+class TestBootstrap(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        self.M = 30
+        self.N = 12
+        self.A = np.random.normal(0, 1, (self.M, self.N))
+        self.K = 4
+        self.B = np.random.normal(0, 1, (self.M, self.K))
+
+    def test_block_cgls(self):
+        damp = 0.5
+        weights = np.random.uniform(0, 3, (self.M, self.K))
+        X, niter = block_cgls(self.A, self.B, damp=damp, weights=weights, niter=200, tol=1e-12)
+
+        for k in range(self.K):
+            W = np.diag(weights[:, k])
+            x = np.linalg.solve(self.A.T @ W @ self.A + damp**2*np.identity(self.N), self.A.T @ W @ self.B[:, k])
+            self.assertTrue(np.allclose(X[:, k], x))
+
+    def test_bootstrap(self):
+        d = self.B[:, 0]
+        for method in ["resample", "noise"]:
+            mean, std = bootstrap(self.A, d, 16, damp=0.1, method=method, seed=1)
+            self.assertEqual(std.shape, (self.N,))
+            self.assertTrue(np.all(std > 0))
+
+    def test_centred(self):
+        # The centred problem is the ridge fit with an intercept of image_tikhonov
+        C = centred_operator(self.A)
+        A_c = self.A - np.mean(self.A, axis=0)
+        X = np.random.normal(0, 1, (self.N, self.K))
+        self.assertTrue(np.allclose(C @ X, A_c @ X))
+        self.assertTrue(np.allclose(C.H @ self.B, A_c.T @ self.B))
+        self.assertTrue(np.allclose(C @ X[:, 0], A_c @ X[:, 0]))
+
+        alpha = 2.0
+        b = self.B[:, 0]
+        reg = linear_model.Ridge(alpha=alpha).fit(self.A, b)
+        x, _ = block_cgls(C, (b - np.mean(b)).reshape(-1, 1), damp=np.sqrt(alpha), niter=200, tol=1e-12)
+        self.assertTrue(np.allclose(x[:, 0], reg.coef_))
+
+    def test_operator_matmat(self):
+        sphere = HealpixSubSphere.from_resolution(res_arcmin=600,
+                                      theta = np.radians(0.0), phi=0.0, radius_rad=np.radians(60))
+        n_vis = 5
+        frequency = 1.5e9
+        dsk = DiSkO(np.random.uniform(0,1, n_vis), np.random.uniform(0,1, n_vis), np.random.uniform(0,1, n_vis), frequency)
+        gamma = dsk.make_gamma(sphere)
+        data = dsk.vis_to_data(np.random.normal(0,1,n_vis) + 1.0j*np.random.normal(0,1,n_vis))
+        Op = disko.DiSkOOperator(dsk.u_arr, dsk.v_arr, dsk.w_arr, data, [frequency], sphere)
+
+        X = np.random.normal(0, 1, (sphere.npix, 3))
+        Y = np.random.normal(0, 1, (2*n_vis, 3))
+        self.assertTrue(np.allclose(Op @ X, gamma @ X))
+        self.assertTrue(np.allclose(Op.H @ Y, gamma.T @ Y))
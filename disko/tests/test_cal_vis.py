@@ -0,0 +1,95 @@
+#
+# Copyright Tim Molteno 2019 tim@elec.ac.nz
+#
+
+import unittest
+import logging
+import json
+import copy
+
+import numpy as np
+
+from disko import DiSkO, get_all_uvw, HealpixSubSphere
+from disko.disko import baseline_indices
+
+from tart.operation import settings
+from tart_tools import api_imaging
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler()) # Add a null handler so logs can go somewhere
+LOGGER.setLevel(logging.INFO)
+
+class TestCalVis(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        fname = 'test_data/test_data.json'
+        with open(fname, 'r') as json_file:
+            calib_info = json.load(json_file)
+
+        info = calib_info['info']
+        cls.ant_pos = np.array(calib_info['ant_pos'])
+        config = settings.from_api_json(info['info'], cls.ant_pos)
+
+        gains = np.asarray(calib_info['gains']['gain'])
+        phase_offsets = np.asarray(calib_info['gains']['phase_offset'])
+
+        vis_json, source_json = calib_info['data'][0]
+        cls.cv, _timestamp = api_imaging.vis_calibrated(vis_json, config, gains, phase_offsets, [])
+
+    def test_baseline_order(self):
+        num_ant = self.ant_pos.shape[0]
+        baselines, uu, vv, ww = get_all_uvw(self.ant_pos)
+        expected = [[i, j] for i in range(num_ant) for j in range(num_ant) if i != j]
+        self.assertEqual(baselines, expected)
+
+        i, j = baseline_indices(num_ant)
+        self.assertIs(i, baseline_indices(num_ant)[0])
+        self.assertTrue(np.allclose(uu, self.ant_pos[i, 0] - self.ant_pos[j, 0]))
+        self.assertTrue(np.allclose(ww, self.ant_pos[i, 2] - self.ant_pos[j, 2]))
+
+    def test_from_cal_vis(self):
+        dsko = DiSkO.from_cal_vis(self.cv)
+        baselines, _, _, _ = get_all_uvw(self.ant_pos)
+        expected = np.array([self.cv.get_visibility(i, j) for i, j in baselines])
+        self.assertTrue(np.allclose(dsko.vis_arr, expected))
+
+    def test_flagged(self):
+        cv = copy.deepcopy(self.cv)
+        cv.flag_baseline(0, 1)
+        with self.assertRaises(RuntimeError):
+            DiSkO.from_cal_vis(cv)
+
+    def test_from_cal_vis_list(self):
+        cv2 = copy.deepcopy(self.cv)
+        cv2.vis.v = list(np.asarray(self.cv.vis.v) * 2.0)
+
+        dsko = DiSkO.from_cal_vis_list([self.cv, cv2])
+        self.assertEqual(dsko.vis_stack.shape, (2, dsko.n_v))
+        self.assertTrue(np.allclose(dsko.vis_stack[1], 2.0 * dsko.vis_stack[0]))
+        self.assertTrue(np.allclose(dsko.vis_arr, dsko.vis_stack[0]))
+        self.assertEqual(len(dsko.timestamps), 2)
+
+        cv2.get_config().Dict['frequency'] = 2.0e9
+        with self.assertRaises(ValueError):
+            DiSkO.from_cal_vis_list([self.cv, cv2])
+
+    def test_snapshots(self):
+        cv2 = copy.deepcopy(self.cv)
+        cv2.vis.v = list(np.asarray(self.cv.vis.v) * 0.5 + 0.1)
+        dsko = DiSkO.from_cal_vis_list([self.cv, cv2])
+
+        sphere = HealpixSubSphere.from_resolution(res_arcmin=600, theta=0.0, phi=0.0, radius_rad=np.radians(60))
+
+        skies = list(dsko.image_snapshots(dsko.vis_stack, sphere, alpha=0.1))
+        self.assertEqual(len(skies), 2)
+        for sky, vis_arr in zip(skies, dsko.vis_stack):
+            expected = dsko.image_tikhonov(vis_arr, sphere, alpha=0.1, scale=False)
+            self.assertTrue(np.allclose(sky, expected, atol=1e-6*np.max(np.abs(expected))))
+
+        skies = list(dsko.image_snapshots(dsko.vis_stack, sphere, alpha=0.1, method="lsqr", niter=500))
+        expected = dsko.solve_matrix_free(dsko.vis_to_data(dsko.vis_stack[1]), sphere, alpha=0.1, scale=False, niter=500)
+        self.assertTrue(np.allclose(skies[1], expected, atol=1e-4*np.max(np.abs(expected))))
+
+        with self.assertRaises(ValueError):
+            next(dsko.image_snapshots(dsko.vis_stack, sphere, alpha=0.1, method="fista"))
@@ -0,0 +1,56 @@
+#
+# Copyright Tim Molteno 2019 tim@elec.ac.nz
+#
+
+import unittest
+import logging
+import os
+import io
+import shutil
+import itertools
+import tempfile
+
+import numpy as np
+
+from disko import DiSkO, HealpixSubSphere
+from disko.daemon import ImagingDaemon, watch_paths, stream_paths
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler()) # Add a null handler so logs can go somewhere
+LOGGER.setLevel(logging.INFO)
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.json_file = os.path.join(self.tmp.name, 'a.json')
+        shutil.copy('test_data/test_data.json', self.json_file)
+        self.sphere = HealpixSubSphere.from_resolution(res_arcmin=600, theta=0.0, phi=0.0, radius_rad=np.radians(60))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_stream_paths(self):
+        stream = io.StringIO("a.ms\n\n  b.json \n")
+        self.assertEqual(list(stream_paths(stream)), ['a.ms', 'b.json'])
+
+    def test_watch_paths(self):
+        open(os.path.join(self.tmp.name, 'ignore.txt'), 'w').close()
+        os.makedirs(os.path.join(self.tmp.name, 'b.ms'))
+        paths = list(itertools.islice(watch_paths(self.tmp.name, interval=0.01, settle=0.0), 2))
+        self.assertEqual([os.path.basename(p) for p in paths], ['a.json', 'b.ms'])
+
+    def test_process(self):
+        daemon = ImagingDaemon(self.sphere, method='tikhonov', alpha=0.1)
+        (dsko, sky), = list(daemon.process(self.json_file))
+        expected = dsko.image_tikhonov(dsko.vis_arr, self.sphere, alpha=0.1, scale=False)
+        self.assertTrue(np.allclose(sky, expected, atol=1e-6*np.max(np.abs(expected))))
+        self.assertEqual(set(daemon.latency), {'read', 'image', 'total'})
+
+        # A snapshot file with the same geometry reuses the imager
+        h5_file = os.path.join(self.tmp.name, 'b.h5')
+        dsko.vis_arr = 2.0 * dsko.vis_arr
+        dsko.to_file(h5_file)
+        (_, sky_2), = list(daemon.process(h5_file))
+        self.assertEqual(len(daemon.imagers), 1)
+        self.assertTrue(np.allclose(sky_2, 2.0 * sky))
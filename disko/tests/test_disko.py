@@ -111,6 +111,13 @@ class TestDiSkO(unittest.TestCase):
             dot = h_i @ h_i.conj().T
             self.assertAlmostEqual(dot, val)
   
+    def test_geometry_key(self):
+        same = DiSkO(self.disko.u_arr.copy(), self.disko.v_arr.copy(), self.disko.w_arr.copy(), self.disko.frequency)
+        self.assertEqual(same.geometry_key(), self.disko.geometry_key())
+
+        moved = DiSkO(self.disko.u_arr + 0.1, self.disko.v_arr, self.disko.w_arr, self.disko.frequency)
+        self.assertNotEqual(moved.geometry_key(), self.disko.geometry_key())
+
     @unittest.skip("Should Fail as the adaptive mesh harmonics dont work")
     def test_adaptive_harmonics_normalized(self):
         ### Check the harmonics are normalized.
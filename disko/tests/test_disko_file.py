@@ -0,0 +1,79 @@
+#
+# Copyright Tim Molteno 2019 tim@elec.ac.nz
+#
+
+import unittest
+import logging
+import os
+import tempfile
+import datetime
+
+import numpy as np
+
+from disko import DiSkO
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler()) # Add a null handler so logs can go somewhere
+LOGGER.setLevel(logging.INFO)
+
+class TestDiSkOFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.tmp.name, "snapshots.h5")
+
+        ant_pos = np.random.normal(0, 5, (6, 3))
+        t_0 = datetime.datetime(2021, 3, 4, 5, 6, 7, tzinfo=datetime.timezone.utc)
+        self.snapshots = []
+        for k in range(3):
+            dsko = DiSkO.from_ant_pos(ant_pos, 1.57542e9)
+            dsko.vis_arr = np.random.normal(0, 1, dsko.n_v) + 1.0j*np.random.normal(0, 1, dsko.n_v)
+            dsko.timestamp = t_0 + datetime.timedelta(seconds=k)
+            dsko.info = {"CRVAL1": np.float64(12.5), "CTYPE1": ("RA---SIN", "Right ascension angle cosine")}
+            self.snapshots.append(dsko)
+        self.snapshots[1].rms = np.random.uniform(1, 2, dsko.n_v)
+        self.snapshots[1].indices = np.arange(dsko.n_v // 2) * 3
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def check_same(self, a, b):
+        for name in DiSkO.SNAPSHOT_FIELDS[0:4]:
+            self.assertTrue(np.allclose(getattr(a, name), getattr(b, name)))
+        self.assertEqual(a.frequency, b.frequency)
+        self.assertEqual(a.timestamp, b.timestamp)
+        self.assertEqual(a.info, b.info)
+
+    def test_append(self):
+        for k, dsko in enumerate(self.snapshots):
+            self.assertEqual(dsko.to_file(self.fname), k)
+
+        loaded = DiSkO.from_file_all(self.fname)
+        self.assertEqual(len(loaded), 3)
+        for a, b in zip(loaded, self.snapshots):
+            self.check_same(a, b)
+
+        self.assertIsNone(loaded[0].rms)
+        self.assertIsNone(loaded[0].indices)
+        self.assertTrue(np.allclose(loaded[1].rms, self.snapshots[1].rms))
+        self.assertTrue(np.array_equal(loaded[1].indices, self.snapshots[1].indices))
+
+        self.assertEqual(DiSkO.file_timestamps(self.fname), [d.timestamp for d in self.snapshots])
+
+    def test_random_access(self):
+        for dsko in self.snapshots:
+            dsko.to_file(self.fname)
+
+        self.check_same(DiSkO.from_file(self.fname), self.snapshots[-1])
+        self.check_same(DiSkO.from_file(self.fname, index=0), self.snapshots[0])
+        self.check_same(DiSkO.from_file(self.fname, timestamp=self.snapshots[1].timestamp), self.snapshots[1])
+
+        with self.assertRaises(ValueError):
+            DiSkO.from_file(self.fname, timestamp=self.snapshots[0].timestamp - datetime.timedelta(seconds=1))
+
+    def test_size_mismatch(self):
+        self.snapshots[0].to_file(self.fname)
+        other = DiSkO.from_ant_pos(np.random.normal(0, 5, (4, 3)), 1.57542e9)
+        other.vis_arr = np.zeros(other.n_v)
+        with self.assertRaises(ValueError):
+            other.to_file(self.fname)
@@ -0,0 +1,83 @@
+#
+# Copyright Tim Molteno 2019 tim@elec.ac.nz
+#
+
+import unittest
+import logging
+
+import numpy as np
+import scipy.linalg
+from scipy.stats import multivariate_normal
+
+from disko import EvidenceOptimizer, MultivariateGaussian, NaturalPosterior
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler()) # Add a null handler so logs can go somewhere
+LOGGER.setLevel(logging.INFO)
+
+
+class SmallOperator:
+    # The parts of a TelescopeOperator used by the EvidenceOptimizer
+    def __init__(self, gamma):
+        self.gamma = gamma
+        self.n_v, self.n_s = gamma.shape
+        U, s, Vh = scipy.linalg.svd(gamma, full_matrices=True)
+        self.rank = s.shape[0]
+        self.s = s
+        self.U_1 = U[:, 0:self.rank]
+        self.Vh = Vh
+        self.V = Vh.T
+
+
+class TestEvidence(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        self.n_v = 40
+        self.n_s = 16
+        self.gamma = np.random.normal(0, 1, (self.n_v, self.n_s))
+        self.to = SmallOperator(self.gamma)
+
+        self.mu_0 = 0.2
+        sky = np.random.normal(self.mu_0, 1.5, self.n_s)
+        self.y = self.gamma @ sky + np.random.normal(0, 0.3, self.n_v)
+        self.opt = EvidenceOptimizer(self.to, self.y, self.mu_0)
+
+    def test_log_evidence(self):
+        sigma_v, sigma_p = 0.4, 1.2
+        cov = sigma_p**2 * self.gamma @ self.gamma.T + sigma_v**2 * np.identity(self.n_v)
+        expected = multivariate_normal.logpdf(self.y, mean=self.gamma @ (np.zeros(self.n_s) + self.mu_0), cov=cov)
+
+        log_z, grad = self.opt.log_evidence(sigma_v, sigma_p)
+        self.assertAlmostEqual(log_z, expected)
+
+    def test_gradient(self):
+        theta = np.log([0.4**2, 1.2**2])
+        log_z, grad = self.opt.log_evidence(*np.exp(theta/2))
+        eps = 1e-6
+        for i in range(2):
+            d = np.zeros(2)
+            d[i] = eps
+            f_plus, _ = self.opt.log_evidence(*np.exp((theta + d)/2))
+            f_minus, _ = self.opt.log_evidence(*np.exp((theta - d)/2))
+            self.assertAlmostEqual(grad[i], (f_plus - f_minus)/(2*eps), 5)
+
+    def test_optimize(self):
+        sigma_v, sigma_p, log_z = self.opt.optimize(1.0, 1.0)
+        for s_v, s_p in [(sigma_v*1.1, sigma_p), (sigma_v, sigma_p*0.9)]:
+            other, _ = self.opt.log_evidence(s_v, s_p)
+            self.assertGreater(log_z, other)
+
+    def test_posterior(self):
+        sigma_v, sigma_p = 0.4, 1.2
+        prior = MultivariateGaussian(np.zeros(self.n_s) + self.mu_0, sigma=sigma_p**2*np.identity(self.n_s))
+        expected = prior.bayes_update(np.identity(self.n_v)/sigma_v**2, self.y, self.gamma)
+
+        posterior = self.opt.posterior(sigma_v, sigma_p)
+        self.assertTrue(np.allclose(posterior.mu, expected.mu))
+        self.assertTrue(np.allclose(posterior.variance(), expected.variance()))
+
+        # The null block is the isotropic prior, so its variance uses only the diagonal
+        self.assertIsNotNone(NaturalPosterior._diagonal(posterior.prior_n))
+        for i in [0, self.n_s - 1]:
+            self.assertTrue(np.allclose(posterior.covariance_row(i), expected.covariance_row(i)))
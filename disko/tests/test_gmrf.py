@@ -0,0 +1,56 @@
+#
+# Copyright Tim Molteno 2019 tim@elec.ac.nz
+#
+
+import unittest
+import logging
+
+import numpy as np
+
+from disko import GMRFPrior, HealpixSphere, MatrixFreePosterior
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler()) # Add a null handler so logs can go somewhere
+LOGGER.setLevel(logging.INFO)
+
+class TestGMRF(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        self.sphere = HealpixSphere(2)
+        self.prior = GMRFPrior.from_variance(self.sphere, mu=0.5, variance=2.0, length=2.0)
+
+    def test_adjacency(self):
+        edges = self.sphere.adjacency()
+        self.assertTrue(np.all(edges[:, 0] < edges[:, 1]))
+        # Every healpix pixel has 7 or 8 neighbours
+        degree = np.bincount(edges.flatten(), minlength=self.sphere.npix)
+        self.assertTrue(np.all(degree >= 7))
+        self.assertTrue(np.all(degree <= 8))
+
+    def test_precision(self):
+        Q = self.prior.precision().toarray()
+        self.assertTrue(np.allclose(Q, Q.T))
+        self.assertTrue(np.all(np.linalg.eigvalsh(Q) > 0))
+        x = np.random.normal(0, 1, self.sphere.npix)
+        self.assertTrue(np.allclose(self.prior.matvec(x), Q @ x))
+        self.assertTrue(np.allclose(Q @ self.prior.solve(x), x))
+
+    def test_perturb(self):
+        Q = self.prior.precision().toarray()
+        N = 20000
+        samples = np.array([self.prior.perturb(np.zeros(self.sphere.npix)) for i in range(N)])
+        self.assertTrue(np.allclose(np.cov(samples.T), Q, atol=0.05*np.max(Q)))
+
+    def test_posterior(self):
+        n_v = 20
+        A = np.random.normal(0, 1, (n_v, self.sphere.npix))
+        y = np.random.normal(0, 1, n_v)
+
+        Q = self.prior.precision().toarray()
+        P = A.T @ A + Q
+        mu = np.linalg.solve(P, A.T @ y + Q @ self.prior.mu)
+
+        posterior = MatrixFreePosterior(A, y, noise_precision=1.0,
+                                        prior_mu=self.prior.mu, prior_precision=self.prior, tol=1e-12)
+        self.assertTrue(np.allclose(posterior.mu, mu))
@@ -0,0 +1,54 @@
+#
+# Copyright Tim Molteno 2019 tim@elec.ac.nz
+#
+
+import unittest
+import logging
+import os
+import tempfile
+import datetime
+
+import numpy as np
+
+from disko import HealpixSubSphere
+from disko.image_cube import ImageCubeWriter, read_image_cube
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler()) # Add a null handler so logs can go somewhere
+LOGGER.setLevel(logging.INFO)
+
+class TestImageCube(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.tmp.name, 'cube.h5')
+        self.sphere = HealpixSubSphere.from_resolution(res_arcmin=600, theta=0.0, phi=0.0, radius_rad=np.radians(60))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_append(self):
+        t_0 = datetime.datetime(2021, 3, 4, 5, 6, 7, tzinfo=datetime.timezone.utc)
+        images = np.random.normal(0, 1, (5, 2, self.sphere.npix))
+        with ImageCubeWriter(self.fname, self.sphere, frequencies=[1.5e9, 1.6e9], queue_size=2) as cube:
+            for k, image in enumerate(images):
+                cube.append(image, t_0 + datetime.timedelta(seconds=k))
+
+        cube_images, timestamps, geometry = read_image_cube(self.fname)
+        self.assertEqual(cube_images.shape, (5, 2, self.sphere.npix))
+        self.assertTrue(np.allclose(cube_images, images, atol=1e-6))
+        self.assertTrue(np.allclose(timestamps - t_0.timestamp(), np.arange(5)))
+        self.assertTrue(np.allclose(geometry['el_r'], self.sphere.el_r))
+        self.assertTrue(np.array_equal(geometry['pixel_indices'], self.sphere.pixel_indices))
+
+        cube_images, timestamps, geometry = read_image_cube(self.fname, time=slice(3, 5))
+        self.assertTrue(np.allclose(cube_images, images[3:5], atol=1e-6))
+
+    def test_closed(self):
+        cube = ImageCubeWriter(self.fname, self.sphere)
+        cube.append(np.zeros((self.sphere.npix, 1)))
+        cube.close()
+        with self.assertRaises(RuntimeError):
+            cube.append(np.zeros(self.sphere.npix))
+        _, timestamps, _ = read_image_cube(self.fname)
+        self.assertTrue(np.isnan(timestamps[0]))
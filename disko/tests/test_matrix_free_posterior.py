@@ -0,0 +1,78 @@
+#
+# Copyright Tim Molteno 2019 tim@elec.ac.nz
+#
+
+import unittest
+import logging
+
+import numpy as np
+
+from disko import MultivariateGaussian, MatrixFreePosterior, conjugate_gradient
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler()) # Add a null handler so logs can go somewhere
+LOGGER.setLevel(logging.INFO)
+
+class TestMatrixFreePosterior(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        self.n_v = 12
+        self.n_s = 8
+        self.A = np.random.normal(0, 1, (self.n_v, self.n_s))
+        self.y = np.random.normal(0, 1, self.n_v)
+        self.sigma_v = 0.5
+        self.prior_var = 2.0
+        self.prior_mu = 0.3
+
+    def dense_posterior(self):
+        # The explicit posterior (Bishop p92)
+        precision = self.A.T @ self.A / self.sigma_v**2 + np.identity(self.n_s) / self.prior_var
+        sigma = np.linalg.inv(precision)
+        mu = sigma @ (self.A.T @ self.y / self.sigma_v**2 + self.prior_mu / self.prior_var)
+        return MultivariateGaussian(mu, sigma=sigma)
+
+    def matrix_free_posterior(self):
+        return MatrixFreePosterior(self.A, self.y,
+                                   noise_precision=1.0/self.sigma_v**2,
+                                   prior_mu=self.prior_mu,
+                                   prior_precision=1.0/self.prior_var)
+
+    def test_cg(self):
+        a = np.random.normal(0, 1, (10, 10))
+        P = a @ a.T + np.identity(10)
+        b = np.random.normal(0, 1, 10)
+        x, niter = conjugate_gradient(lambda x: P @ x, b)
+        self.assertTrue(np.allclose(P @ x, b))
+        self.assertTrue(niter <= 20)
+
+    def test_mean(self):
+        dense = self.dense_posterior()
+        post = self.matrix_free_posterior()
+        self.assertTrue(np.allclose(post.mu, dense.mu))
+
+    def test_sampling(self):
+        dense = self.dense_posterior()
+        post = self.matrix_free_posterior()
+
+        N = 4000
+        samples = np.array([post.sample() for i in range(N)])
+
+        self.assertTrue(np.allclose(np.mean(samples, axis=0), dense.mu, atol=0.05))
+        self.assertTrue(np.allclose(np.cov(samples.T), dense.sigma(), atol=0.02))
+
+    def test_variance(self):
+        dense = self.dense_posterior()
+        post = self.matrix_free_posterior()
+
+        for method in ['hutchinson', 'samples']:
+            var, err = post.variance_estimate(n_samples=400, method=method)
+            diag = np.diagonal(dense.sigma())
+            self.assertTrue(np.all(np.abs(var - diag) < 5*err + 1e-12))
+            self.assertTrue(np.all(err < 0.2*diag))
+
+    def test_covariance_row(self):
+        dense = self.dense_posterior()
+        post = self.matrix_free_posterior()
+        for i in [0, 3, 7]:
+            self.assertTrue(np.allclose(post.covariance_row(i), dense.covariance_row(i)))
@@ -0,0 +1,148 @@
+#
+# Copyright Tim Molteno 2019 tim@elec.ac.nz
+#
+
+import unittest
+import logging
+
+import types
+
+import numpy as np
+import dask.array as da
+
+from disko.ms_helper import allocate_quota, time_slices, combine_datasets
+from disko.ms_helper import smearing_limits, average_groups, average_units, OMEGA_EARTH
+from disko.ms_helper import sample_rows, stream_time_slices
+from disko import Resolution
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler()) # Add a null handler so logs can go somewhere
+LOGGER.setLevel(logging.INFO)
+
+def fake_dataset(time, ant1, ant2, chunks):
+    """A stand in for a dask-ms dataset, with the columns that sample_rows reads"""
+    n = time.shape[0]
+    rng = np.random.default_rng(5)
+    columns = {
+        "TIME": time,
+        "ANTENNA1": ant1,
+        "ANTENNA2": ant2,
+        "UVW": rng.normal(0, 1, (n, 3)),
+        "FLAG": np.zeros((n, 1, 1), dtype=bool),
+        "SIGMA": rng.uniform(1, 2, (n, 1)),
+        "DATA": rng.normal(0, 1, (n, 1, 1)) + 1.0j*rng.normal(0, 1, (n, 1, 1)),
+        "ROWID": np.arange(n),
+    }
+    return types.SimpleNamespace(**{
+        name: types.SimpleNamespace(data=da.from_array(x, chunks=(chunks,) + x.shape[1:]))
+        for name, x in columns.items()
+    })
+
+
+class TestMsHelper(unittest.TestCase):
+
+    def test_quota_total(self):
+        counts = np.array([100, 0, 37, 512, 3])
+        for total in [1, 10, 99, 500, 651]:
+            quota = allocate_quota(counts, total)
+            self.assertEqual(np.sum(quota), total)
+            self.assertTrue(np.all(quota <= counts))
+            self.assertEqual(quota[1], 0)
+
+    def test_quota_proportional(self):
+        counts = np.array([1000, 2000, 1000])
+        quota = allocate_quota(counts, 400)
+        self.assertTrue(np.array_equal(quota, [100, 200, 100]))
+
+    def test_quota_all_rows(self):
+        counts = np.array([10, 20, 5])
+        quota = allocate_quota(counts, 1000)
+        self.assertTrue(np.array_equal(quota, counts))
+
+    def test_time_slices(self):
+        times = np.repeat(np.arange(10.0), 3)   # 10 integrations of 3 rows
+        self.assertEqual(time_slices(times), [(0, 30)])
+        self.assertEqual(time_slices(times, 1.0), [(3*i, 3*i + 3) for i in range(10)])
+        self.assertEqual(time_slices(times, 4.0), [(0, 12), (12, 24), (24, 30)])
+        self.assertEqual(time_slices([], 4.0), [])
+
+        with self.assertRaises(ValueError):
+            time_slices(times, 0.0)
+
+    def test_combine_datasets(self):
+        def part(n, frequency):
+            return {"ms": "test.ms", "field_id": 0, "frequency": frequency,
+                    "phase_dir": np.array([0.1, -0.5]), "epoch_seconds": 5e9 + frequency*1e-9,
+                    "uvw": np.random.normal(0, 10, (n, 3)), "vis": np.random.normal(0, 1, n) + 0j,
+                    "rms": np.ones(n), "indices": np.arange(n)}
+
+        parts = [part(5, 2e9), part(3, 1e9)]
+        rows, row_frequency = combine_datasets(parts)
+        u, v, w, frequency, vis, hdr, timestamp, rms, indices = rows
+
+        self.assertEqual(frequency, 1e9)
+        self.assertEqual(u.shape, (8,))
+        self.assertTrue(np.allclose(row_frequency, [2e9]*5 + [1e9]*3))
+
+        # The phase u*f is unchanged at the reference frequency.
+        self.assertTrue(np.allclose(u[0:5]*frequency, parts[0]["uvw"][:, 0]*2e9))
+        self.assertTrue(np.allclose(w[5:], parts[1]["uvw"][:, 2]))
+
+    def test_smearing_limits(self):
+        res = Resolution.from_deg(1.0)
+        dt, df = smearing_limits(res, 1.5e9, fraction=0.5)
+        self.assertAlmostEqual(dt * OMEGA_EARTH, 0.5 * res.radians())
+        self.assertAlmostEqual(df / 1.5e9, 0.5 * res.radians())
+
+    def test_average(self):
+        # Two baselines, six integrations 2 seconds apart, averaged in 6 second windows
+        time = np.repeat(np.arange(6) * 2.0, 2)
+        ant1 = np.zeros(12, dtype=int)
+        ant2 = np.tile([1, 2], 6)
+        unit = average_groups(time, ant1, ant2, 6.0)
+        self.assertEqual(np.max(unit) + 1, 4)
+        self.assertEqual(unit[0], unit[4])
+        self.assertNotEqual(unit[0], unit[1])
+        self.assertNotEqual(unit[0], unit[6])
+
+        uvw = np.random.normal(0, 1, (12, 3))
+        data = (np.random.normal(0, 1, (12, 1, 1)) + 1.0j*np.random.normal(0, 1, (12, 1, 1))).astype(np.complex64)
+        sigma = np.random.uniform(1, 2, (12, 1)).astype(np.float32)
+
+        chosen = np.array([unit[0], unit[7]])
+        a_uvw, a_vis, a_sigma, first = average_units(unit, chosen, uvw, data, sigma)
+        self.assertEqual(a_vis.shape, (2, 1, 1))
+
+        rows = np.flatnonzero(unit == unit[0])
+        w = 1.0 / sigma[rows, 0].astype(np.float64)**2
+        self.assertTrue(np.allclose(a_vis[0, 0, 0], np.sum(w * data[rows, 0, 0]) / np.sum(w)))
+        self.assertTrue(np.allclose(a_sigma[0, 0], 1.0 / np.sqrt(np.sum(w))))
+        self.assertTrue(np.allclose(a_uvw[0], np.mean(uvw[rows], axis=0)))
+        self.assertEqual(first[0], rows[0])
+
+    def test_stream_time_slices(self):
+        times = 5e9 + np.repeat(np.arange(10.0), 3)
+        for interval in [None, 1.0, 4.0]:
+            expected = time_slices(times, interval)
+            for chunks in [1, 4, 7, 30]:
+                ds = fake_dataset(times, times, times, chunks)
+                slices = list(stream_time_slices(ds, interval))
+                self.assertEqual([(a, b) for a, b, t in slices], expected)
+                self.assertEqual([t for a, b, t in slices], [times[a] for a, b in expected])
+
+    def test_average_chunks(self):
+        # The averages do not depend on the row chunks
+        time = np.repeat(np.arange(12) * 2.0, 3)
+        ant1 = np.zeros(36, dtype=int)
+        ant2 = np.tile([1, 2, 3], 12)
+        results = []
+        for chunks in [4, 9, 36]:
+            ds = fake_dataset(time, ant1, ant2, chunks)
+            results.append(sample_rows(ds, 100, 1e3, slice(0, 1), [0], max_dt=6.0))
+
+        uvw, vis, sigma, rows = results[-1]
+        self.assertEqual(rows.shape[0], 12)
+        for r in results:
+            order, expected = np.argsort(r[3]), np.argsort(rows)
+            for x, y in zip(r, results[-1]):
+                self.assertTrue(np.allclose(x[order], y[expected]))
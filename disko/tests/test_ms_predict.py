@@ -0,0 +1,98 @@
+#
+# Copyright Tim Molteno 2019 tim@elec.ac.nz
+#
+
+import os
+import tempfile
+import unittest
+import logging
+
+import numpy as np
+import casacore.tables as pt
+
+from disko import DiSkO, HealpixSubSphere
+from disko.ms_predict import predict_block, write_model_data
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler()) # Add a null handler so logs can go somewhere
+LOGGER.setLevel(logging.INFO)
+
+
+def make_ms(path, n_row=40, n_chan=2, n_corr=2, n_field=2, n_spw=2):
+    ''' A small measurement set, whose rows cycle through the fields and spectral windows '''
+    rng = np.random.default_rng(0)
+    pt.default_ms(path).close()
+
+    with pt.table(os.path.join(path, "FIELD"), readonly=False, ack=False) as fld:
+        fld.addrows(n_field)
+        fld.putcol("PHASE_DIR", np.array([[[0.1*(i+1), -0.5]] for i in range(n_field)]))
+    with pt.table(os.path.join(path, "SPECTRAL_WINDOW"), readonly=False, ack=False) as spw:
+        spw.addrows(n_spw)
+        for s in range(n_spw):
+            spw.putcell("CHAN_FREQ", s, 1.5e9 + s*1e8 + np.arange(n_chan)*1e6)
+            spw.putcell("NUM_CHAN", s, n_chan)
+    with pt.table(os.path.join(path, "DATA_DESCRIPTION"), readonly=False, ack=False) as dd:
+        dd.addrows(n_spw)
+        dd.putcol("SPECTRAL_WINDOW_ID", np.arange(n_spw))
+    with pt.table(os.path.join(path, "POLARIZATION"), readonly=False, ack=False) as pol:
+        pol.addrows(1)
+        pol.putcell("NUM_CORR", 0, n_corr)
+        pol.putcell("CORR_TYPE", 0, np.arange(n_corr) + 9)
+
+    with pt.table(path, readonly=False, ack=False) as ms:
+        ms.addcols(pt.makearrcoldesc("DATA", 0j, valuetype="complex", shape=[n_chan, n_corr]))
+        ms.addrows(n_row)
+        ms.putcol("UVW", rng.normal(0, 20, (n_row, 3)))
+        ms.putcol("DATA", np.zeros((n_row, n_chan, n_corr), dtype=np.complex64))
+        ms.putcol("SIGMA", np.ones((n_row, n_corr), dtype=np.float32))
+        ms.putcol("FIELD_ID", np.arange(n_row) % n_field)
+        ms.putcol("DATA_DESC_ID", (np.arange(n_row) // n_field) % n_spw)
+
+
+class TestMsPredict(unittest.TestCase):
+
+    def test_predict_block(self):
+        sphere = HealpixSubSphere.from_resolution(res_arcmin=600,
+                                      theta = np.radians(0.0), phi=0.0, radius_rad=np.radians(60))
+        n_row = 7
+        uvw = np.random.normal(0, 1, (n_row, 3))
+        sigma = np.random.uniform(1, 2, (n_row, 4))
+        sky = np.random.normal(0, 1, sphere.npix)
+        frequencies = np.array([1.5e9, 1.6e9])
+
+        model = predict_block(uvw, sigma, frequencies, sphere, sky, batch=3)
+        self.assertEqual(model.shape, (n_row, 2, 4))
+
+        for k, f in enumerate(frequencies):
+            gamma = DiSkO(uvw[:, 0], uvw[:, 1], uvw[:, 2], f).make_gamma(sphere)
+            vis = gamma @ sky
+            vis = vis[0:n_row] + 1.0j*vis[n_row:]
+            self.assertTrue(np.allclose(model[:, k, 0], vis*sigma[:, 0], rtol=1e-5))
+            self.assertTrue(np.allclose(model[:, k, 3], vis*sigma[:, 3], rtol=1e-5))
+            self.assertTrue(np.allclose(model[:, k, 1:3], 0))
+
+    def test_write_model_selection(self):
+        sphere = HealpixSubSphere.from_resolution(res_arcmin=600,
+                                      theta = np.radians(0.0), phi=0.0, radius_rad=np.radians(60))
+        sky = np.random.normal(0, 1, sphere.npix)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ms = os.path.join(tmpdir, "two_field.ms")
+            make_ms(ms)
+
+            write_model_data(ms, sphere, sky, field_id=1, spws=[1])
+
+            with pt.table(ms, ack=False) as t:
+                model = t.getcol("MODEL_DATA")
+                field = t.getcol("FIELD_ID")
+                spw = t.getcol("DATA_DESC_ID")
+                uvw = t.getcol("UVW")
+                sigma = t.getcol("SIGMA")
+
+        selected = (field == 1) & (spw == 1)
+        frequencies = 1.6e9 + np.arange(2)*1e6
+        expected = predict_block(uvw[selected], sigma[selected], frequencies, sphere, sky)
+
+        self.assertTrue(np.allclose(model[selected], expected, rtol=1e-4))
+        # The other field and spectral window are not written
+        self.assertTrue(np.allclose(model[~selected], 0))
@@ -72,3 +72,39 @@ class TestMultivariate(unittest.TestCase):
         
         os.remove(fname)
 
+
+    def test_chunked(self):
+        # The out-of-core operations should match the in-memory ones.
+        D = 23
+        tile = 5
+        mu = np.random.normal(0,1,(D))
+        a = np.random.normal(0,1,(D,D))
+        sigma = a @ a.T
+        A = np.random.normal(0,1,(D,D))
+
+        x = mg.MultivariateGaussian(mu, sigma=sigma)
+        y = mg.ChunkedMultivariateGaussian.from_sigma(mu, sigma, tile=tile)
+
+        self.assertTrue(np.allclose(y.variance(), x.variance()))
+        self.assertTrue(np.allclose(y.covariance_row(3), x.covariance_row(3)))
+
+        x_t = x.linear_transform(A, mu)
+        y_t = y.linear_transform(A, mu)
+        self.assertTrue(np.allclose(y_t.mu, x_t.mu))
+        self.assertTrue(np.allclose(y_t.sigma(), x_t.sigma()))
+
+        x_r = x_t.block(0, 7)
+        x_n = x_t.block(7, D)
+        y_r = y_t.block(0, 7)
+        y_n = y_t.block(7, D)
+        self.assertTrue(np.allclose(y_n.sigma(), x_n.sigma()))
+
+        x_o = mg.MultivariateGaussian.outer(x_r, x_n)
+        y_o = mg.MultivariateGaussian.outer(x_r, y_n)
+        self.assertIsInstance(y_o, mg.ChunkedMultivariateGaussian)
+        self.assertTrue(np.allclose(y_o.mu, x_o.mu))
+        self.assertTrue(np.allclose(y_o.sigma(), x_o.sigma()))
+
+        fname = y_o.filename
+        y_o.close()
+        self.assertFalse(os.path.exists(fname))
@@ -0,0 +1,75 @@
+#
+# Copyright Tim Molteno 2019 tim@elec.ac.nz
+#
+
+import unittest
+import logging
+
+import numpy as np
+
+from disko import MultivariateGaussian, MatrixFreePosterior, StructuredNoiseCovariance
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler()) # Add a null handler so logs can go somewhere
+LOGGER.setLevel(logging.INFO)
+
+class TestNoiseCovariance(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        self.n = 10
+        self.rms = np.random.uniform(0.5, 2.0, self.n)
+        self.sigma = StructuredNoiseCovariance.from_rms(self.rms, correlation=0.5)
+        self.dense = self.sigma.to_dense()
+
+    def test_dense(self):
+        diag = np.diag(self.rms**2)
+        expected = np.block([[diag, 0.5*diag],[0.5*diag, diag]])
+        self.assertTrue(np.allclose(self.dense, expected))
+
+    def test_inv(self):
+        precision = self.sigma.inv()
+        self.assertTrue(np.allclose(precision.to_dense(), np.linalg.inv(self.dense)))
+
+    def test_logdet(self):
+        sign, logdet = np.linalg.slogdet(self.dense)
+        self.assertEqual(sign, 1)
+        self.assertAlmostEqual(self.sigma.logdet(), logdet)
+
+    def test_dot(self):
+        x = np.random.normal(0, 1, 2*self.n)
+        X = np.random.normal(0, 1, (2*self.n, 3))
+        self.assertTrue(np.allclose(self.sigma.dot(x), self.dense @ x))
+        self.assertTrue(np.allclose(self.sigma.dot(X), self.dense @ X))
+
+    def test_not_positive_definite(self):
+        with self.assertRaises(ValueError):
+            StructuredNoiseCovariance.from_rms(self.rms, correlation=1.0)
+
+    def test_perturb(self):
+        precision = self.sigma.inv()
+        mu = np.random.normal(0, 1, 2*self.n)
+        N = 20000
+        samples = np.array([precision.perturb(mu) for i in range(N)])
+
+        Q = precision.to_dense()
+        self.assertTrue(np.allclose(np.mean(samples, axis=0), Q @ mu, atol=0.1))
+        self.assertTrue(np.allclose(np.cov(samples.T), Q, atol=0.1))
+
+    def test_bayes_update(self):
+        n_s = 6
+        A = np.random.normal(0, 1, (2*self.n, n_s))
+        y = np.random.normal(0, 1, 2*self.n)
+        prior = MultivariateGaussian(np.zeros(n_s) + 0.3, sigma=2.0*np.identity(n_s))
+
+        precision = self.sigma.inv()
+        expected = prior.bayes_update(precision.to_dense(), y, A)
+        posterior = prior.bayes_update(precision, y, A)
+
+        self.assertTrue(np.allclose(posterior.mu, expected.mu))
+        self.assertTrue(np.allclose(posterior.sigma(), expected.sigma()))
+
+        # The matrix-free posterior accepts the same noise precision.
+        mf = MatrixFreePosterior(A, y, noise_precision=precision,
+                                 prior_mu=0.3, prior_precision=0.5, tol=1e-12)
+        self.assertTrue(np.allclose(mf.mu, expected.mu))
@@ -185,3 +185,77 @@ class TestPylopsOperator(unittest.TestCase):
         self.assertTrue(np.allclose(vis1, vis2))
 
         
+
+    def test_pylops_cube(self):
+        r'''
+            A cube of several frequencies and correlations is the stack of the
+            single frequency gamma matrices, copied to each correlation.
+        '''
+        sphere = HealpixSubSphere.from_resolution(res_arcmin=600,
+                                      theta = np.radians(0.0), phi=0.0, radius_rad=np.radians(60))
+        n_vis = 4
+        n_pol = 2
+        frequencies = [1.4e9, 1.5e9, 1.6e9]
+        u, v, w = [np.random.uniform(0,1, n_vis) for i in range(3)]
+
+        gammas = [DiSkO(u, v, w, f).make_gamma(sphere) for f in frequencies]
+        G = np.stack(gammas, axis=1)                          # [n_v*2, n_freq, npix]
+        G = np.repeat(G[:, :, None, :], n_pol, axis=2).reshape(-1, sphere.npix)
+
+        data = np.zeros((2*n_vis, len(frequencies), n_pol))
+        Op = disko.DiSkOOperator(u, v, w, data, frequencies, sphere)
+        self.assertEqual(Op.shape, G.shape)
+
+        sky = np.random.normal(0,1, sphere.npix)
+        self.assertTrue(np.allclose(Op @ sky, G @ sky))
+
+        y = np.random.normal(0,1, Op.shape[0])
+        self.assertTrue(np.allclose(Op.H @ y, G.T @ y))
+
+        X = np.random.normal(0, 1, (sphere.npix, 3))
+        Y = np.random.normal(0, 1, (Op.shape[0], 3))
+        self.assertTrue(np.allclose(Op @ X, G @ X))
+        self.assertTrue(np.allclose(Op.H @ Y, G.T @ Y))
+
+        dottest(Op, Op.shape[0], Op.shape[1], 1e-6)
+
+        # The direct imaging operator is the adjoint
+        Op_di = disko.DirectImagingOperator(u, v, w, data, frequencies, sphere)
+        self.assertTrue(np.allclose(Op_di @ y, G.T @ y))
+
+        with self.assertRaises(RuntimeError):
+            disko.DiSkOOperator(u, v, w, data, frequencies[0:1], sphere)
+
+
+class TestOperatorHarmonic(unittest.TestCase):
+
+    def test_conjugate_harmonic(self):
+        r'''
+            The operator uses the conjugate harmonic exp(-2 pi j (ul + vm + w(n-1)) / lambda),
+            in A(i, j) and in matvec, and its adjoint is rmatvec.
+        '''
+        sphere = HealpixSubSphere.from_resolution(res_arcmin=600,
+                                      theta = np.radians(0.0), phi=0.0, radius_rad=np.radians(60))
+        n_vis = 4
+        frequency = 1.5e9
+        wavelength = 2.99793e8 / frequency
+        u, v, w = [np.random.uniform(-2, 2, n_vis) for i in range(3)]
+
+        phase = np.outer(u, sphere.l) + np.outer(v, sphere.m) + np.outer(w, sphere.n_minus_1)
+        h = np.exp(-2.0j*np.pi*phase/wavelength) * sphere.pixel_areas
+        G = np.block([[np.real(h)], [np.imag(h)]])
+
+        data = np.zeros((2*n_vis, 1, 1))
+        Op = disko.DiSkOOperator(u, v, w, data, [frequency], sphere)
+
+        p2j = 2*np.pi*1.0j / wavelength
+        for i in range(Op.M):
+            for j in range(Op.N):
+                self.assertAlmostEqual(Op.A(i, j, p2j), G[i, j])
+
+        sky = np.random.normal(0, 1, sphere.npix)
+        self.assertTrue(np.allclose(Op.matvec(sky), G @ sky))
+
+        y = np.random.normal(0, 1, 2*n_vis)
+        self.assertTrue(np.allclose(Op.rmatvec(y), G.T @ y))
+        dottest(Op, Op.M, Op.N, 1e-6)
@@ -0,0 +1,72 @@
+#
+# Copyright Tim Molteno 2019 tim@elec.ac.nz
+#
+
+import unittest
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+from scipy.interpolate import griddata
+
+from disko import HealpixSubSphere
+from disko.reproject import Reprojection, sphere_lm, grid_lm
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler()) # Add a null handler so logs can go somewhere
+LOGGER.setLevel(logging.INFO)
+
+class TestReproject(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.sphere = HealpixSubSphere.from_resolution(res_arcmin=300, theta=0.0, phi=0.0, radius_rad=np.radians(60))
+        Reprojection._memory.clear()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_same_as_griddata(self):
+        pixels = np.random.normal(0, 1, self.sphere.npix)
+        grid = Reprojection.from_sphere(self.sphere, 120, 100)(pixels)
+
+        xx, yy = grid_lm(self.sphere, 120, 100)
+        expected = griddata(sphere_lm(self.sphere), pixels, (xx, yy), method="linear")
+        self.assertEqual(grid.shape, (100, 120))
+        # The corners of the grid are outside the convex hull of the pixels
+        self.assertTrue(np.any(np.isnan(expected)))
+        self.assertTrue(np.array_equal(np.isnan(grid), np.isnan(expected)))
+        ok = ~np.isnan(expected)
+        self.assertTrue(np.allclose(grid[ok], expected[ok], atol=1e-5))
+
+    def test_to_fits(self):
+        from astropy.io import fits
+
+        self.sphere.pixels = np.random.normal(0, 1, self.sphere.npix)
+        xx, yy = grid_lm(self.sphere, 2000, 2000)
+        for method in ["linear", "cubic"]:
+            fname = os.path.join(self.tmp.name, "{}.fits".format(method))
+            if method == "cubic":
+                self.sphere.to_fits(fname)  # The default
+            else:
+                self.sphere.to_fits(fname, method=method)
+            image = fits.getdata(fname)
+            expected = griddata(sphere_lm(self.sphere), self.sphere.pixels, (xx, yy), method=method)
+            self.assertTrue(np.array_equal(np.isnan(image), np.isnan(expected)))
+            ok = ~np.isnan(expected)
+            self.assertTrue(np.allclose(image[ok], expected[ok], atol=1e-5))
+
+    def test_cache(self):
+        a = Reprojection.from_sphere(self.sphere, 50, 50, cache=self.tmp.name)
+        self.assertIs(Reprojection.from_sphere(self.sphere, 50, 50), a)
+        self.assertEqual(len(os.listdir(self.tmp.name)), 1)
+
+        Reprojection._memory.clear()
+        b = Reprojection.from_sphere(self.sphere, 50, 50, cache=self.tmp.name)
+        self.assertIsNot(a, b)
+        self.assertEqual((a.weights != b.weights).nnz, 0)
+
+        c = Reprojection.from_sphere(self.sphere, 60, 50, cache=self.tmp.name)
+        self.assertEqual(c.weights.shape, (3000, self.sphere.npix))
@@ -0,0 +1,61 @@
+#
+# Copyright Tim Molteno 2019 tim@elec.ac.nz
+#
+
+import unittest
+import logging
+
+import numpy as np
+
+from disko.subsample import uvw_bins, water_fill, stratified_choice, leverage_scores, leverage_choice
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler()) # Add a null handler so logs can go somewhere
+LOGGER.setLevel(logging.INFO)
+
+class TestSubsample(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        # Dense short baselines, and a few long ones
+        self.uvw = np.concatenate((np.random.normal(0, 1, (900, 3)),
+                                   np.random.uniform(-10, 10, (100, 3))))
+
+    def test_water_fill(self):
+        counts = np.array([100, 3, 0, 50, 7])
+        quota = water_fill(counts, 40)
+        self.assertEqual(np.sum(quota), 40)
+        self.assertTrue(np.array_equal(quota, [15, 3, 0, 15, 7]))
+        self.assertTrue(np.array_equal(water_fill(counts, 1000), counts))
+
+    def test_bins(self):
+        bins = uvw_bins(np.array([[-1.0, -1.0, -1.0], [0.99, 0.99, 0.99], [5.0, 0.0, -5.0]]), 1.0, 4)
+        self.assertEqual(bins[0], 0)
+        self.assertEqual(bins[1], 63)
+        self.assertEqual(bins[2], (3*4 + 2)*4 + 0)
+
+    def test_stratified(self):
+        n = 100
+        a = stratified_choice(self.uvw, n, 10.0, seed=1)
+        b = stratified_choice(self.uvw, n, 10.0, seed=1)
+        self.assertEqual(a.shape, (n,))
+        self.assertEqual(np.unique(a).shape, (n,))
+        self.assertTrue(np.array_equal(a, b))
+
+        # The long baselines are over-represented compared with random sampling
+        self.assertGreater(np.sum(a >= 900), 10*n/100)
+
+    def test_leverage(self):
+        A = np.random.normal(0, 1, (30, 6))
+        scores = leverage_scores(A)
+        H = A @ np.linalg.pinv(A)
+        self.assertTrue(np.allclose(scores, np.diag(H)))
+        self.assertAlmostEqual(np.sum(scores), 6)
+
+        chosen = leverage_choice(scores, 10, seed=3)
+        self.assertEqual(np.unique(chosen).shape, (10,))
+        self.assertTrue(np.array_equal(chosen, leverage_choice(scores, 10, seed=3)))
+
+        scores[0:25] = 0
+        chosen = leverage_choice(scores, 8, seed=3)
+        self.assertTrue(np.all(np.isin(np.arange(25, 30), chosen)))
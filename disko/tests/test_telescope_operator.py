@@ -5,11 +5,13 @@
 import unittest
 import logging
 import json
+import os
+import tempfile
 
 import numpy as np
 
 #from spotless import sphere
-from disko import TelescopeOperator, HealpixSphere, DiSkO, normal_svd, dask_svd
+from disko import TelescopeOperator, HealpixSphere, DiSkO, NaturalPosterior, normal_svd, dask_svd
 
 from tart.operation import settings
 from tart_tools import api_imaging
@@ -239,3 +241,43 @@ class TestTelescopeOperator(unittest.TestCase):
 
         
         
+
+    def test_natural_posterior(self):
+        sky = self.get_point_sky()
+        vis = np.array(self.to.gamma @ sky).flatten()
+
+        prior = self.to.get_prior() # in the image space.
+        sigma_precision = 1e6*np.identity(self.to.n_v)
+
+        posterior = self.to.natural_inference(prior, vis, sigma_precision)
+        dense = posterior.to_multivariate()
+
+        self.assertTrue(np.allclose(posterior.mu, dense.mu))
+        self.assertTrue(np.allclose(posterior.variance(), dense.variance()))
+        self.assertTrue(np.allclose(posterior.covariance_row(1), dense.covariance_row(1)))
+
+        # A second update with the same operator stays in the natural basis
+        posterior_2 = self.to.natural_inference(posterior, vis, sigma_precision)
+        self.assertIs(posterior_2.prior_n, posterior.prior_n)
+
+    def test_natural_posterior_hdf5(self):
+        sky = self.get_point_sky()
+        vis = np.array(self.to.gamma @ sky).flatten()
+
+        prior = self.to.get_prior()
+        sigma_precision = 1e6*np.identity(self.to.n_v)
+        posterior = self.to.natural_inference(prior, vis, sigma_precision)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'posterior.h5')
+            posterior.to_hdf5(fname)
+            self.assertTrue(NaturalPosterior.is_hdf5(fname))
+            loaded = NaturalPosterior.from_hdf5(fname)
+
+        self.assertEqual(loaded.rank, posterior.rank)
+        self.assertTrue(np.allclose(loaded.mu, posterior.mu))
+        self.assertTrue(np.allclose(loaded.variance(), posterior.variance()))
+        self.assertTrue(np.allclose(loaded.covariance_row(1), posterior.covariance_row(1)))
+
+        # The loaded posterior is the prior for the next step without a transform
+        self.assertTrue(loaded.in_basis_of(self.to))
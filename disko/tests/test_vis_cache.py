@@ -0,0 +1,80 @@
+#
+# Copyright Tim Molteno 2019 tim@elec.ac.nz
+#
+
+import unittest
+import logging
+import os
+import tempfile
+import datetime
+
+import numpy as np
+
+from disko.vis_cache import VisibilityCache, cache_key
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler()) # Add a null handler so logs can go somewhere
+LOGGER.setLevel(logging.INFO)
+
+class TestVisibilityCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.ms = os.path.join(self.tmp.name, "test.ms")
+        os.makedirs(self.ms)
+        with open(os.path.join(self.ms, "table.f0"), "w") as f:
+            f.write("data")
+        os.makedirs(os.path.join(self.ms, "ANTENNA"))
+        with open(os.path.join(self.ms, "ANTENNA", "table.f0"), "w") as f:
+            f.write("antennas")
+
+        n = 20
+        self.rows = (np.random.normal(0, 1, n), np.random.normal(0, 1, n), np.random.normal(0, 1, n),
+                     1.5e9, np.random.normal(0, 1, n) + 1.0j*np.random.normal(0, 1, n),
+                     {"CRVAL1": np.float64(12.5), "CTYPE1": ("RA---SIN", "Right ascension angle cosine")},
+                     datetime.datetime(2021, 3, 4, 5, 6, 7, tzinfo=datetime.timezone.utc),
+                     np.random.uniform(1, 2, n), np.arange(n))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        cache = VisibilityCache(os.path.join(self.tmp.name, "cache"))
+        key = cache_key(self.ms, num_vis=20, channel=0)
+        self.assertIsNone(cache.load(key))
+
+        calls = []
+        def read():
+            calls.append(1)
+            return self.rows
+
+        cache.get(key, read)
+        rows = cache.get(key, read)
+        self.assertEqual(len(calls), 1)
+
+        for a, b in zip(rows, self.rows):
+            if isinstance(b, np.ndarray):
+                self.assertTrue(np.array_equal(a, b))
+            else:
+                self.assertEqual(a, b)
+
+    def test_key(self):
+        key = cache_key(self.ms, num_vis=20, channel=0)
+        self.assertEqual(key, cache_key(self.ms, channel=0, num_vis=20))
+        self.assertNotEqual(key, cache_key(self.ms, num_vis=20, channel=1))
+
+        # Modifying the measurement set changes the key
+        fname = os.path.join(self.ms, "table.f0")
+        st = os.stat(fname)
+        os.utime(fname, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.assertNotEqual(key, cache_key(self.ms, num_vis=20, channel=0))
+
+    def test_subtable_modified(self):
+        cache = VisibilityCache(os.path.join(self.tmp.name, "cache"))
+        cache.get(cache_key(self.ms, num_vis=20, channel=0), lambda: self.rows)
+
+        # Modifying a file of a subtable is a cache miss
+        fname = os.path.join(self.ms, "ANTENNA", "table.f0")
+        st = os.stat(fname)
+        os.utime(fname, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.assertIsNone(cache.load(cache_key(self.ms, num_vis=20, channel=0)))
@@ -0,0 +1,130 @@
+#
+# A cache of the visibilities read from measurement sets.
+#
+# Reading a measurement set opens several casacore tables and streams the UVW,
+# FLAG, SIGMA and DATA columns. The selected visibilities are small, so they are
+# saved to an HDF5 file keyed by the measurement set path, its modification time
+# and the selection parameters, and later runs load them directly.
+#
+import os
+import json
+import hashlib
+import logging
+import datetime
+
+import h5py
+import numpy as np
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    logging.NullHandler()
+)  # Add other handlers if you're using this as a library
+logger.setLevel(logging.INFO)
+
+
+def ms_mtime(ms):
+    """
+    The latest modification time (ns) of any directory or file in the measurement
+    set, including its subtables (ANTENNA, FIELD, SPECTRAL_WINDOW ...).
+    """
+    mtime = os.stat(ms).st_mtime_ns
+    for root, dirs, files in os.walk(ms):
+        for name in dirs + files:
+            mtime = max(mtime, os.stat(os.path.join(root, name)).st_mtime_ns)
+    return mtime
+
+
+def cache_key(ms, **params):
+    """
+    A key for the visibilities selected from the measurement set ms with params.
+    The key changes if the measurement set is modified.
+    """
+    desc = {"ms": os.path.abspath(ms), "mtime": ms_mtime(ms)}
+    desc.update(params)
+    return hashlib.sha1(json.dumps(desc, sort_keys=True).encode()).hexdigest()
+
+
+def _to_json(x):
+    if isinstance(x, np.generic):
+        return x.item()
+    raise TypeError("Cannot encode {}".format(type(x)))
+
+
+def info_to_json(info):
+    """
+    Encode the info (FITS header) dictionary of a DiSkO object as JSON
+    """
+    return json.dumps(info, default=_to_json)
+
+
+def info_from_json(s):
+    """
+    Decode an info dictionary written by info_to_json. Lists become tuples again.
+    """
+    return {
+        k: tuple(v) if isinstance(v, list) else v
+        for k, v in json.loads(s).items()
+    }
+
+
+class VisibilityCache:
+    """
+    A directory of HDF5 files, each holding the read_ms results for one key.
+    """
+
+    FIELDS = ["u_arr", "v_arr", "w_arr", "cv_vis", "rms", "indices"]
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, "{}.h5".format(key))
+
+    def load(self, key):
+        """
+        Return the read_ms tuple for key, or None if it is not in the cache
+        """
+        fname = self.path(key)
+        if not os.path.exists(fname):
+            return None
+
+        logger.info("Loading visibilities from cache {}".format(fname))
+        with h5py.File(fname, "r") as h5f:
+            u_arr, v_arr, w_arr, cv_vis, rms, indices = [
+                h5f[name][:] for name in self.FIELDS
+            ]
+            frequency = h5f.attrs["frequency"]
+            hdr = info_from_json(h5f.attrs["info"])
+            timestamp = datetime.datetime.fromisoformat(h5f.attrs["timestamp"])
+
+        return u_arr, v_arr, w_arr, frequency, cv_vis, hdr, timestamp, rms, indices
+
+    def save(self, key, rows):
+        """
+        Save the read_ms tuple rows. The file is written under a temporary name
+        and then renamed, so a partial file is never loaded.
+        """
+        u_arr, v_arr, w_arr, frequency, cv_vis, hdr, timestamp, rms, indices = rows
+        fname = self.path(key)
+        tmp = "{}.{}.tmp".format(fname, os.getpid())
+
+        with h5py.File(tmp, "w") as h5f:
+            for name, x in zip(self.FIELDS, [u_arr, v_arr, w_arr, cv_vis, rms, indices]):
+                h5f.create_dataset(name, data=x)
+            h5f.attrs["frequency"] = frequency
+            h5f.attrs["info"] = info_to_json(hdr)
+            h5f.attrs["timestamp"] = timestamp.isoformat()
+
+        os.replace(tmp, fname)
+        logger.info("Saved visibilities to cache {}".format(fname))
+
+    def get(self, key, read):
+        """
+        Return the cached tuple for key, calling read() to create it if needed
+        """
+        rows = self.load(key)
+        if rows is None:
+            rows = read()
+            self.save(key, rows)
+        return rows